@@ -1,12 +1,57 @@
+from collections import Counter
+from collections.abc import Iterable
+from datetime import UTC, datetime, timedelta
 import logging
+import os
+import time
 
+import mu
+
+from critic.libs.ddb import get_executor
 from critic.libs.mailgun import send_email
 from critic.libs.slack import post_message, post_webhook
-from critic.models import MonitorState, UptimeMonitorModel
+from critic.models import AlertChannel, AlertModel, MonitorState, UptimeMonitorModel
+from critic.tables import AlertOutboxTable
 
 
 log = logging.getLogger(__name__)
 
+# Tries at sending an alert in one delivery, with exponential backoff between them
+ALERT_SEND_ATTEMPTS = 3
+ALERT_RETRY_BASE_SECS = 0.5
+# Failed deliveries before an alert is given up on. Each sweep (once a minute) retries it.
+MAX_ALERT_DELIVERIES = 10
+# How long a sender holds an alert before another may take it over. Must cover every try.
+ALERT_LEASE_SECS = 120
+# How long sent alerts are kept, so the same alert can't be queued again
+ALERT_RETENTION = timedelta(days=7)
+# Alerts sent at once
+ALERT_SEND_CONCURRENCY = 8
+# Destinations whose digests are waited on at once outside Lambda. Others wait for a free thread.
+DIGEST_SENDERS = 32
+# With the outbox, alerts to a destination are held until none have been queued for this long and
+# then sent as one digest. 0 sends each alert on its own.
+DEFAULT_DIGEST_WINDOW_SECS = 0
+# No alert is held longer than this waiting for its digest's window to close
+DEFAULT_DIGEST_MAX_DELAY_SECS = 60
+# Alerts listed in one digest, the rest are counted
+DIGEST_MAX_LINES = 50
+
+
+def outbox_enabled() -> bool:
+    """Queue alerts to send them outside the check (CRITIC_ALERT_OUTBOX=1), see queue_alerts()."""
+    return os.environ.get('CRITIC_ALERT_OUTBOX') == '1'
+
+
+def digest_window_secs() -> float:
+    return float(os.environ.get('CRITIC_ALERT_DIGEST_SECS', DEFAULT_DIGEST_WINDOW_SECS))
+
+
+def digest_max_delay_secs() -> float:
+    return float(
+        os.environ.get('CRITIC_ALERT_DIGEST_MAX_DELAY_SECS', DEFAULT_DIGEST_MAX_DELAY_SECS)
+    )
+
 
 def _monitor_url(monitor: UptimeMonitorModel) -> str:
     return str(monitor.url)
@@ -16,14 +61,20 @@ def _monitor_label(monitor: UptimeMonitorModel) -> str:
     return f'{monitor.project_id}/{monitor.slug}'
 
 
+def _send(channel: AlertChannel, dest: str, subject: str, text: str) -> None:
+    if channel == AlertChannel.email:
+        send_email(dest, subject, text)
+    # If it looks like a webhook, use webhook mode otherwise treat as channel id/name.
+    elif dest.startswith(('http://', 'https://')):
+        post_webhook(dest, text)
+    else:
+        post_message(dest, text)
+
+
 def _send_slack(monitor: UptimeMonitorModel, text: str) -> None:
     for dest in monitor.alert_slack_channels:
         try:
-            # If it looks like a webhook, use webhook mode otherwise treat as channel id/name.
-            if dest.startswith(('http://', 'https://')):
-                post_webhook(dest, text)
-            else:
-                post_message(dest, text)
+            _send(AlertChannel.slack, dest, '', text)
         except Exception as e:
             log.exception(f'Failed to send Slack alert to {dest}: {e}')
 
@@ -31,32 +82,25 @@ def _send_slack(monitor: UptimeMonitorModel, text: str) -> None:
 def _send_email(monitor: UptimeMonitorModel, subject: str, text: str) -> None:
     for email in monitor.alert_emails:
         try:
-            send_email(email, subject, text)
+            _send(AlertChannel.email, email, subject, text)
         except Exception as e:
             log.exception(f'Failed to send email alert to {email}: {e}')
 
 
-def maybe_send_alerts(
-    *,
-    monitor: UptimeMonitorModel,
-    prev_state: MonitorState,
-    prev_consecutive_fails: int,
-) -> None:
+def _alert_message(
+    monitor: UptimeMonitorModel, prev_state: MonitorState, prev_consecutive_fails: int
+) -> tuple[str, str, str] | None:
+    """The kind, subject and text of the alert the state change calls for, if any."""
     # Decide whether to send alerts based on state transitions and fail thresholds.
     if monitor.state == MonitorState.paused:
-        return
+        return None
 
     label = _monitor_label(monitor)
     url = _monitor_url(monitor)
 
     # Recovery
     if prev_state == MonitorState.down and monitor.state == MonitorState.up:
-        subject = f'CRITIC RECOVERY: {label}'
-        text = f'Recovered: {label}\nURL: {url}'
-        log.info(f'Sending recovery alert for {label}')
-        _send_slack(monitor, text)
-        _send_email(monitor, subject, text)
-        return
+        return 'recovery', f'CRITIC RECOVERY: {label}', f'Recovered: {label}\nURL: {url}'
 
     # Down alert
     if (
@@ -66,13 +110,271 @@ def maybe_send_alerts(
         crossed_threshold = prev_consecutive_fails < monitor.failures_before_alerting
         became_down = prev_state != MonitorState.down
         if crossed_threshold or became_down:
-            subject = f'CRITIC DOWN: {label}'
             text = (
                 f'Down: {label}\n'
                 f'URL: {url}\n'
                 f'Consecutive fails: {monitor.consecutive_fails} '
                 f'(threshold: {monitor.failures_before_alerting})'
             )
-            log.info(f'Sending down alert for {label}')
-            _send_slack(monitor, text)
-            _send_email(monitor, subject, text)
+            return 'down', f'CRITIC DOWN: {label}', text
+    return None
+
+
+def maybe_send_alerts(
+    *,
+    monitor: UptimeMonitorModel,
+    prev_state: MonitorState,
+    prev_consecutive_fails: int,
+) -> None:
+    message = _alert_message(monitor, prev_state, prev_consecutive_fails)
+    if message is None:
+        return
+    kind, subject, text = message
+    log.info(f'Sending {kind} alert for {_monitor_label(monitor)}')
+    if outbox_enabled():
+        queue_alerts(monitor, kind, subject, text)
+        return
+    _send_slack(monitor, text)
+    _send_email(monitor, subject, text)
+
+
+def queue_alerts(
+    monitor: UptimeMonitorModel, kind: str, subject: str, text: str
+) -> list[AlertModel]:
+    """
+    Write the alert for each of the monitor's destinations to the outbox and hand them to a
+    sender. Returns the alerts queued (none if they already were).
+    """
+    now = datetime.now(UTC)
+    destinations = [(AlertChannel.slack, dest) for dest in monitor.alert_slack_channels] + [
+        (AlertChannel.email, dest) for dest in monitor.alert_emails
+    ]
+    alerts = [
+        AlertModel(
+            id=f'{monitor.id}/{monitor.next_due_at.isoformat()}/{kind}/{channel.value}/{dest}',
+            channel=channel,
+            destination=dest,
+            kind=kind,
+            subject=subject,
+            text=text,
+            created_at=now,
+            pending=AlertModel.pending_key(channel, dest),
+            expires_at=int((now + ALERT_RETENTION).timestamp()),
+        )
+        for channel, dest in destinations
+    ]
+    if not alerts:
+        return []
+    if not AlertOutboxTable.enqueue(alerts):
+        log.info(f'The {kind} alert for {_monitor_label(monitor)} was already queued')
+        return []
+    start_delivery(alerts)
+    return alerts
+
+
+def start_delivery(alerts: list[AlertModel]):
+    """
+    Send the alerts (see deliver_queued()) from another Lambda invocation, or a background thread
+    outside Lambda (e.g. the worker). If that can't start, the next sweep sends them. With digests,
+    start each destination's digest sender instead.
+    """
+    if digest_window_secs() > 0:
+        for channel, destination in dict.fromkeys((a.channel, a.destination) for a in alerts):
+            start_digest(channel, destination)
+        return
+    try:
+        if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+            deliver_alerts.invoke([a.model_dump(mode='json') for a in alerts])
+        else:
+            get_executor('alerts').submit(deliver_queued, alerts)
+    except Exception:
+        log.exception('Failed to start alert delivery, leaving it to the next sweep')
+
+
+def _pending_for(channel: AlertChannel, destination: str) -> list[AlertModel]:
+    """The destination's pending alerts, oldest first."""
+    return list(AlertOutboxTable.pending_for(channel, destination))
+
+
+def _claim(alert: AlertModel) -> bool:
+    now = datetime.now(UTC)
+    return AlertOutboxTable.claim(alert.id, now, now + timedelta(seconds=ALERT_LEASE_SECS))
+
+
+def _send_claimed(alerts: list[AlertModel], subject: str, text: str) -> bool:
+    """
+    Send a message for alerts this sender claimed, retrying with backoff, and release them as sent
+    or failed. Returns True if it was sent.
+    """
+    first = alerts[0]
+    sent = False
+    for attempt in range(ALERT_SEND_ATTEMPTS):
+        if attempt:
+            time.sleep(ALERT_RETRY_BASE_SECS * 2 ** (attempt - 1))
+        try:
+            _send(first.channel, first.destination, subject, text)
+        except Exception as e:
+            log.warning(f'Failed to send alert {first.id} (try {attempt + 1}): {e}')
+            continue
+        sent = True
+        break
+
+    for alert in alerts:
+        if AlertOutboxTable.finish(alert.id, datetime.now(UTC), sent, MAX_ALERT_DELIVERIES):
+            log.error(f'Giving up on alert {alert.id} after {MAX_ALERT_DELIVERIES} deliveries')
+    return sent
+
+
+def deliver(alert: AlertModel) -> bool:
+    """
+    Claim the alert and send it, retrying with backoff. Returns True if it was sent by this call.
+    Alerts that are already sent or held by another sender are skipped.
+    """
+    if not _claim(alert):
+        return False
+    return _send_claimed([alert], alert.subject, alert.text)
+
+
+def digest_message(alerts: list[AlertModel]) -> tuple[str, str]:
+    """The subject and text of one message for several alerts to a destination."""
+    kinds = Counter(a.kind for a in alerts)
+    summary = ', '.join(
+        f'{kinds[kind]} {label}'
+        for kind, label in (('down', 'down'), ('recovery', 'recovered'))
+        if kinds[kind]
+    )
+    lines = [a.subject for a in alerts[:DIGEST_MAX_LINES]]
+    if len(alerts) > DIGEST_MAX_LINES:
+        lines.append(f'...and {len(alerts) - DIGEST_MAX_LINES} more')
+    return f'CRITIC: {summary or f"{len(alerts)} alerts"}', '\n'.join([summary, '', *lines])
+
+
+def _lock_digest(channel: AlertChannel, destination: str, hold_secs: float) -> bool:
+    now = datetime.now(UTC)
+    lease_until = now + timedelta(seconds=hold_secs)
+    return AlertOutboxTable.lock_digest(channel, destination, now, lease_until)
+
+
+def start_digest(channel: AlertChannel, destination: str):
+    """
+    Start the destination's digest sender (see deliver_digest()) like start_delivery() does, unless
+    one is already waiting, in which case it sends the alerts just queued too.
+    """
+    hold_secs = digest_window_secs() + digest_max_delay_secs() + ALERT_LEASE_SECS
+    if not _lock_digest(channel, destination, hold_secs):
+        return
+    try:
+        if os.environ.get('AWS_LAMBDA_FUNCTION_NAME'):
+            deliver_alerts.invoke(None, [channel.value, destination])
+        else:
+            executor = get_executor('alert-digest', max_workers=DIGEST_SENDERS)
+            executor.submit(deliver_digest, channel, destination, True)
+    except Exception:
+        log.exception('Failed to start the digest sender, leaving it to the next sweep')
+        AlertOutboxTable.unlock_digest(channel, destination)
+
+
+def _send_digest(channel: AlertChannel, destination: str, wait: bool) -> tuple[int, set[str]]:
+    """
+    Send the destination's digest once it's due, waiting for it if `wait`. Returns how many alerts
+    were sent and the ids of every pending alert seen.
+    """
+    window = timedelta(seconds=digest_window_secs())
+    max_delay = timedelta(seconds=digest_max_delay_secs())
+    seen: set[str] = set()
+    while True:
+        pending = _pending_for(channel, destination)
+        seen.update(a.id for a in pending)
+        if not pending:
+            return 0, seen
+        send_at = min(pending[-1].created_at + window, pending[0].created_at + max_delay)
+        delay = (send_at - datetime.now(UTC)).total_seconds()
+        if delay <= 0:
+            break
+        if not wait:
+            return 0, seen
+        time.sleep(delay)
+
+    claimed = [a for a in pending if _claim(a)]
+    if not claimed:
+        return 0, seen
+    if len(claimed) == 1:
+        subject, text = claimed[0].subject, claimed[0].text
+    else:
+        subject, text = digest_message(claimed)
+    if not _send_claimed(claimed, subject, text):
+        return 0, seen
+    log.info(f'Sent {len(claimed)} alerts to {destination} in one message')
+    return len(claimed), seen
+
+
+def deliver_digest(channel: AlertChannel, destination: str, locked: bool = False) -> int:
+    """
+    Send the destination's pending alerts as one digest once its window closes: when no alert has
+    been queued for CRITIC_ALERT_DIGEST_SECS, or the oldest has waited
+    CRITIC_ALERT_DIGEST_MAX_DELAY_SECS. Returns how many alerts were sent.
+
+    Each destination has at most one sender, which holds its digest lock (see
+    AlertOutboxTable.lock_digest()). Queuing alerts starts one (`locked`, see start_digest()) only
+    if the destination has none, so a burst of alerts to a destination costs one sender, thread or
+    Lambda invocation. It waits for the window to close and sends one digest, so it's done within
+    the max delay however long alerts keep coming. Alerts queued while it sent theirs start the
+    next sender when it's done, or are left to the sweep if PendingIndex doesn't have them yet.
+
+    Without `locked` (the sweep), only a digest that's already due is sent, and only if no sender is
+    waiting on it, so the sweep never waits.
+    """
+    if locked:
+        # The alerts that started this sender may not be in PendingIndex yet
+        time.sleep(digest_window_secs())
+    elif not _lock_digest(channel, destination, ALERT_LEASE_SECS):
+        return 0
+    try:
+        sent, seen = _send_digest(channel, destination, wait=locked)
+    finally:
+        AlertOutboxTable.unlock_digest(channel, destination)
+    # Their queue_alerts() found this sender holding the lock
+    if locked and any(a.id not in seen for a in _pending_for(channel, destination)):
+        start_digest(channel, destination)
+    return sent
+
+
+def deliver_all(alerts: Iterable[AlertModel]) -> int:
+    """Send the alerts concurrently on pooled clients. Returns how many were sent."""
+    executor = get_executor('alert-send', max_workers=ALERT_SEND_CONCURRENCY)
+    return sum(executor.map(deliver, alerts))
+
+
+def deliver_queued(alerts: list[AlertModel]) -> int:
+    """Send alerts a check just queued, each on its own. Returns how many were sent."""
+    return deliver_all(alerts)
+
+
+def deliver_pending() -> int:
+    """
+    Send every alert in the outbox that's waiting (e.g. failed before, or never started). With
+    digests, send each destination's digest that's due and has no sender waiting on it.
+    """
+    pending = AlertOutboxTable.pending()
+    if digest_window_secs() <= 0:
+        return deliver_all(pending)
+    destinations = {(a.channel, a.destination) for a in pending}
+    executor = get_executor('alert-send', max_workers=ALERT_SEND_CONCURRENCY)
+    return sum(executor.map(lambda d: deliver_digest(*d), destinations))
+
+
+@mu.task
+def deliver_alerts(alerts: list[dict] | None = None, digest: list[str] | None = None):
+    """
+    Sends alerts from the outbox: the ones given (just queued by a check, see deliver_queued()),
+    the digest of the [channel, destination] given (see start_digest()), or every pending one when
+    called with neither (the sweep run_due_checks starts each minute).
+    """
+    if digest is not None:
+        channel, destination = digest
+        sent = deliver_digest(AlertChannel(channel), destination, locked=True)
+    elif alerts is None:
+        sent = deliver_pending()
+    else:
+        sent = deliver_queued([AlertModel.model_validate(a) for a in alerts])
+    log.info(f'Sent {sent} alerts')
@@ -4,6 +4,7 @@ from uuid import UUID
 import click
 
 from critic.libs.assertions import Assertion
+from critic.libs.ddb import gsi_shard_count
 from critic.models import MonitorState, UptimeMonitorModel
 from critic.tables import ProjectTable, UptimeMonitorTable
 
@@ -37,8 +38,8 @@ def put_fake_monitors(project_id: UUID, count: int):
 
     # Create fake monitors
     click.echo(f'Creating {count} fake monitors...')
-    for i in range(count):
-        monitor = UptimeMonitorModel(
+    UptimeMonitorTable.batch_put(
+        UptimeMonitorModel(
             project_id=project_id,
             slug=str(i),
             url='https://google.com',
@@ -48,8 +49,8 @@ def put_fake_monitors(project_id: UUID, count: int):
             assertions=[Assertion(assertion_string='status_code == 301')],
             state=MonitorState.down,
         )
-        UptimeMonitorTable.put(monitor)
-        click.echo(f'  Put monitor: {project_id}/{i}')
+        for i in range(count)
+    )
 
     click.echo(f'Successfully created {count} monitors in project {project_id}')
 
@@ -68,13 +69,23 @@ def del_fake_monitors(project_id: UUID):
     monitors = UptimeMonitorTable.query(project_id)
 
     click.echo(f'Deleting {len(monitors)} monitors from project {project_id}...')
-    for m in monitors:
-        UptimeMonitorTable.delete(project_id, m.slug)
-        click.echo(f'  Deleted monitor: {project_id}/{m.slug}')
+    UptimeMonitorTable.batch_delete((project_id, m.slug) for m in monitors)
 
     click.echo(f'Successfully deleted {len(monitors)} monitors from project {project_id}')
 
 
+@cli.command()
+def reshard_monitors():
+    """
+    Moves monitors to the NextDueIndex shard they belong to under the current CRITIC_GSI_SHARDS.
+    Monitors keep the shard they were stored with, so run this after enabling sharding (existing
+    monitors stay on shard 0 until then) and after lowering the shard count.
+    """
+    click.echo(f'Resharding monitors across {gsi_shard_count()} shards...')
+    moved = UptimeMonitorTable.reshard()
+    click.echo(f'Moved {moved} monitors')
+
+
 if __name__ == '__main__':
     # Allows running CLI commands directly.
     cli()
@@ -1,5 +1,8 @@
 from collections.abc import Callable
+from dataclasses import dataclass
 from enum import Enum
+from functools import cached_property, lru_cache
+import json
 import operator
 import re
 import shlex
@@ -13,11 +16,20 @@ class AssertionSubject(str, Enum):
     """
     This class should take in strings like "status_code < 400" or "body contains 'foo'"
     We can then evaluate operator(<given httpx data field actual value>, expected value)
+
+    Header and JSON subjects also name what to look at: "header content-type contains json" or
+    "json data.status == ok" (see compile_json_path()).
     """
 
     STATUS_CODE = 'status_code'
     BODY = 'body'
     RESPONSE_TIME = 'response_time'
+    HEADER = 'header'
+    JSON = 'json'
+
+    @property
+    def has_target(self) -> bool:
+        return self in (AssertionSubject.HEADER, AssertionSubject.JSON)
 
     def cast(self, value: str) -> Any:
         # Casting logic here is simpler than in the validation method
@@ -25,17 +37,146 @@ class AssertionSubject(str, Enum):
             return int(value)
         elif self == AssertionSubject.RESPONSE_TIME:
             return float(value)
-        elif self == AssertionSubject.BODY:
+        elif self in (AssertionSubject.BODY, AssertionSubject.HEADER):
             return value
+        elif self == AssertionSubject.JSON:
+            # Numbers, true/false/null, etc. compare as their JSON values. Anything else is a
+            # string; quote it in JSON (e.g. '"200"') to compare a string that looks like one.
+            try:
+                return json.loads(value)
+            except ValueError:
+                return value
         else:
             raise ValueError()
 
 
+TARGETED_SUBJECTS = frozenset(s.value for s in AssertionSubject if s.has_target)
+# Subjects that describe the response's content rather than how it was served, so their results
+# hold for as long as the content is unchanged (see evaluate_all())
+CONTENT_SUBJECTS = frozenset(
+    (AssertionSubject.BODY, AssertionSubject.JSON, AssertionSubject.HEADER)
+)
+
+# Distinct assertion strings whose parsed and compiled plans are kept in memory. Well above the
+# number of assertions a worker sees, so each is normally compiled once per warm process.
+PLAN_CACHE_SIZE = 50_000
+
+
+def _search(pattern: str) -> tuple[re.Pattern | None, Callable[[str], bool]]:
+    """
+    Compile the pattern up front. An invalid pattern fails when the assertion is evaluated (like
+    it did before compiling), so monitors saved with one still load.
+    """
+    try:
+        compiled = re.compile(pattern)
+    except re.error as e:
+        error = e
+
+        def check(_actual: str) -> bool:
+            raise error
+
+        return None, check
+    return compiled, lambda actual: compiled.search(actual) is not None
+
+
+class ResponseData:
+    """
+    The response as assertions see it. Anything costly to get from it, like the parsed JSON body,
+    is worked out the first time an assertion needs it and shared by the rest.
+    """
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+
+    @cached_property
+    def _json(self) -> tuple[Any, Exception | None]:
+        try:
+            return self.response.json(), None
+        except ValueError as e:
+            return None, e
+
+    def json(self) -> Any:
+        value, error = self._json
+        if error is not None:
+            raise ValueError(f'Response body is not valid JSON: {error}')
+        return value
+
+
+def _response_time_ms(data: ResponseData) -> float:
+    return data.response.elapsed.total_seconds() * 1000
+
+
+_JSON_PATH_PART = re.compile(r'\.?([^.\[\]]+)|\[(-?\d+)\]')
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def compile_json_path(path: str) -> tuple[str | int, ...]:
+    """
+    Compile a path like `data.items[0].id` (optionally starting with `$.`) into the keys and
+    indexes to follow, raising ValueError if it's invalid.
+    """
+    path = path.removeprefix('$')
+    parts = []
+    pos = 0
+    while pos < len(path):
+        match = _JSON_PATH_PART.match(path, pos)
+        if match is None:
+            raise ValueError(f'Invalid JSON path: {path}')
+        key, index = match.groups()
+        parts.append(key if index is None else int(index))
+        pos = match.end()
+    return tuple(parts)
+
+
+def _json_getter(path: tuple[str | int, ...]) -> Callable[[ResponseData], Any]:
+    """Get the value at the path, or None if it isn't there."""
+
+    def get(data: ResponseData) -> Any:
+        value = data.json()
+        for part in path:
+            if isinstance(part, int) and isinstance(value, list):
+                if not -len(value) <= part < len(value):
+                    return None
+                value = value[part]
+            elif isinstance(part, str) and isinstance(value, dict):
+                value = value.get(part)
+            else:
+                return None
+        return value
+
+    return get
+
+
+@dataclass(frozen=True, slots=True)
+class AssertionPlan:
+    """An assertion string parsed once, with everything evaluation needs ready to call."""
+
+    subject: AssertionSubject
+    # The header name or JSON path, for subjects that have one
+    target: str | None
+    operator: str
+    expected: Any
+    # Gets the subject's value from a response
+    actual: Callable[[ResponseData], Any]
+    # Applies the operator and expected value to the actual value
+    check: Callable[[Any], bool]
+    # The compiled regex of a (valid) `matches` assertion
+    pattern: re.Pattern | None = None
+
+
+_ACTUAL: dict[AssertionSubject, Callable[[ResponseData], Any]] = {
+    AssertionSubject.STATUS_CODE: operator.attrgetter('response.status_code'),
+    AssertionSubject.BODY: operator.attrgetter('response.text'),
+    AssertionSubject.RESPONSE_TIME: _response_time_ms,
+}
+
+
 class Assertion(BaseModel):
     assertion_string: str
     assertion_object: AssertionSubject
+    assertion_target: str | None = None
     assertion_operator: str
-    assertion_expected_value: str | int | float
+    assertion_expected_value: str | int | float | bool | list | dict | None
 
     # Shared by all
     _OPS: ClassVar[dict[str, Callable]] = {
@@ -62,48 +203,11 @@ class Assertion(BaseModel):
             )
 
         if 'assertion_string' in data:
-            raw_string: str = data['assertion_string']
-            """
-            Things that can go wrong:
-                1. More than 3 parts
-                2. assertion subject must be one of the assertion subject possibilities
-                3. valid operator
-                4. expected value must map to the correct value that this will make
-                5. Must be able to parse correctly for body, which may be a string or regex
-            Parsing here will break the component into its 3 parts, since a body which may be
-            a string or a regex will be surrounded by ""'s it will be parsed as one part and we
-            can keep the 3 part format.
-            """
-            try:
-                parts = shlex.split(raw_string)
-            except ValueError as e:
-                raise ValueError(
-                    f'Invalid assertion format: unable to parse quotes in {raw_string}'
-                ) from e
-
-            if len(parts) != 3:
-                raise ValueError(
-                    f'Invalid assertion format: {raw_string} has more or less than 3 parts'
-                )
-
-            try:
-                subject = AssertionSubject(parts[0])
-            except ValueError as e:
-                raise ValueError(
-                    f'Invalid assertion format: {parts[0]} is not a valid Assertion Subject'
-                ) from e
-
-            if parts[1] not in cls._OPS:
-                raise ValueError(f'Invalid assertion format: {parts[1]} is not a valid operator')
-
-            try:
-                converted_value = subject.cast(parts[2])
-            except ValueError as e:
-                raise ValueError(f"Value '{parts[2]}' is not valid for {subject.value}") from e
-
-            data['assertion_object'] = parts[0]
-            data['assertion_operator'] = parts[1]
-            data['assertion_expected_value'] = converted_value
+            plan = compile_assertion(data['assertion_string'])
+            data['assertion_object'] = plan.subject
+            data['assertion_target'] = plan.target
+            data['assertion_operator'] = plan.operator
+            data['assertion_expected_value'] = plan.expected
 
         return data
 
@@ -111,31 +215,179 @@ class Assertion(BaseModel):
     def serialize_model(self) -> str:
         return f'{self.assertion_string}'
 
-    def evaluate(self, response: httpx.Response) -> tuple[bool, str | None]:
+    def evaluate(self, response: httpx.Response | ResponseData) -> tuple[bool, str | None]:
         """Return true and empty string if true and false with a string explaining
         what failed otherwise"""
-        op_func = self._OPS[self.assertion_operator]
-
-        # Get the actual value from the response based on the subject
-        actual = None
-        expected = self.assertion_expected_value
-        if self.assertion_object == AssertionSubject.STATUS_CODE:
-            actual = response.status_code
-        elif self.assertion_object == AssertionSubject.BODY:
-            actual = response.text
-        elif self.assertion_object == AssertionSubject.RESPONSE_TIME:
-            actual = response.elapsed.total_seconds() * 1000
+        plan = compile_assertion(self.assertion_string)
+        data = response if isinstance(response, ResponseData) else ResponseData(response)
 
         try:
-            success = op_func(actual, expected)
-            if success:
-                return True, None
-            return (
-                False,
-                (
-                    f'Expected {self.assertion_object} {self.assertion_operator} '
-                    f'{expected}, but got {actual}'
-                ),
-            )
+            # Get the actual value from the response based on the subject
+            actual = plan.actual(data)
+            return self.outcome(plan.check(actual), actual)
         except Exception as e:
             return False, f'Error evaluating assertion: {e}'
+
+    def outcome(self, success: bool, actual: Any) -> tuple[bool, str | None]:
+        if success:
+            return True, None
+        subject = self.assertion_object
+        if self.assertion_target is not None:
+            subject = f'{subject} {self.assertion_target}'
+        return (
+            False,
+            (
+                f'Expected {subject} {self.assertion_operator} '
+                f'{self.assertion_expected_value}, but got {actual}'
+            ),
+        )
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def compile_assertion(raw_string: str) -> AssertionPlan:
+    """
+    Parse an assertion string into an AssertionPlan, raising ValueError if it's invalid. Plans
+    are cached by string, so loading a monitor or evaluating its assertions doesn't parse (or
+    compile regexes) again.
+
+    Things that can go wrong:
+        1. More than 3 parts (4 for subjects with a target, like `header <name>`)
+        2. assertion subject must be one of the assertion subject possibilities
+        3. valid operator
+        4. expected value must map to the correct value that this will make
+        5. Must be able to parse correctly for body, which may be a string or regex
+    Parsing here will break the component into its 3 parts, since a body which may be
+    a string or a regex will be surrounded by ""'s it will be parsed as one part and we
+    can keep the 3 part format.
+    """
+    try:
+        parts = shlex.split(raw_string)
+    except ValueError as e:
+        raise ValueError(f'Invalid assertion format: unable to parse quotes in {raw_string}') from e
+
+    n_parts = 4 if parts and parts[0] in TARGETED_SUBJECTS else 3
+    if len(parts) != n_parts:
+        raise ValueError(
+            f'Invalid assertion format: {raw_string} has more or less than {n_parts} parts'
+        )
+
+    try:
+        subject = AssertionSubject(parts[0])
+    except ValueError as e:
+        raise ValueError(
+            f'Invalid assertion format: {parts[0]} is not a valid Assertion Subject'
+        ) from e
+
+    target = parts[1] if subject.has_target else None
+    op_name, raw_expected = parts[-2:]
+    if op_name not in Assertion._OPS:
+        raise ValueError(f'Invalid assertion format: {op_name} is not a valid operator')
+
+    try:
+        expected = subject.cast(raw_expected)
+    except ValueError as e:
+        raise ValueError(f"Value '{raw_expected}' is not valid for {subject.value}") from e
+
+    if subject == AssertionSubject.HEADER:
+        actual = lambda data: data.response.headers.get(target)
+    elif subject == AssertionSubject.JSON:
+        actual = _json_getter(compile_json_path(target))
+    else:
+        actual = _ACTUAL[subject]
+
+    pattern = None
+    if op_name == 'matches':
+        pattern, check = _search(expected)
+    else:
+        op_func = Assertion._OPS[op_name]
+        check = lambda actual: op_func(actual, expected)
+    return AssertionPlan(subject, target, op_name, expected, actual, check, pattern)
+
+
+# Body assertions that search the body, which BodyWatch can decide from part of it
+SEARCH_OPS = frozenset(('contains', 'not_contains', 'matches'))
+
+
+# Patterns that look past the end of their match, so a match in part of a body may not be one in
+# the whole body
+_LOOKS_AHEAD = re.compile(r'\$|\\Z|\(\?[=!]')
+
+
+class BodyWatch:
+    """
+    Follows a body as it's read to tell when every body assertion is decided, so the rest doesn't
+    need to be downloaded. A contains or not_contains is decided once its literal turns up, and a
+    matches once its pattern matches somewhere the rest of the body can't change. Anything else
+    (e.g. `body == ...`) needs the whole body.
+
+    Each call to decided() only searches the new text for literals. Patterns are searched again
+    from the start, but only each time the text has doubled, so the total work stays linear.
+    """
+
+    def __init__(self, plans: list[AssertionPlan]):
+        searches = [p for p in plans if p.subject == AssertionSubject.BODY]
+        self.literals = {p.expected for p in searches if p.operator in ('contains', 'not_contains')}
+        self.patterns = [p.pattern for p in searches if p.operator == 'matches']
+        self.whole_body = any(
+            p.subject == AssertionSubject.JSON
+            or p.operator not in SEARCH_OPS
+            or (p.operator == 'matches' and (p.pattern is None or _LOOKS_AHEAD.search(p.expected)))
+            for p in plans
+        )
+        self._scanned = 0
+        self._next_pattern_scan = 0
+
+    @classmethod
+    def for_assertions(cls, assertions: list[Assertion]) -> 'BodyWatch | None':
+        """A watch for the assertions that need the body, or None if there aren't any."""
+        plans = [
+            compile_assertion(a.assertion_string)
+            for a in assertions
+            if a.assertion_object in (AssertionSubject.BODY, AssertionSubject.JSON)
+        ]
+        return cls(plans) if plans else None
+
+    def decided(self, text: str) -> bool:
+        """Whether the body read so far (`text`) decides every body assertion."""
+        if self.whole_body:
+            return False
+        self.literals = {
+            lit for lit in self.literals if text.find(lit, max(0, self._scanned - len(lit) + 1)) < 0
+        }
+        self._scanned = len(text)
+        if self.patterns and len(text) >= self._next_pattern_scan:
+            self.patterns = [p for p in self.patterns if not self._settled(p, text)]
+            self._next_pattern_scan = 2 * len(text)
+        return not self.literals and not self.patterns
+
+    @staticmethod
+    def _settled(pattern: re.Pattern, text: str) -> bool:
+        # A match running to the end of the text might depend on what comes next (e.g. `\b`).
+        match = pattern.search(text)
+        return match is not None and match.end() < len(text)
+
+
+def evaluate_all(
+    assertions: list[Assertion],
+    response: httpx.Response,
+    cached: dict[str, str | None] | None = None,
+) -> list[tuple[bool, str | None]]:
+    """
+    Evaluate a monitor's assertions against the response, in order.
+
+    `cached` has earlier results (the error message, or None if it passed) by assertion string,
+    for when the response content is known not to have changed since. Content assertions with a
+    cached result use it instead of being evaluated.
+    """
+    if cached:
+        reuse = {
+            i: (cached[a.assertion_string] is None, cached[a.assertion_string])
+            for i, a in enumerate(assertions)
+            if a.assertion_object in CONTENT_SUBJECTS and a.assertion_string in cached
+        }
+        rest = [a for i, a in enumerate(assertions) if i not in reuse]
+        results = iter(evaluate_all(rest, response))
+        return [reuse[i] if i in reuse else next(results) for i in range(len(assertions))]
+
+    data = ResponseData(response)
+    return [a.evaluate(data) for a in assertions]
@@ -1,22 +1,49 @@
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
+from enum import Enum
+from functools import cache
+import heapq
+from itertools import batched
+import math
 import os
-from typing import Any
+import random
+import time
+from types import NoneType, UnionType
+from typing import Annotated, Any, ClassVar, Union, get_args, get_origin
 from uuid import UUID
+import zlib
 
 from boto3 import client
 from boto3.dynamodb.types import TypeDeserializer, TypeSerializer
 from botocore.exceptions import ClientError
-from pydantic import AwareDatetime, BaseModel, TypeAdapter
+from pydantic import AnyUrl, AwareDatetime, BaseModel, NaiveDatetime, TypeAdapter
 
 from critic.libs.dt import to_utc
 
 
 # https://www.reddit.com/r/aws/comments/cwams9/dynamodb_i_need_to_sort_whole_table_by_range_how/
 CONSTANT_GSI_PK = 'bogus'
+# A single constant partition key sends every write to one GSI partition, so items are spread over
+# this many shards instead. Shard 0 keeps the original constant, which means items written before
+# sharding are still found, and raising the count never strands items. Items keep the key they
+# were stored with, though (putting one again doesn't move it), so run the `reshard-monitors` CLI
+# command after enabling sharding to spread existing monitors, and after lowering the count.
+DEFAULT_GSI_SHARDS = 8
+# DynamoDB's per-request item limits
+BATCH_WRITE_LIMIT = 25
+BATCH_GET_LIMIT = 100
+# Retries for unprocessed batch items use "full jitter" exponential backoff
+BATCH_MAX_ATTEMPTS = 8
+BATCH_BACKOFF_BASE_SECS = 0.05
+BATCH_BACKOFF_MAX_SECS = 5
+# Children read (and deleted) per checkpointed step of a CascadeDelete
+CASCADE_DELETE_PAGE_SIZE = 25
 _ddb_client = None
+_streams_client = None
+_executors: dict[str, ThreadPoolExecutor] = {}
 
 
 def get_client():
@@ -29,6 +56,92 @@ def get_client():
     return _ddb_client
 
 
+def get_streams_client():
+    """Like get_client(), for DynamoDB Streams."""
+    global _streams_client
+    if _streams_client is None:
+        _streams_client = client('dynamodbstreams')
+    return _streams_client
+
+
+def gsi_shard_count() -> int:
+    return int(os.environ.get('CRITIC_GSI_SHARDS', DEFAULT_GSI_SHARDS))
+
+
+def gsi_shard_keys() -> list[str]:
+    """All GSI partition keys currently in use, one per shard."""
+    return [
+        CONSTANT_GSI_PK if i == 0 else f'{CONSTANT_GSI_PK}-{i}' for i in range(gsi_shard_count())
+    ]
+
+
+def gsi_shard_key(item_id: str) -> str:
+    """Get the GSI partition key for an item. The same id always maps to the same shard."""
+    return gsi_shard_keys()[zlib.crc32(item_id.encode()) % gsi_shard_count()]
+
+
+def get_executor(name: str, max_workers: int = 8) -> ThreadPoolExecutor:
+    """
+    Get a named thread pool for running blocking (mostly DynamoDB) calls concurrently. Like the
+    client, each pool is created once per process so warm invocations reuse its threads.
+
+    Work running on a pool should never wait on work submitted to the same pool, so each kind of
+    work (e.g. query prefetching vs. batch chunks) gets its own name.
+    """
+    if name not in _executors:
+        _executors[name] = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=f'ddb-{name}'
+        )
+    return _executors[name]
+
+
+class UnprocessedItemsError(Exception):
+    """Raised when a batch request still has unprocessed items after all retries."""
+
+    def __init__(self, unprocessed: dict):
+        self.unprocessed = unprocessed
+        count = sum(len(v['Keys']) if isinstance(v, dict) else len(v) for v in unprocessed.values())
+        super().__init__(
+            f'{count} items were still unprocessed after {BATCH_MAX_ATTEMPTS} attempts'
+        )
+
+
+def retry_unprocessed(send: Callable[[dict], dict], request_items: dict, unprocessed_key: str):
+    """
+    Send a batch request and re-send whatever DynamoDB reports back under `unprocessed_key` until
+    nothing is left, sleeping with jittered exponential backoff between attempts. Yields each
+    response so callers can collect returned items.
+    """
+    for attempt in range(BATCH_MAX_ATTEMPTS):
+        if attempt:
+            cap = min(BATCH_BACKOFF_MAX_SECS, BATCH_BACKOFF_BASE_SECS * 2**attempt)
+            time.sleep(random.uniform(0, cap))
+        response = send(request_items)
+        yield response
+        request_items = response.get(unprocessed_key)
+        if not request_items:
+            return
+    raise UnprocessedItemsError(request_items)
+
+
+def transact_write(items: list[dict]) -> bool:
+    """
+    Write the items (TransactItems entries, e.g. from Table.update_request()) in one
+    TransactWriteItems call, so they all happen or none do. Returns False if the transaction was
+    canceled because a condition failed, like Table.update() does for a single item.
+    """
+    try:
+        get_client().transact_write_items(TransactItems=items)
+    except ClientError as e:
+        reasons = e.response.get('CancellationReasons', [])
+        if e.response['Error']['Code'] == 'TransactionCanceledException' and any(
+            r.get('Code') == 'ConditionalCheckFailed' for r in reasons
+        ):
+            return False
+        raise
+    return True
+
+
 class Serializer:
     """Serialize standard JSON to DynamoDB format."""
 
@@ -80,13 +193,533 @@ serialize = Serializer()
 deserialize = Deserializer()
 
 
+Encoder = Callable[[Any], dict]
+_NULL = {'NULL': True}
+_dt_adapter = TypeAdapter(datetime)
+
+
+def _encode_float(value) -> dict:
+    value = float(value)
+    if not math.isfinite(value):
+        # Pydantic dumps inf/nan as null in JSON mode
+        return _NULL
+    return {'N': str(Decimal(str(value)))}
+
+
+def _fallback_encoder(annotation: Any) -> Encoder:
+    """Encode a value the slow way: a JSON-mode dump followed by the Serializer."""
+    adapter = TypeAdapter(annotation)
+    return lambda value: serialize.serialize(
+        adapter.dump_python(value, mode='json', exclude_none=True)
+    )
+
+
+def compile_encoder(annotation: Any) -> Encoder:
+    """
+    Build a function that encodes values of the given type directly to a DynamoDB attribute value,
+    producing the same output as model_dump(mode='json') followed by the Serializer.
+    """
+    origin = get_origin(annotation)
+    args = get_args(annotation)
+
+    if origin is Annotated:
+        return compile_encoder(args[0])
+
+    if origin in (Union, UnionType):
+        non_none = [a for a in args if a is not NoneType]
+        if len(non_none) != 1:
+            return _fallback_encoder(annotation)
+        inner = compile_encoder(non_none[0])
+        return lambda value: _NULL if value is None else inner(value)
+
+    if origin is list:
+        item = compile_encoder(args[0]) if args else _fallback_encoder(Any)
+        return lambda value: {'L': [item(v) for v in value]}
+
+    if origin is not None or not isinstance(annotation, type):
+        return _fallback_encoder(annotation)
+
+    # Order matters: bool is an int and str enums are strs.
+    if issubclass(annotation, Enum):
+        if issubclass(annotation, str):
+            return lambda value: {'S': value.value}
+        return _fallback_encoder(annotation)
+    if annotation is bool:
+        return lambda value: {'BOOL': value}
+    if annotation is int:
+        return lambda value: {'N': str(value)}
+    if annotation is float:
+        return _encode_float
+    if annotation is str:
+        return lambda value: {'S': value}
+    if annotation is UUID or issubclass(annotation, AnyUrl):
+        return lambda value: {'S': str(value)}
+    if annotation in (datetime, AwareDatetime, NaiveDatetime):
+        return lambda value: {'S': _dt_adapter.dump_python(value, mode='json')}
+    if issubclass(annotation, BaseModel):
+        return model_codec(annotation).encode_value
+
+    return _fallback_encoder(annotation)
+
+
+Decoder = Callable[[dict], Any]
+
+
+def _fallback_decoder(annotation: Any) -> Decoder:
+    """Decode a value the slow way: the Deserializer followed by full validation."""
+    adapter = TypeAdapter(annotation)
+    return lambda av: adapter.validate_python(Deserializer._deserializer.deserialize(av))
+
+
+def compile_decoder(annotation: Any) -> Decoder:
+    """
+    Build a function that decodes a DynamoDB attribute value written by compile_encoder() back to
+    the Python value Pydantic would have produced, without validating it.
+    """
+    origin = get_origin(annotation)
+    args = get_args(annotation)
+
+    if origin is Annotated:
+        return compile_decoder(args[0])
+
+    if origin in (Union, UnionType):
+        non_none = [a for a in args if a is not NoneType]
+        if len(non_none) != 1:
+            return _fallback_decoder(annotation)
+        inner = compile_decoder(non_none[0])
+        return lambda av: None if 'NULL' in av else inner(av)
+
+    if origin is list:
+        item = compile_decoder(args[0]) if args else _fallback_decoder(Any)
+        return lambda av: [item(v) for v in av['L']]
+
+    if origin is not None or not isinstance(annotation, type):
+        return _fallback_decoder(annotation)
+
+    if issubclass(annotation, Enum):
+        if issubclass(annotation, str):
+            members = {m.value: m for m in annotation}
+            return lambda av: members[av['S']]
+        return _fallback_decoder(annotation)
+    if annotation is bool:
+        return lambda av: av['BOOL']
+    if annotation is int:
+        return lambda av: int(av['N'])
+    if annotation is float:
+        return lambda av: float(av['N'])
+    if annotation is str:
+        return lambda av: av['S']
+    if annotation in (datetime, AwareDatetime, NaiveDatetime):
+        return lambda av: datetime.fromisoformat(av['S'])
+    if annotation is UUID or issubclass(annotation, AnyUrl):
+        # There's no way to build these without parsing, and Pydantic's parsers beat the stdlib's.
+        adapter = TypeAdapter(annotation)
+        return lambda av: adapter.validate_python(av['S'])
+    if issubclass(annotation, BaseModel):
+        return model_codec(annotation).decode_value
+
+    return _fallback_decoder(annotation)
+
+
+class ModelCodec:
+    """
+    Converts between one Pydantic model and DynamoDB items in a single pass. Field encoders and
+    decoders are compiled once from the model's field types (see model_codec()), so this skips the
+    intermediate JSON dict that model_dump() + Serializer would build and, when decoding data
+    Critic wrote itself, Pydantic validation.
+    """
+
+    def __init__(self, model: type[BaseModel]):
+        self.model = model
+        decorators = model.__pydantic_decorators__
+        # Custom serializers can output anything, so leave those models to Pydantic.
+        self.use_fallback = bool(decorators.model_serializers or decorators.field_serializers)
+        self.encoders: list[tuple[str, Encoder]] = []
+        self.decoders: dict[str, Decoder] = {}
+        if self.use_fallback:
+            self.fallback_decoder = _fallback_decoder(model)
+        else:
+            fields = {name: f for name, f in model.model_fields.items() if not f.exclude}
+            self.encoders = [(name, compile_encoder(f.annotation)) for name, f in fields.items()]
+            self.decoders = {name: compile_decoder(f.annotation) for name, f in fields.items()}
+
+        # model_construct() spends most of its time checking aliases. Models that don't need any of
+        # its extra handling can be built directly.
+        self.fast_construct = not (
+            model.__pydantic_root_model__
+            or model.__pydantic_post_init__
+            or model.__private_attributes__
+            or model.model_config.get('extra') == 'allow'
+            or any(f.alias or f.validation_alias for f in model.model_fields.values())
+        )
+        self.defaults = {name: f for name, f in model.model_fields.items() if not f.is_required()}
+
+    def encode(self, inst: BaseModel) -> dict:
+        """Encode an instance to a DynamoDB item, leaving out None values."""
+        if self.use_fallback:
+            return serialize(inst.model_dump(mode='json', exclude_none=True))
+        item = {}
+        for name, encoder in self.encoders:
+            value = getattr(inst, name)
+            if value is not None:
+                item[name] = encoder(value)
+        return item
+
+    def encode_value(self, inst: BaseModel) -> dict:
+        """Encode an instance as a DynamoDB attribute value (for nesting in another item)."""
+        if self.use_fallback:
+            return serialize.serialize(inst.model_dump(mode='json', exclude_none=True))
+        return {'M': self.encode(inst)}
+
+    def validate(self, item: dict) -> BaseModel:
+        """Decode an item by fully validating it, exactly like data from any other source."""
+        return self.model(**deserialize(item))
+
+    def decode(self, item: dict, validate: bool = False) -> BaseModel:
+        """
+        Decode a DynamoDB item to an instance. Unless `validate` is set, the item is trusted to
+        have been written by encode() and the instance is built with model_construct(). Items that
+        don't decode cleanly (e.g. written by an older version of the model) are validated instead.
+        """
+        if validate or self.use_fallback:
+            return self.validate(item)
+        try:
+            values = {
+                name: decoder(item[name]) for name, decoder in self.decoders.items() if name in item
+            }
+        except (KeyError, TypeError, ValueError):
+            return self.validate(item)
+        return self.construct(values)
+
+    def construct(self, values: dict) -> BaseModel:
+        """Build an instance from already decoded values, like model_construct() does."""
+        if not self.fast_construct:
+            return self.model.model_construct(**values)
+
+        fields_set = set(values)
+        for name, field in self.defaults.items():
+            if name not in fields_set:
+                values[name] = field.get_default(call_default_factory=True, validated_data=values)
+        inst = self.model.__new__(self.model)
+        object.__setattr__(inst, '__dict__', values)
+        object.__setattr__(inst, '__pydantic_fields_set__', fields_set)
+        object.__setattr__(inst, '__pydantic_extra__', None)
+        object.__setattr__(inst, '__pydantic_private__', None)
+        return inst
+
+    def decode_value(self, av: dict) -> BaseModel:
+        if self.use_fallback:
+            return self.fallback_decoder(av)
+        return self.decode(av['M'])
+
+
+@cache
+def model_codec(model: type[BaseModel]) -> ModelCodec:
+    return ModelCodec(model)
+
+
+class QueryIterator:
+    """
+    Iterates over the items of a DynamoDB query (or scan), following LastEvaluatedKey across pages.
+
+    While the caller consumes one page, the next one is fetched in the background, so at most two
+    pages are held in memory regardless of how many items match.
+
+    `cursor` is the ExclusiveStartKey that resumes the query right after the last item (or page,
+    when using pages()) yielded. It is already in DynamoDB format so it can be passed between
+    invocations as JSON. It is None once the query has been exhausted (see also `exhausted`).
+    """
+
+    def __init__(
+        self,
+        table: type['Table'],
+        request: dict,
+        cursor: dict | None = None,
+        page_size: int | None = None,
+        operation: str = 'query',
+    ):
+        self.table = table
+        self.request = dict(request)
+        self.cursor = cursor
+        self.page_size = page_size
+        self.operation = operation
+        self.exhausted = False
+        # Limit caps the total number of items, not the size of each page. That's how it behaved
+        # when queries only read a single page and callers (e.g. prune) rely on it.
+        self.limit: int | None = self.request.pop('Limit', None)
+        self.key_attributes = table.key_attributes(self.request.get('IndexName'))
+        self._first_page: Future | None = None
+
+    def _fetch(self, client, start_key: dict | None, remaining: int | None) -> dict:
+        kwargs = dict(self.request)
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        limits = [n for n in (remaining, self.page_size) if n is not None]
+        if limits:
+            kwargs['Limit'] = min(limits)
+        return getattr(client, self.operation)(**kwargs)
+
+    def _submit(self, client, start_key: dict | None, remaining: int | None) -> Future:
+        return get_executor('prefetch').submit(self._fetch, client, start_key, remaining)
+
+    def start(self) -> 'QueryIterator':
+        """
+        Start fetching the first page in the background. Iterating does this implicitly, but
+        starting several iterators up front lets their first pages load in parallel.
+        """
+        if self._first_page is None:
+            self._first_page = self._submit(get_client(), self.cursor, self.limit)
+        return self
+
+    def pages(self) -> Iterator[list[dict]]:
+        """Yield pages of raw DynamoDB items, prefetching the next page in the background."""
+        client = get_client()
+        remaining = self.limit
+        future = self.start()._first_page
+        while future is not None:
+            response = future.result()
+            items = response.get('Items', [])
+            last_key = response.get('LastEvaluatedKey')
+            if remaining is not None:
+                remaining -= len(items)
+
+            if last_key and (remaining is None or remaining > 0):
+                future = self._submit(client, last_key, remaining)
+            else:
+                future = None
+
+            # Page consumers can checkpoint right after handling a page.
+            self.cursor = last_key
+            self.exhausted = not last_key
+            yield items
+
+    def __iter__(self) -> Iterator[BaseModel]:
+        for page in self.pages():
+            for item in page:
+                self.cursor = {k: item[k] for k in self.key_attributes}
+                yield self.table.ddb_to_model(item)
+        if self.exhausted:
+            self.cursor = None
+
+
+class MergedQueryIterator:
+    """
+    Merges several QueryIterators whose results share a sort order (e.g. one per shard of a
+    write-sharded index) into one sorted stream. Every iterator is started immediately so their
+    first pages load in parallel.
+
+    `cursor` maps the name of each iterator that isn't exhausted to its own cursor, which always
+    points at the last item this iterator yielded from it (not the ones it has only peeked at).
+    """
+
+    def __init__(self, iterators: dict[str, QueryIterator], sort_key: Callable[[BaseModel], Any]):
+        self.iterators = {name: it.start() for name, it in iterators.items()}
+        self.sort_key = sort_key
+        self.cursor = {name: it.cursor for name, it in iterators.items()}
+
+    def __iter__(self) -> Iterator[BaseModel]:
+        # Heap entries are (sort value, tie breaker, name, item, cursor after item, iterator).
+        heap = []
+
+        def push(name: str, it: Iterator[BaseModel], tie_breaker: int):
+            query = self.iterators[name]
+            for item in it:
+                heapq.heappush(
+                    heap, (self.sort_key(item), tie_breaker, name, item, query.cursor, it)
+                )
+                return
+            if query.exhausted:
+                self.cursor.pop(name, None)
+
+        for i, (name, query) in enumerate(self.iterators.items()):
+            push(name, iter(query), i)
+
+        while heap:
+            _, tie_breaker, name, item, cursor, it = heapq.heappop(heap)
+            self.cursor[name] = cursor
+            yield item
+            push(name, it, tie_breaker)
+
+
+class StreamNotEnabledError(Exception):
+    pass
+
+
+class StreamReader:
+    """
+    Follows a table's DynamoDB stream from when it's created, so a copy of the table kept in memory
+    can be updated with just the items that changed instead of reading the table again. The
+    stream must include new images (StreamViewType NEW_IMAGE or NEW_AND_OLD_IMAGES).
+
+    Shards that appear later (the stream rolls its shards over every few hours, and splits them
+    under load) are read from their start, after their parents. A stream keeps records for 24
+    hours and a shard iterator expires after 15 minutes, so read() must be called well within
+    that; a ClientError from it means records may have been missed and the copy needs a full
+    reload.
+    """
+
+    def __init__(self, table: type['Table']):
+        description = get_client().describe_table(TableName=table.name())['Table']
+        self.arn = description.get('LatestStreamArn')
+        if not self.arn or not description.get('StreamSpecification', {}).get('StreamEnabled'):
+            raise StreamNotEnabledError(f'{table.name()} has no stream enabled')
+        # Shard id -> iterator for what's next in it
+        self.iterators: dict[str, str] = {}
+        # Shards that were closed and read to the end
+        self.finished: set[str] = set()
+        self._discover('LATEST')
+
+    def _shards(self) -> Iterator[dict]:
+        kwargs = {'StreamArn': self.arn}
+        while True:
+            description = get_streams_client().describe_stream(**kwargs)['StreamDescription']
+            yield from description['Shards']
+            if not description.get('LastEvaluatedShardId'):
+                return
+            kwargs['ExclusiveStartShardId'] = description['LastEvaluatedShardId']
+
+    def _discover(self, iterator_type: str):
+        shard_ids = []
+        for shard in self._shards():
+            shard_id = shard['ShardId']
+            shard_ids.append(shard_id)
+            if shard_id in self.iterators or shard_id in self.finished:
+                continue
+            self.iterators[shard_id] = get_streams_client().get_shard_iterator(
+                StreamArn=self.arn, ShardId=shard_id, ShardIteratorType=iterator_type
+            )['ShardIterator']
+        # Shards past the stream's retention are no longer listed
+        self.finished &= set(shard_ids)
+
+    def read(self) -> Iterator[dict]:
+        """
+        Yield the stream records written since the last read, in order for each item. Each is a
+        record's `eventName` (INSERT, MODIFY or REMOVE) and its `dynamodb` fields (`Keys`, and
+        `NewImage` unless it's a REMOVE) in one dict.
+        """
+        self._discover('TRIM_HORIZON')
+        for shard_id in list(self.iterators):
+            iterator = self.iterators[shard_id]
+            while iterator:
+                response = get_streams_client().get_records(ShardIterator=iterator)
+                for record in response['Records']:
+                    yield {'eventName': record['eventName'], **record['dynamodb']}
+                iterator = response.get('NextShardIterator')
+                if not response['Records']:
+                    break
+            if iterator:
+                self.iterators[shard_id] = iterator
+            else:
+                del self.iterators[shard_id]
+                self.finished.add(shard_id)
+
+
 @dataclass
 class CascadeRelationship:
     child_table: type['Table']
     # Given the parent's partition and sort keys, return the child's partition key for querying
     get_child_query_key: Callable[[Any, Any | None], Any]
-    # Given the child, return the child's partition and sort key for deletion
-    get_child_delete_keys: Callable[[BaseModel], tuple[Any, Any | None]]
+
+
+class CascadeDelete:
+    """
+    Deletes an item along with everything under it (see Table.cascade_relationships) in steps that
+    can be checkpointed, so a delete too big for one Lambda invocation can be finished by the next.
+
+    Each step reads one page of children with a keys-only projection, deletes the children's own
+    descendants concurrently, then deletes the page with batch writes. The checkpoint records which
+    relationship and query cursor to resume from and is JSON-serializable. Deletes are idempotent,
+    so losing a checkpoint only costs re-reading what's left.
+    """
+
+    def __init__(
+        self,
+        table: type['Table'],
+        partition_value: Any,
+        sort_value: Any | None = None,
+        checkpoint: dict | None = None,
+        page_size: int = CASCADE_DELETE_PAGE_SIZE,
+        parallel: bool = True,
+    ):
+        self.table = table
+        self.partition_value = partition_value
+        self.sort_value = sort_value
+        self.checkpoint = checkpoint
+        self.page_size = page_size
+        # Descendants are deleted on the 'cascade' pool. Nested deletes running on that pool must
+        # not wait on it, so they run serially.
+        self.parallel = parallel
+
+    @staticmethod
+    def delete_descendants(
+        table: type['Table'], keys: list[tuple[Any, Any | None]], parallel: bool
+    ):
+        """Fully delete the descendants of the items with the given keys (not the items)."""
+        if not table.cascade_relationships():
+            return
+
+        def delete(key: tuple[Any, Any | None]):
+            CascadeDelete(table, *key, parallel=False).run_descendants()
+
+        if parallel:
+            for _ in get_executor('cascade').map(delete, keys):
+                pass
+        else:
+            for key in keys:
+                delete(key)
+
+    def run_descendants(self, deadline: float | None = None) -> dict | None:
+        """
+        Delete everything under the item, stopping once time.monotonic() passes `deadline`.
+        Returns a checkpoint to resume from, or None once everything is deleted.
+        """
+        relationships = self.table.cascade_relationships()
+        start, cursor = (0, None)
+        if self.checkpoint:
+            start, cursor = self.checkpoint['relationship'], self.checkpoint['cursor']
+
+        for i in range(start, len(relationships)):
+            rel = relationships[i]
+            child = rel.child_table
+            query = child.query_iter(
+                rel.get_child_query_key(self.partition_value, self.sort_value),
+                cursor=cursor,
+                page_size=self.page_size,
+                keys_only=True,
+                # We delete everything we read, so don't let eventual consistency show it again.
+                ConsistentRead=True,
+            )
+            for page in query.pages():
+                keys = [
+                    (key[child.partition_key], key.get(child.sort_key))
+                    for key in map(deserialize, page)
+                ]
+                self.delete_descendants(child, keys, self.parallel)
+                child._batch_write({'DeleteRequest': {'Key': key}} for key in page)
+
+                self.checkpoint = {'relationship': i, 'cursor': query.cursor}
+                if query.exhausted:
+                    break
+                if deadline is not None and time.monotonic() >= deadline:
+                    return self.checkpoint
+            cursor = None
+
+        self.checkpoint = None
+        return None
+
+    def run(self, deadline: float | None = None) -> dict | None:
+        """
+        Delete everything under the item and then the item itself. Returns a checkpoint if the
+        deadline passed first (see run_descendants()).
+        """
+        checkpoint = self.run_descendants(deadline)
+        if checkpoint:
+            return checkpoint
+        get_client().delete_item(
+            TableName=self.table.name(),
+            Key=self.table.key(self.partition_value, self.sort_value),
+        )
+        return None
 
 
 class Table:
@@ -94,17 +727,26 @@ class Table:
     model: type[BaseModel]
     partition_key: str
     sort_key: str | None = None
+    # Items read back from DynamoDB were written (and validated) by Critic, so by default they're
+    # decoded without validation. Set CRITIC_DDB_VALIDATE_READS=1 to validate them again.
+    validate_reads: bool = os.environ.get('CRITIC_DDB_VALIDATE_READS') == '1'
+    # Maps GSI names to their (partition key, sort key) attribute names
+    indexes: ClassVar[dict[str, tuple[str, str | None]]] = {}
 
     @staticmethod
     def model_to_ddb(inst: BaseModel) -> dict:
         """Convert a Pydantic model instance to a DynamoDB-compatible dict."""
-        plain = inst.model_dump(mode='json', exclude_none=True)
-        return serialize(plain)
+        return model_codec(type(inst)).encode(inst)
 
     @classmethod
-    def ddb_to_model(cls, item: dict) -> BaseModel:
-        """Convert a DynamoDB item to a Pydantic model instance."""
-        return cls.model(**deserialize(item))
+    def ddb_to_model(cls, item: dict, validate: bool | None = None) -> BaseModel:
+        """
+        Convert a DynamoDB item to a Pydantic model instance. See ModelCodec.decode() for how
+        `validate` (which defaults to the table's validate_reads) is used.
+        """
+        if validate is None:
+            validate = cls.validate_reads
+        return model_codec(cls.model).decode(item, validate=validate)
 
     @staticmethod
     def namespace(table_name: str) -> str:
@@ -128,11 +770,28 @@ class Table:
         return serialize(key)
 
     @classmethod
-    def put(cls, data: dict | BaseModel):
+    def key_attributes(cls, index_name: str | None = None) -> list[str]:
+        """
+        Attribute names that make up an item's position in the table or one of its indexes. (An
+        index's ExclusiveStartKey needs both the table's key and the index's key.)
+        """
+        attrs = [cls.partition_key]
+        if cls.sort_key is not None:
+            attrs.append(cls.sort_key)
+        if index_name is not None:
+            attrs.extend(a for a in cls.indexes[index_name] if a is not None and a not in attrs)
+        return attrs
+
+    @classmethod
+    def put_request(cls, data: dict | BaseModel) -> dict:
+        """The parameters of a PutItem (or a Put in a transaction, see transact_write())."""
         if isinstance(data, dict):
             data = cls.model(**data)
-        client = get_client()
-        client.put_item(TableName=cls.name(), Item=cls.model_to_ddb(data))
+        return {'TableName': cls.name(), 'Item': cls.model_to_ddb(data)}
+
+    @classmethod
+    def put(cls, data: dict | BaseModel):
+        get_client().put_item(**cls.put_request(data))
 
     @classmethod
     def get(cls, partition_value: Any, sort_value: Any | None = None) -> BaseModel | None:
@@ -143,20 +802,45 @@ class Table:
         return cls.ddb_to_model(response['Item']) if 'Item' in response else None
 
     @classmethod
-    def query(cls, partition_value: Any, **kwargs) -> list[BaseModel]:
-        """Query for all items with the given partition key."""
+    def query_iter(
+        cls,
+        partition_value: Any,
+        cursor: dict | None = None,
+        page_size: int | None = None,
+        keys_only: bool = False,
+        **kwargs,
+    ) -> QueryIterator:
+        """
+        Lazily query for all items with the given partition key. See QueryIterator for paging and
+        resuming from a cursor. With `keys_only`, only the table's key attributes are read (use
+        pages() to get them, since they don't make a valid model).
+        """
         names, values, clauses = cls.alias({cls.partition_key: partition_value})
-
-        response = get_client().query(
-            TableName=cls.name(),
-            KeyConditionExpression=clauses[0],
-            ExpressionAttributeNames=names,
-            ExpressionAttributeValues=values,
+        if keys_only:
+            key_names = {f'#{k}': k for k in cls.key_attributes()}
+            names |= key_names
+            kwargs['ProjectionExpression'] = ', '.join(key_names)
+        request = {
+            'TableName': cls.name(),
+            'KeyConditionExpression': clauses[0],
+            'ExpressionAttributeNames': names,
+            'ExpressionAttributeValues': values,
             **kwargs,
-        )
+        }
+        return QueryIterator(cls, request, cursor=cursor, page_size=page_size)
+
+    @classmethod
+    def scan_iter(
+        cls, cursor: dict | None = None, page_size: int | None = None, **kwargs
+    ) -> QueryIterator:
+        """Lazily scan the whole table. See QueryIterator for paging and resuming."""
+        request = {'TableName': cls.name(), **kwargs}
+        return QueryIterator(cls, request, cursor=cursor, page_size=page_size, operation='scan')
 
-        items = response.get('Items', [])
-        return [cls.model(**deserialize(item)) for item in items]
+    @classmethod
+    def query(cls, partition_value: Any, **kwargs) -> list[BaseModel]:
+        """Query for all items with the given partition key."""
+        return list(cls.query_iter(partition_value, **kwargs))
 
     @staticmethod
     def alias(data: dict, val_suffix: str = '') -> tuple[dict, dict, list]:
@@ -198,13 +882,14 @@ class Table:
         return names, values, clauses
 
     @classmethod
-    def update(
+    def update_request(
         cls,
         partition_value: Any,
         sort_value: Any | None = None,
         updates: dict | None = None,
         condition: dict | None = None,
-    ) -> bool:
+    ) -> dict:
+        """The parameters of an UpdateItem (or an Update in a transaction, see transact_write())."""
         if not updates:
             raise ValueError('No updates provided')
 
@@ -223,7 +908,17 @@ class Table:
         }
         if condition:
             kwargs['ConditionExpression'] = ' AND '.join(cond_clauses)
+        return kwargs
 
+    @classmethod
+    def update(
+        cls,
+        partition_value: Any,
+        sort_value: Any | None = None,
+        updates: dict | None = None,
+        condition: dict | None = None,
+    ) -> bool:
+        kwargs = cls.update_request(partition_value, sort_value, updates, condition)
         try:
             get_client().update_item(**kwargs)
         except ClientError as e:
@@ -232,18 +927,84 @@ class Table:
             raise
         return True
 
+    @classmethod
+    def _run_batches(cls, send: Callable[[list], Any], items: Iterable, size: int) -> list:
+        """Split items into chunks of `size`, send them concurrently and return the results."""
+        executor = get_executor('batch')
+        futures = [
+            executor.submit(send, list(chunk)) for chunk in batched(items, size, strict=False)
+        ]
+        return [f.result() for f in futures]
+
+    @classmethod
+    def _batch_write(cls, requests: Iterable[dict]):
+        client = get_client()
+        name = cls.name()
+
+        def send(chunk: list[dict]):
+            for _ in retry_unprocessed(
+                lambda items: client.batch_write_item(RequestItems=items),
+                {name: chunk},
+                'UnprocessedItems',
+            ):
+                pass
+
+        cls._run_batches(send, requests, BATCH_WRITE_LIMIT)
+
+    @classmethod
+    def batch_put(cls, items: Iterable[dict | BaseModel]):
+        """
+        Put many items using BatchWriteItem. Each item must have a distinct key.
+        """
+        cls._batch_write(
+            {
+                'PutRequest': {
+                    'Item': cls.model_to_ddb(cls.model(**item) if isinstance(item, dict) else item)
+                }
+            }
+            for item in items
+        )
+
+    @classmethod
+    def batch_get(cls, keys: Iterable[tuple[Any, Any | None]]) -> list[BaseModel]:
+        """
+        Get many items by (partition_value, sort_value) using BatchGetItem. Items that don't exist
+        are skipped and the order of the results is not guaranteed.
+        """
+        client = get_client()
+        name = cls.name()
+
+        def send(chunk: list[dict]) -> list[BaseModel]:
+            found = []
+            for response in retry_unprocessed(
+                lambda items: client.batch_get_item(RequestItems=items),
+                {name: {'Keys': chunk}},
+                'UnprocessedKeys',
+            ):
+                found.extend(cls.ddb_to_model(item) for item in response['Responses'][name])
+            return found
+
+        chunks = cls._run_batches(send, (cls.key(*k) for k in keys), BATCH_GET_LIMIT)
+        return [model for chunk in chunks for model in chunk]
+
+    @classmethod
+    def batch_delete(cls, keys: Iterable[tuple[Any, Any | None]]):
+        """
+        Delete many items by (partition_value, sort_value) using BatchWriteItem, cascading to their
+        children first just like delete().
+        """
+        keys = list(keys)
+        CascadeDelete.delete_descendants(cls, keys, parallel=True)
+        cls._batch_write({'DeleteRequest': {'Key': cls.key(*k)}} for k in keys)
+
     @classmethod
     def cascade_relationships(cls) -> list[CascadeRelationship]:
         return []
 
     @classmethod
     def delete(cls, partition_value: Any, sort_value: Any | None = None):
-        for rel in cls.cascade_relationships():
-            child_partition_key = rel.get_child_query_key(partition_value, sort_value)
-            for child in rel.child_table.query(child_partition_key):
-                rel.child_table.delete(*rel.get_child_delete_keys(child))
-
-        get_client().delete_item(
-            TableName=cls.name(),
-            Key=cls.key(partition_value, sort_value),
-        )
+        """
+        Delete an item and all its descendants in this invocation. For items with too many
+        descendants for that, use the `cascade_delete` task.
+        """
+        CascadeDelete(cls, partition_value, sort_value).run()
@@ -0,0 +1,358 @@
+from collections import Counter, deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from datetime import datetime
+import heapq
+from itertools import chain, groupby
+import json
+import logging
+import math
+import os
+import time
+from zlib import crc32
+
+from critic.libs.ddb import get_executor
+from critic.models import MonitorState, UptimeMonitorModel
+from critic.tables import ProjectTable, UptimeMonitorTable
+
+
+log = logging.getLogger(__name__)
+
+# `single` invokes run_checks once per due monitor, `batch` invokes run_checks_batch once per chunk
+DEFAULT_DISPATCH_MODE = 'single'
+# Most monitors sent to one run_checks_batch invocation
+DEFAULT_CHUNK_SIZE = 100
+# Async Lambda invocations take at most 256 KB of payload. Chunks are cut short before they'd grow
+# past this, leaving room for the rest of the payload.
+MAX_CHUNK_BYTES = 200_000
+# Invocations in flight at once
+DISPATCH_CONCURRENCY = 16
+# Chunks' worth of monitors read ahead to put monitors of the same host in the same chunk
+CHUNK_GROUP_WINDOW = 10
+# Seconds into the minute that due checks are spread over. 0 releases them all at once.
+DEFAULT_SPREAD_SECS = 0
+# Checks are spread no later than this into the minute, so they're sent before round_minute()
+# would round up to the next minute and the next run_due_checks starts.
+MAX_SPREAD_SECS = 50
+# Checks whose offsets fall in the same slice of the minute are released together
+DEFAULT_SLICE_SECS = 1
+# Most checks dispatched per run. 0 is no limit. Past it, the lowest priority checks are deferred.
+DEFAULT_DISPATCH_CAPACITY = 0
+# When the most overdue monitor is this far behind, checks are dispatched in priority order
+DEFAULT_OVERLOAD_LAG_SECS = 120
+
+
+def dispatch_mode() -> str:
+    return os.environ.get('CRITIC_DISPATCH_MODE', DEFAULT_DISPATCH_MODE)
+
+
+def chunk_size() -> int:
+    return int(os.environ.get('CRITIC_DISPATCH_CHUNK_SIZE', DEFAULT_CHUNK_SIZE))
+
+
+def spread_secs() -> float:
+    return min(
+        float(os.environ.get('CRITIC_DISPATCH_SPREAD_SECS', DEFAULT_SPREAD_SECS)), MAX_SPREAD_SECS
+    )
+
+
+def slice_secs() -> float:
+    return float(os.environ.get('CRITIC_DISPATCH_SLICE_SECS', DEFAULT_SLICE_SECS))
+
+
+def dispatch_capacity() -> int:
+    return int(os.environ.get('CRITIC_DISPATCH_CAPACITY', DEFAULT_DISPATCH_CAPACITY))
+
+
+def overload_lag_secs() -> float:
+    return float(os.environ.get('CRITIC_OVERLOAD_LAG_SECS', DEFAULT_OVERLOAD_LAG_SECS))
+
+
+def fair_dispatch() -> bool:
+    """Share the dispatch capacity among projects (CRITIC_FAIR_DISPATCH=1, see prioritize())."""
+    return os.environ.get('CRITIC_FAIR_DISPATCH') == '1'
+
+
+def project_shares(project_ids: Iterable[str]) -> dict[str, int]:
+    """The projects' check shares (see ProjectModel.check_share), keyed by project id."""
+    return {pid: project.check_share for pid, project in ProjectTable.by_id(project_ids).items()}
+
+
+def fair_order(
+    monitors: Iterable[UptimeMonitorModel], shares: dict[str, int] | None = None
+) -> Iterator[UptimeMonitorModel]:
+    """
+    Interleave the projects' monitors by weighted fair queueing, so a project with thousands of
+    due monitors can't hold up every other project's checks behind its own. Each project's
+    monitors keep their order, and a project gets checks in proportion to its share (see
+    ProjectModel.check_share), looked up when `shares` isn't given.
+    """
+    queues: dict[str, deque[UptimeMonitorModel]] = {}
+    for monitor in monitors:
+        queues.setdefault(str(monitor.project_id), deque()).append(monitor)
+    if shares is None:
+        shares = project_shares(queues)
+
+    # (virtual finish time of the project's next check, tie breaker, project id)
+    heap = [(1 / shares.get(pid, 1), i, pid) for i, pid in enumerate(queues)]
+    heapq.heapify(heap)
+    while heap:
+        finish, i, pid = heapq.heappop(heap)
+        queue = queues[pid]
+        yield queue.popleft()
+        if queue:
+            heapq.heappush(heap, (finish + 1 / shares.get(pid, 1), i, pid))
+
+
+# Names of check_priority()'s tiers, for logging
+PRIORITY_TIERS = ('down', 'failing', 'up', 'paused')
+# Projects named in the summary of deferred checks
+DEFERRED_LOG_PROJECTS = 10
+
+
+def check_priority(monitor: UptimeMonitorModel) -> tuple:
+    """
+    Sort key putting the checks that matter most for alerting first: monitors that are down, then
+    failing ones by how few failures they are from alerting, then the rest. Paused monitors only
+    need their next due time moved, so they go last. Within each, the most overdue go first.
+    """
+    if monitor.state == MonitorState.down:
+        tier = 0
+    elif monitor.state == MonitorState.paused:
+        tier = 3
+    elif monitor.consecutive_fails:
+        tier = 1
+    else:
+        tier = 2
+    fails_to_alert = monitor.failures_before_alerting - monitor.consecutive_fails
+    return tier, fails_to_alert if tier == 1 else 0, monitor.next_due_at
+
+
+def is_urgent(monitor: UptimeMonitorModel) -> bool:
+    """Whether the monitor is down or failing, see check_priority()."""
+    return check_priority(monitor)[0] < 2
+
+
+def deferred_summary(deferred: list[UptimeMonitorModel]) -> str:
+    """Count the deferred checks by priority tier and by project (the biggest ones), for logging."""
+    tiers = Counter(PRIORITY_TIERS[check_priority(m)[0]] for m in deferred)
+    projects = Counter(str(m.project_id) for m in deferred)
+    by_tier = ', '.join(f'{tier} {tiers[tier]}' for tier in PRIORITY_TIERS if tiers[tier])
+    by_project = ', '.join(
+        f'{pid} {count}' for pid, count in projects.most_common(DEFERRED_LOG_PROJECTS)
+    )
+    if len(projects) > DEFERRED_LOG_PROJECTS:
+        by_project += f' and {len(projects) - DEFERRED_LOG_PROJECTS} more'
+    return f'by state: {by_tier}; by project: {by_project}'
+
+
+def prioritize(
+    monitors: Iterable[UptimeMonitorModel],
+    now: datetime,
+    capacity: int | None = None,
+    lag_secs: float | None = None,
+    fair: bool | None = None,
+) -> tuple[Iterable[UptimeMonitorModel], bool]:
+    """
+    Measure how far behind schedule the due monitors (most overdue first, as get_due_since()
+    yields them) are, and decide what to dispatch. Returns the monitors to dispatch and whether
+    they're in priority order. When keeping up, that's all of them in the order given, read
+    lazily.
+
+    We're overloaded when there are more than `capacity` due, or the most overdue is `lag_secs`
+    or more behind. Then the checks are ordered by check_priority() and only `capacity` of them
+    are dispatched. The rest are deferred: they're left due, so the next run picks them up
+    further overdue, and they're logged in one summary line with the reason.
+
+    With `fair` (CRITIC_FAIR_DISPATCH=1 when not given), the projects' checks within each priority
+    tier are interleaved by fair_order(), so where the capacity cuts a tier, it's shared between
+    the projects by their check shares rather than going to whichever has the most overdue
+    monitors.
+    """
+    capacity = dispatch_capacity() if capacity is None else capacity
+    lag_secs = overload_lag_secs() if lag_secs is None else lag_secs
+    fair = fair_dispatch() if fair is None else fair
+
+    def by_priority(due: list[UptimeMonitorModel]) -> list[UptimeMonitorModel]:
+        due.sort(key=check_priority)
+        if not fair:
+            return due
+        shares = project_shares({str(m.project_id) for m in due})
+        tiers = groupby(due, key=lambda m: check_priority(m)[0])
+        return [m for _, tier in tiers for m in fair_order(tier, shares)]
+
+    monitors = iter(monitors)
+    first = next(monitors, None)
+    if first is None:
+        return [], False
+    lag = (now - first.next_due_at).total_seconds()
+    log.info(f'Schedule lag: {lag:.0f}s')
+    behind = lag >= lag_secs
+    if not capacity and not behind:
+        return chain([first], monitors), False
+
+    due = [first, *monitors]
+    if capacity and len(due) > capacity:
+        due = by_priority(due)
+        dispatched, deferred = due[:capacity], due[capacity:]
+        reason = f'overloaded: {len(due)} checks due, capacity {capacity}, lag {lag:.0f}s'
+        log.warning(f'Deferring {len(deferred)} checks ({reason}), {deferred_summary(deferred)}')
+        return dispatched, True
+    if behind:
+        log.warning(f'Behind schedule by {lag:.0f}s, dispatching {len(due)} checks by priority')
+        due = by_priority(due)
+    return due, behind
+
+
+def monitor_offset_secs(monitor: UptimeMonitorModel, spread: float) -> float:
+    """
+    The monitor's offset into the minute, in [0, spread). It's derived from the monitor's host, so
+    a monitor is checked at the same second every minute and the interval between its checks
+    holds, and monitors of the same host are released together: in batch mode they then go to the
+    same invocation, whose host limits space them out (see chunk_monitors()), and monitors of the
+    same URL can share a request (see UptimeCheck.request_key()).
+    """
+    return crc32(str(monitor.url.host).encode()) % 1000 / 1000 * spread
+
+
+def release_slices(
+    monitors: Iterable[UptimeMonitorModel],
+    start: datetime,
+    spread: float | None = None,
+    slice_len: float | None = None,
+    sleep: Callable[[float], None] | None = None,
+    urgent_first: bool = False,
+) -> Iterator[Iterable[UptimeMonitorModel]]:
+    """
+    Yield the monitors in slices of the minute starting at `start`, waiting until each slice is due
+    before yielding it. Each monitor lands in the slice holding its offset (monitor_offset_secs),
+    so the checks, and the DynamoDB writes and requests they make, are spread evenly through the
+    minute instead of all landing at the top of it.
+
+    The monitors are queued by slice as they're read, so the first slices go out while the rest
+    are still being read: a slice is yielded once it's over if reading hasn't finished by then.
+    Monitors read after their slice went out go in the next one. Within a slice, monitors keep
+    the order they were read in.
+
+    With `urgent_first` (for monitors in priority order, see prioritize()), monitors that are down
+    or failing go in the first slice rather than on their offsets, so the checks that decide
+    alerts aren't held back behind healthy ones. The rest keep their offsets: past the urgent
+    ones, priority only decides which checks are deferred and the order within each slice.
+
+    With no spread, the monitors are yielded as one slice, without waiting or reading them ahead.
+    """
+    spread = spread_secs() if spread is None else spread
+    if spread <= 0:
+        yield monitors
+        return
+
+    slice_len = slice_len or slice_secs()
+    sleep = sleep or time.sleep
+    start_ts = start.timestamp()
+    last_num = math.ceil(spread / slice_len) - 1
+
+    queues: dict[int, list[UptimeMonitorModel]] = {}
+    # Slices before this one have been yielded
+    released = 0
+    for monitor in monitors:
+        if urgent_first and is_urgent(monitor):
+            num = released
+        else:
+            num = max(int(monitor_offset_secs(monitor, spread) // slice_len), released)
+        queues.setdefault(num, []).append(monitor)
+        while released <= last_num and start_ts + (released + 1) * slice_len <= time.time():
+            if released in queues:
+                yield queues.pop(released)
+            released += 1
+
+    for num in sorted(queues):
+        delay = start_ts + num * slice_len - time.time()
+        if delay > 0:
+            sleep(delay)
+        yield queues[num]
+
+
+def host_groups(
+    monitors: Iterable[UptimeMonitorModel], window: int
+) -> Iterator[list[UptimeMonitorModel]]:
+    """
+    Group the monitors by host, reading up to `window` monitors ahead. Groups come in the order of
+    their first monitor, and within a group, monitors of the same URL are next to each other.
+    """
+    groups: dict[str, list[UptimeMonitorModel]] = {}
+    buffered = 0
+
+    def flush() -> Iterator[list[UptimeMonitorModel]]:
+        for group in groups.values():
+            yield sorted(group, key=lambda m: str(m.url))
+
+    for monitor in monitors:
+        groups.setdefault(str(monitor.url.host), []).append(monitor)
+        buffered += 1
+        if buffered >= window:
+            yield from flush()
+            groups, buffered = {}, 0
+    yield from flush()
+
+
+def chunk_monitors(
+    monitors: Iterable[UptimeMonitorModel],
+    max_size: int | None = None,
+    max_bytes: int = MAX_CHUNK_BYTES,
+) -> Iterator[list[dict]]:
+    """
+    Group monitors into chunks of DynamoDB items for run_checks_batch. Chunks hold up to
+    `max_size` monitors, but are cut short when monitors are large (e.g. lots of assertions) so
+    the payload stays under `max_bytes`.
+
+    Monitors of the same host (within CHUNK_GROUP_WINDOW chunks of each other) go in the same chunk
+    where they fit, so one invocation's host limits cover all of them (see run_checks_async()), and
+    monitors of the same URL can share a request. Host limits are per invocation, so a host with
+    more monitors than fit in a chunk is split over several invocations that don't share them.
+
+    Items are sent in DynamoDB format so workers can decode them without re-validating.
+    """
+    max_size = max_size or chunk_size()
+    chunk, chunk_bytes = [], 0
+    for group in host_groups(monitors, max_size * CHUNK_GROUP_WINDOW):
+        items = [UptimeMonitorTable.model_to_ddb(monitor) for monitor in group]
+        sizes = [len(json.dumps(item)) for item in items]
+        # Start a new chunk rather than split the group, unless it's too big for one anyway
+        if chunk and (len(chunk) + len(items) > max_size or chunk_bytes + sum(sizes) > max_bytes):
+            yield chunk
+            chunk, chunk_bytes = [], 0
+        for item, item_bytes in zip(items, sizes, strict=True):
+            if chunk and (len(chunk) >= max_size or chunk_bytes + item_bytes > max_bytes):
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(item)
+            chunk_bytes += item_bytes
+    if chunk:
+        yield chunk
+
+
+def invoke_all(invoke: Callable, calls: Iterable[tuple], concurrency: int = DISPATCH_CONCURRENCY):
+    """
+    Call `invoke(*args)` for each args tuple, `concurrency` at a time. Calls are submitted as the
+    iterable produces them, so it's never read far ahead. A failed call is logged and doesn't stop
+    the rest. Returns the number of calls that succeeded.
+    """
+    executor = get_executor('dispatch', max_workers=concurrency)
+    pending: set[Future] = set()
+    succeeded = 0
+
+    def collect(futures: Iterable[Future]):
+        nonlocal succeeded
+        for future in futures:
+            if future.exception():
+                log.error('Task invoke failed', exc_info=future.exception())
+            else:
+                succeeded += 1
+
+    for args in calls:
+        if len(pending) >= concurrency:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+        pending.add(executor.submit(invoke, *args))
+    collect(wait(pending).done)
+    return succeeded
@@ -0,0 +1,141 @@
+import asyncio
+from collections.abc import AsyncIterator, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+import os
+import threading
+import time
+from typing import Any
+
+
+# Requests to one host that may be in flight at once
+DEFAULT_HOST_CONCURRENCY = 8
+# Least time between the starts of two requests to one host
+DEFAULT_HOST_SPACING_MS = 25
+# Hosts with a start time on record before the passed ones are dropped
+PRUNE_MIN_HOSTS = 1000
+
+
+def host_concurrency() -> int:
+    return int(os.environ.get('CRITIC_HOST_CONCURRENCY', DEFAULT_HOST_CONCURRENCY))
+
+
+def host_spacing_secs() -> float:
+    return int(os.environ.get('CRITIC_HOST_SPACING_MS', DEFAULT_HOST_SPACING_MS)) / 1000
+
+
+def configured() -> bool:
+    """Whether host limits were set (CRITIC_HOST_CONCURRENCY or CRITIC_HOST_SPACING_MS)."""
+    return any(
+        os.environ.get(name) for name in ('CRITIC_HOST_CONCURRENCY', 'CRITIC_HOST_SPACING_MS')
+    )
+
+
+class _HostSchedule:
+    """
+    Keeps requests to each host under a concurrency cap and spaces out their starts, so a burst
+    of checks against one customer host (e.g. at the top of the minute) doesn't get us rate
+    limited. Callers time how long hold() makes them wait and report it as queueing delay, apart
+    from the request's latency.
+
+    The limits only cover the requests of one process (or event loop): with single dispatch, each
+    check is its own Lambda invocation and nothing is limited. In batch mode, a host's monitors go
+    to the same invocation where they fit (see dispatch.chunk_monitors()).
+
+    State is only kept for hosts with requests in flight or waiting, or a start time still ahead,
+    so a long-lived worker doesn't accumulate an entry for every host it has ever checked.
+    """
+
+    def __init__(self, concurrency: int | None = None, spacing_secs: float | None = None):
+        self.concurrency = concurrency or host_concurrency()
+        self.spacing_secs = host_spacing_secs() if spacing_secs is None else spacing_secs
+        self._next_start: dict[str, float] = {}
+        self._prune_at = PRUNE_MIN_HOSTS
+        # Each host's semaphore and how many callers hold it or wait on it
+        self._slots: dict[str, list] = {}
+
+    def _reserve(self, host: str) -> float:
+        """Take the host's next start time and return how long until it."""
+        now = time.monotonic()
+        if len(self._next_start) >= self._prune_at:
+            # Drop start times that have passed; amortized over the reservations since the last go
+            self._next_start = {h: t for h, t in self._next_start.items() if t > now}
+            self._prune_at = max(PRUNE_MIN_HOSTS, 2 * len(self._next_start))
+        start = max(now, self._next_start.get(host, now))
+        self._next_start[host] = start + self.spacing_secs
+        return start - now
+
+    def _join(self, host: str, new_slots: Callable[[int], Any]) -> Any:
+        """Count a caller of the host's slots, and return them."""
+        entry = self._slots.setdefault(host, [new_slots(self.concurrency), 0])
+        entry[1] += 1
+        return entry[0]
+
+    def _leave(self, host: str) -> None:
+        """Uncount a caller of the host's slots, and forget them once nobody is using them."""
+        entry = self._slots[host]
+        entry[1] -= 1
+        if not entry[1]:
+            del self._slots[host]
+
+
+class HostLimits(_HostSchedule):
+    """Per-host limits for requests made from threads (see _HostSchedule)."""
+
+    def __init__(self, concurrency: int | None = None, spacing_secs: float | None = None):
+        super().__init__(concurrency, spacing_secs)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def hold(self, host: str) -> Iterator[None]:
+        """Wait for the host to allow another request, and hold its slot until exiting."""
+        with self._lock:
+            slots = self._join(host, threading.Semaphore)
+        try:
+            with slots:
+                with self._lock:
+                    delay = self._reserve(host)
+                if delay > 0:
+                    time.sleep(delay)
+                yield
+        finally:
+            with self._lock:
+                self._leave(host)
+
+
+class AsyncHostLimits(_HostSchedule):
+    """
+    Per-host limits for requests made on an event loop (see _HostSchedule). asyncio primitives
+    belong to one loop, so make one of these per loop.
+
+    hold() takes the host's slot and then its turn. A caller that also waits on a shared limit
+    should take slot() before the shared limit and wait_turn() after it: the spacing is then
+    reserved when the request is about to go out, not before a wait of unknown length that would
+    let same-host requests bunch up again.
+    """
+
+    @asynccontextmanager
+    async def slot(self, host: str) -> AsyncIterator[None]:
+        """Wait for one of the host's concurrent slots, and hold it until exiting."""
+        slots = self._join(host, asyncio.Semaphore)
+        try:
+            async with slots:
+                yield
+        finally:
+            self._leave(host)
+
+    async def wait_turn(self, host: str) -> None:
+        """Wait for the host's next start time."""
+        delay = self._reserve(host)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def hold(self, host: str) -> AsyncIterator[None]:
+        """Wait for the host to allow another request, and hold its slot until exiting."""
+        async with self.slot(host):
+            await self.wait_turn(host)
+            yield
+
+
+# Shared by every thread in the process
+limits = HostLimits()
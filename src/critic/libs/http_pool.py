@@ -0,0 +1,136 @@
+from collections import OrderedDict
+from collections.abc import Iterator
+from contextlib import contextmanager
+import importlib.util
+import logging
+import os
+import threading
+
+import httpx
+
+
+log = logging.getLogger(__name__)
+
+# Idle keep-alive connections kept open per host. Checks against a host reuse these instead of
+# paying for DNS, TCP and TLS setup on every request.
+DEFAULT_KEEPALIVE_PER_HOST = 10
+# How long an idle connection is kept before it's closed
+DEFAULT_KEEPALIVE_EXPIRY_SECS = 60
+# Hosts with their own client. The least recently used client is closed past this.
+DEFAULT_MAX_HOSTS = 1000
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.environ.get(name, default))
+
+
+def http2_enabled() -> bool:
+    """HTTP/2 is opt-in (CRITIC_HTTP2=1) and needs the h2 package (httpx[http2])."""
+    if os.environ.get('CRITIC_HTTP2') != '1':
+        return False
+    if importlib.util.find_spec('h2') is None:
+        log.warning('CRITIC_HTTP2 is set but h2 is not installed, using HTTP/1.1')
+        return False
+    return True
+
+
+def limits(max_connections: int | None = None) -> httpx.Limits:
+    keepalive = _env_int('CRITIC_HTTP_KEEPALIVE_PER_HOST', DEFAULT_KEEPALIVE_PER_HOST)
+    return httpx.Limits(
+        max_connections=max_connections,
+        # A client shared across hosts keeps every connection it may use open
+        max_keepalive_connections=max(keepalive, max_connections or 0),
+        keepalive_expiry=_env_int(
+            'CRITIC_HTTP_KEEPALIVE_EXPIRY_SECS', DEFAULT_KEEPALIVE_EXPIRY_SECS
+        ),
+    )
+
+
+def new_async_client(max_connections: int | None = None, **kwargs) -> httpx.AsyncClient:
+    """
+    An async client configured like the pooled ones. Async clients are bound to the event loop
+    they're used on, so they can't be pooled across invocations; share one per batch instead.
+
+    Size it for the requests the batch has in flight (`max_connections`, e.g. the batch's
+    concurrency): it opens that many connections at most and keeps them all alive between
+    requests, so a request that's been let through never waits on the pool for a connection (that
+    would count towards its latency).
+    """
+    return httpx.AsyncClient(limits=limits(max_connections), http2=http2_enabled(), **kwargs)
+
+
+class ClientPool:
+    """
+    Process-wide httpx clients, one per origin (scheme, host and port), so connections survive
+    across checks in a worker loop and across warm Lambda invocations. Clients are thread-safe, so
+    one pool is shared by every thread in the process.
+
+    Callers hold a client while using it (see hold()), so a client evicted for another origin is
+    only closed once nobody is using it.
+    """
+
+    def __init__(self):
+        self._clients: OrderedDict[tuple, httpx.Client] = OrderedDict()
+        # Holders by client, for clients in use
+        self._holders: dict[httpx.Client, int] = {}
+        # Clients evicted while in use, closed when their last holder releases them
+        self._retired: set[httpx.Client] = set()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def origin(url: str | httpx.URL) -> tuple:
+        url = httpx.URL(str(url))
+        return url.scheme, url.host, url.port
+
+    @staticmethod
+    def new_client(**kwargs) -> httpx.Client:
+        return httpx.Client(limits=limits(), http2=http2_enabled(), **kwargs)
+
+    def _retire(self, clients: list[httpx.Client]) -> list[httpx.Client]:
+        """Mark removed clients that are in use to close later. Returns the ones to close now."""
+        idle = [c for c in clients if c not in self._holders]
+        self._retired.update(c for c in clients if c in self._holders)
+        return idle
+
+    @contextmanager
+    def hold(self, url: str | httpx.URL) -> Iterator[httpx.Client]:
+        """Use the shared client for the URL's origin, creating it if needed."""
+        key = self.origin(url)
+        evicted = []
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._clients[key] = self.new_client()
+                max_hosts = _env_int('CRITIC_HTTP_MAX_HOSTS', DEFAULT_MAX_HOSTS)
+                while len(self._clients) > max_hosts:
+                    evicted.append(self._clients.popitem(last=False)[1])
+            else:
+                self._clients.move_to_end(key)
+            self._holders[client] = self._holders.get(client, 0) + 1
+            to_close = self._retire(evicted)
+        for old in to_close:
+            old.close()
+
+        try:
+            yield client
+        finally:
+            with self._lock:
+                remaining = self._holders.pop(client) - 1
+                if remaining:
+                    self._holders[client] = remaining
+                retired = not remaining and client in self._retired
+                if retired:
+                    self._retired.remove(client)
+            if retired:
+                client.close()
+
+    def close(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+            to_close = self._retire(clients)
+        for client in to_close:
+            client.close()
+
+
+pool = ClientPool()
@@ -1,6 +1,6 @@
 import os
 
-import httpx
+from critic.libs.http_pool import pool
 
 
 class MailgunError(Exception):
@@ -22,15 +22,17 @@ def send_email(to_email: str, subject: str, text: str) -> None:
     if not to_email:
         raise MailgunError('Missing recipient email')
 
-    resp = httpx.post(
-        f'https://api.mailgun.net/v3/{domain}/messages',
-        auth=('api', api_key),
-        data={
-            'from': mail_from,
-            'to': to_email,
-            'subject': subject,
-            'text': text,
-        },
-        timeout=10,
-    )
+    url = f'https://api.mailgun.net/v3/{domain}/messages'
+    with pool.hold(url) as client:
+        resp = client.post(
+            url,
+            auth=('api', api_key),
+            data={
+                'from': mail_from,
+                'to': to_email,
+                'subject': subject,
+                'text': text,
+            },
+            timeout=10,
+        )
     resp.raise_for_status()
@@ -1,6 +1,6 @@
 import os
 
-import httpx
+from critic.libs.http_pool import pool
 
 
 class SlackError(Exception):
@@ -12,11 +12,12 @@ def post_webhook(webhook_url: str, text: str) -> None:
     if not webhook_url:
         raise SlackError('Missing webhook_url')
 
-    resp = httpx.post(
-        webhook_url,
-        json={'text': text},
-        timeout=10,
-    )
+    with pool.hold(webhook_url) as client:
+        resp = client.post(
+            webhook_url,
+            json={'text': text},
+            timeout=10,
+        )
     resp.raise_for_status()
 
 
@@ -26,12 +27,14 @@ def post_message(channel: str, text: str) -> None:
     if not token:
         raise SlackError('Missing SLACK_BOT_TOKEN')
 
-    resp = httpx.post(
-        'https://slack.com/api/chat.postMessage',
-        headers={'Authorization': f'Bearer {token}'},
-        json={'channel': channel, 'text': text},
-        timeout=10,
-    )
+    url = 'https://slack.com/api/chat.postMessage'
+    with pool.hold(url) as client:
+        resp = client.post(
+            url,
+            headers={'Authorization': f'Bearer {token}'},
+            json={'channel': channel, 'text': text},
+            timeout=10,
+        )
     resp.raise_for_status()
     data = resp.json()
     if not data.get('ok'):
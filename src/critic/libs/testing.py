@@ -44,6 +44,8 @@ def create_tables():
                 'Projection': {'ProjectionType': 'ALL'},
             }
         ],
+        # The worker follows changes to monitors from the stream
+        StreamSpecification={'StreamEnabled': True, 'StreamViewType': 'NEW_IMAGE'},
         BillingMode='PAY_PER_REQUEST',
     )
 
@@ -60,6 +62,55 @@ def create_tables():
         BillingMode='PAY_PER_REQUEST',
     )
 
+    client.create_table(
+        TableName=Table.namespace('UptimeLogRing'),
+        AttributeDefinitions=[
+            # Key attributes
+            {'AttributeName': 'monitor_id', 'AttributeType': 'S'},
+            {'AttributeName': 'slot', 'AttributeType': 'N'},
+            # LSI attributes
+            {'AttributeName': 'timestamp', 'AttributeType': 'S'},
+        ],
+        KeySchema=[
+            {'AttributeName': 'monitor_id', 'KeyType': 'HASH'},
+            {'AttributeName': 'slot', 'KeyType': 'RANGE'},
+        ],
+        LocalSecondaryIndexes=[
+            {
+                'IndexName': 'TimestampIndex',
+                'KeySchema': [
+                    {'AttributeName': 'monitor_id', 'KeyType': 'HASH'},
+                    {'AttributeName': 'timestamp', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+            }
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
+    client.create_table(
+        TableName=Table.namespace('AlertOutbox'),
+        AttributeDefinitions=[
+            {'AttributeName': 'id', 'AttributeType': 'S'},
+            {'AttributeName': 'pending', 'AttributeType': 'S'},
+            {'AttributeName': 'created_at', 'AttributeType': 'S'},
+        ],
+        KeySchema=[
+            {'AttributeName': 'id', 'KeyType': 'HASH'},
+        ],
+        GlobalSecondaryIndexes=[
+            {
+                'IndexName': 'PendingIndex',
+                'KeySchema': [
+                    {'AttributeName': 'pending', 'KeyType': 'HASH'},
+                    {'AttributeName': 'created_at', 'KeyType': 'RANGE'},
+                ],
+                'Projection': {'ProjectionType': 'ALL'},
+            }
+        ],
+        BillingMode='PAY_PER_REQUEST',
+    )
+
 
 def _clear_table(table_name: str):
     """Delete all items from a DDB table without deleting the table itself."""
@@ -98,7 +149,8 @@ def _clear_table(table_name: str):
 
 
 def clear_tables():
-    for table_name in [Table.namespace(t) for t in ('Project', 'UptimeMonitor', 'UptimeLog')]:
+    tables = ('Project', 'UptimeMonitor', 'UptimeLog', 'UptimeLogRing', 'AlertOutbox')
+    for table_name in [Table.namespace(t) for t in tables]:
         _clear_table(table_name)
 
 
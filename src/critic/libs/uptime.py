@@ -1,35 +1,132 @@
+import asyncio
+import codecs
+from collections.abc import Iterable
+from contextlib import nullcontext
 from datetime import UTC, datetime, timedelta
 from functools import cached_property
 import logging
+import os
 import time
 
 import httpx
 
 from critic.alerts import maybe_send_alerts
+from critic.libs import host_limits, http_pool
+from critic.libs.assertions import CONTENT_SUBJECTS, BodyWatch, evaluate_all
+from critic.libs.ddb import Table, get_executor, transact_write
 from critic.libs.dt import round_minute
-from critic.models import MonitorState, UptimeLogModel, UptimeMonitorModel
-from critic.tables import UptimeLogTable, UptimeMonitorTable
+from critic.models import (
+    BodyCacheModel,
+    MonitorState,
+    UptimeLogModel,
+    UptimeLogSlotModel,
+    UptimeMonitorModel,
+)
+from critic.tables import (
+    ProjectTable,
+    UptimeLogRingTable,
+    UptimeLogTable,
+    UptimeMonitorTable,
+    log_layout,
+)
 
 
 log = logging.getLogger(__name__)
 
+# Checks in one batch that may have a request in flight at once
+DEFAULT_CHECK_CONCURRENCY = 100
+# Checks of one project in a batch that may have a request in flight at once. 0 is no cap.
+DEFAULT_PROJECT_CONCURRENCY = 0
+# Most of a response body read for body assertions
+DEFAULT_MAX_BODY_BYTES = 1024 * 1024
+# How long a claimed check has to finish before its monitor is due again (see UptimeCheck.claim())
+DEFAULT_CLAIM_LEASE_MINS = 2
+
 
 class MonitorNotFoundError(ValueError):
     pass
 
 
+def max_body_bytes() -> int:
+    return int(os.environ.get('CRITIC_MAX_BODY_BYTES', DEFAULT_MAX_BODY_BYTES))
+
+
+def transact_commit_enabled() -> bool:
+    """Save each check's monitor update and log in one transaction (CRITIC_TRANSACT_COMMIT=1)."""
+    return os.environ.get('CRITIC_TRANSACT_COMMIT') == '1'
+
+
+def claims_enabled() -> bool:
+    """Claim monitors before checking them (CRITIC_CLAIM_CHECKS=1, see UptimeCheck.claim())."""
+    return os.environ.get('CRITIC_CLAIM_CHECKS') == '1'
+
+
+def claim_lease_mins() -> int:
+    return int(os.environ.get('CRITIC_CLAIM_LEASE_MINS', DEFAULT_CLAIM_LEASE_MINS))
+
+
+class BodyReader:
+    """
+    Collects a streamed response body for checking body assertions. Reading stops once the
+    assertions are decided (see BodyWatch) or max_body_bytes() have been read, so a check never
+    holds more than that much of a body. Assertions about anything past the limit fail.
+
+    The body is decoded as it arrives so the watch can search it.
+    """
+
+    def __init__(self, response: httpx.Response, watch: BodyWatch, start: float):
+        self.streamed = response
+        self.watch = watch
+        # Time to the response headers, which is what a HEAD request's latency measures
+        self.elapsed = timedelta(seconds=time.perf_counter() - start)
+        self.max_bytes = max_body_bytes()
+        self.chunks: list[bytes] = []
+        self.size = 0
+        self.decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        self.text = ''
+
+    def feed(self, chunk: bytes) -> bool:
+        """Add a chunk of the body. Returns True once there's no need to read more."""
+        chunk = chunk[: self.max_bytes - self.size]
+        self.chunks.append(chunk)
+        self.size += len(chunk)
+        self.text += self.decoder.decode(chunk)
+        return self.size >= self.max_bytes or self.watch.decided(self.text)
+
+    def response(self) -> httpx.Response:
+        """The response with the body as far as it was read, and the headers as they were sent."""
+        # The chunks are already decompressed, so they're read in without Content-Encoding, which
+        # would decompress them again. The original headers go back on afterwards for header
+        # assertions, like on a HEAD response.
+        response = httpx.Response(
+            self.streamed.status_code,
+            content=b''.join(self.chunks),
+            request=self.streamed.request,
+            extensions=self.streamed.extensions,
+        )
+        response.headers = self.streamed.headers
+        response.elapsed = self.elapsed
+        return response
+
+
 class UptimeCheck:
     """
     This class is responsible for running a single uptime check for a given monitor. It handles
     making the request, checking the response, updating the monitor, and saving a log.
     """
 
-    def __init__(self, project_id: str, monitor_slug: str):
+    def __init__(
+        self,
+        project_id: str,
+        monitor_slug: str,
+        monitor: UptimeMonitorModel | None = None,
+    ):
         self.now = datetime.now(UTC)
         self.project_id = project_id
         self.monitor_slug = monitor_slug
 
-        self.monitor: UptimeMonitorModel | None = UptimeMonitorTable.get(
+        # Callers that already loaded the monitor (e.g. batches) can pass it to save a read.
+        self.monitor: UptimeMonitorModel | None = monitor or UptimeMonitorTable.get(
             self.project_id, self.monitor_slug
         )
         if not self.monitor:
@@ -38,6 +135,14 @@ class UptimeCheck:
         # Used internally to make sure we don't duplicate DB operations
         self._updated_monitor = False
         self._put_log = False
+        # The next_due_at claim() set, which update_monitor() then expects
+        self.claimed_due_at: datetime | None = None
+        # The updates update_monitor() saved, once it has (None if it lost a race or never ran)
+        self.saved_updates: dict | None = None
+        # Assertion results from check_resp()
+        self.results: list[tuple[bool, str | None]] = []
+        # Time spent waiting to send the request (for the batch or the host's limits)
+        self.queue_secs = 0.0
 
     @cached_property
     def new_next_due_at(self):
@@ -53,6 +158,29 @@ class UptimeCheck:
 
         return next_due_at
 
+    def claim(self) -> bool:
+        """
+        Claim the monitor before making its request, so when two invocations race for a check only
+        one of them sends the request. The claim moves next_due_at to the end of a lease (a
+        conditional write like update_monitor()'s), which takes the monitor off the due list
+        while the check runs. update_monitor() then sets the real next due time. If the check
+        never finishes, the monitor comes due again when the lease runs out.
+
+        Returns True if the claim was won.
+        """
+        lease_due_at = round_minute(self.now) + timedelta(minutes=claim_lease_mins())
+        claimed = UptimeMonitorTable.update(
+            self.project_id,
+            self.monitor_slug,
+            updates={'next_due_at': lease_due_at},
+            condition={'next_due_at': self.monitor.next_due_at},
+        )
+        if claimed:
+            self.claimed_due_at = lease_due_at
+        else:
+            log.info(f'Monitor {self.monitor.id} was claimed by another check, skipping')
+        return claimed
+
     def update_monitor(self, updates: dict | None = None) -> bool:
         """
         Updates the monitor with the given updates and also updates the next due time. This method
@@ -64,32 +192,170 @@ class UptimeCheck:
             raise Exception(
                 'Monitor already updated! Do not call this method more than once in one run.'
             )
-        if updates is None:
-            updates = {}
+        updates = {**(updates or {}), 'next_due_at': self.new_next_due_at}
         updated = UptimeMonitorTable.update(
             self.project_id,
             self.monitor_slug,
-            updates={**updates, 'next_due_at': self.new_next_due_at},
-            condition={'next_due_at': self.monitor.next_due_at},
+            updates=updates,
+            condition={'next_due_at': self.claimed_due_at or self.monitor.next_due_at},
         )
         self._updated_monitor = True
+        if updated:
+            self.saved_updates = updates
         return updated
 
+    @cached_property
+    def body_watch(self) -> BodyWatch | None:
+        return BodyWatch.for_assertions(self.monitor.assertions)
+
+    @cached_property
+    def content_assertions(self) -> list[str]:
+        return [
+            a.assertion_string
+            for a in self.monitor.assertions
+            if a.assertion_object in CONTENT_SUBJECTS
+        ]
+
+    def conditional_headers(self) -> dict[str, str]:
+        """
+        Validators from the last full response, if its cached results cover all the content
+        assertions (they won't once an assertion is added or edited).
+        """
+        cache = self.monitor.body_cache
+        if cache is None or not set(self.content_assertions) <= cache.results.keys():
+            return {}
+        headers = {}
+        if cache.etag:
+            headers['If-None-Match'] = cache.etag
+        if cache.last_modified:
+            headers['If-Modified-Since'] = cache.last_modified
+        return headers
+
+    def evaluate(self, response: httpx.Response) -> list[tuple[bool, str | None]]:
+        cache = self.monitor.body_cache
+        if response.status_code != httpx.codes.NOT_MODIFIED or cache is None:
+            return evaluate_all(self.monitor.assertions, response)
+        # The content (and so its status) is what the cached results came from. Response time is
+        # still this response's.
+        revalidated = httpx.Response(
+            cache.status_code, headers=response.headers, request=response.request
+        )
+        revalidated.elapsed = response.elapsed
+        return evaluate_all(self.monitor.assertions, revalidated, cached=cache.results)
+
+    def body_cache_updates(
+        self, response: httpx.Response | None, results: list[tuple[bool, str | None]]
+    ) -> dict:
+        """Monitor updates that cache the results of a full GET, if it can be revalidated."""
+        if (
+            response is None
+            or self.body_watch is None
+            or response.status_code == httpx.codes.NOT_MODIFIED
+        ):
+            return {}
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return {'body_cache': None} if self.monitor.body_cache else {}
+        cache = BodyCacheModel(
+            etag=etag,
+            last_modified=last_modified,
+            status_code=response.status_code,
+            results={
+                a.assertion_string: error
+                for a, (_passed, error) in zip(self.monitor.assertions, results, strict=True)
+                if a.assertion_object in CONTENT_SUBJECTS
+            },
+        )
+        return {'body_cache': cache.model_dump(mode='json')}
+
+    def request_key(self) -> tuple | None:
+        """
+        Checks with equal keys send the same request, so a batch can send it once for all of them.
+        Cold-connection checks time their own connection setup, so they don't share (None).
+        """
+        if self.monitor.cold_connection:
+            return None
+        return (
+            str(self.monitor.url),
+            'HEAD' if self.body_watch is None else 'GET',
+            float(self.monitor.timeout_secs),
+            tuple(sorted(self.conditional_headers().items())),
+        )
+
     def make_req(self) -> tuple[httpx.Response | None, float]:
         """
         Makes the request and returns the response and the time it took to make the request.
+        Waiting for the host's limits (see host_limits) is recorded as queue_secs, not latency.
         """
-        start = time.perf_counter()
-        with httpx.Client() as client:
+        url = str(self.monitor.url)
+        queued_at = time.perf_counter()
+        with host_limits.limits.hold(self.monitor.url.host):
+            start = time.perf_counter()
+            self.queue_secs = start - queued_at
             try:
-                response: httpx.Response = client.head(
-                    str(self.monitor.url), timeout=float(self.monitor.timeout_secs)
-                )
+                if self.monitor.cold_connection:
+                    # A fresh client so the latency includes DNS, TCP and TLS setup
+                    with http_pool.pool.new_client() as client:
+                        response = self.send(client, url, start)
+                else:
+                    with http_pool.pool.hold(url) as client:
+                        response = self.send(client, url, start)
             except httpx.TimeoutException:
                 response = None
+        return response, self.latency(response, start)
+
+    def send(self, client: httpx.Client, url: str, start: float) -> httpx.Response:
+        """
+        HEAD the URL, or GET it if there are body assertions, reading the body only until they're
+        decided (see BodyReader).
+        """
+        timeout = float(self.monitor.timeout_secs)
+        if self.body_watch is None:
+            return client.head(url, timeout=timeout)
+        headers = self.conditional_headers()
+        with client.stream('GET', url, timeout=timeout, headers=headers) as response:
+            reader = BodyReader(response, self.body_watch, start)
+            if response.status_code != httpx.codes.NOT_MODIFIED:
+                for chunk in response.iter_bytes():
+                    if reader.feed(chunk):
+                        break
+        return reader.response()
+
+    async def make_req_async(
+        self, client: httpx.AsyncClient
+    ) -> tuple[httpx.Response | None, float]:
+        """Like make_req(), but on a shared async client (see run_batch())."""
+        url = str(self.monitor.url)
+        start = time.perf_counter()
+        try:
+            if self.monitor.cold_connection:
+                async with http_pool.new_async_client() as cold_client:
+                    response = await self.send_async(cold_client, url, start)
+            else:
+                response = await self.send_async(client, url, start)
+        except httpx.TimeoutException:
+            response = None
+        return response, self.latency(response, start)
+
+    async def send_async(self, client: httpx.AsyncClient, url: str, start: float) -> httpx.Response:
+        """Like send(), but on an async client."""
+        timeout = float(self.monitor.timeout_secs)
+        if self.body_watch is None:
+            return await client.head(url, timeout=timeout)
+        headers = self.conditional_headers()
+        async with client.stream('GET', url, timeout=timeout, headers=headers) as response:
+            reader = BodyReader(response, self.body_watch, start)
+            if response.status_code != httpx.codes.NOT_MODIFIED:
+                async for chunk in response.aiter_bytes():
+                    if reader.feed(chunk):
+                        break
+        return reader.response()
+
+    @staticmethod
+    def latency(response: httpx.Response | None, start: float) -> float:
         finished = time.perf_counter()
-        latency = response.elapsed.total_seconds() * 1000 if response else (finished - start)
-        return response, latency
+        return response.elapsed.total_seconds() * 1000 if response else (finished - start)
 
     def alert(self, prev_state: MonitorState, prev_consecutive_fails: int):
         maybe_send_alerts(
@@ -107,8 +373,8 @@ class UptimeCheck:
 
         if response:
             if self.monitor.assertions != []:
-                for assertions in self.monitor.assertions:
-                    passed, error_message = assertions.evaluate(response)
+                self.results = self.evaluate(response)
+                for passed, error_message in self.results:
                     if not passed:
                         error_messages.append(error_message)
                 if not error_messages:
@@ -123,38 +389,110 @@ class UptimeCheck:
 
         return state, consecutive_fails, error_messages
 
-    def put_log(
+    def next_log_counter(self) -> int:
+        """
+        The table layout only needs to know when retention_limit is reached, so the counter stops
+        there. The ring layout derives slots from it, so it keeps counting.
+        """
+        if log_layout() == 'ring':
+            return self.monitor.log_counter + 1
+        return min(self.monitor.log_counter + 1, UptimeLogTable.retention_limit)
+
+    def new_log(
         self,
         state: MonitorState,
         status_code: int,
         latency: float,
         error_messages: list[str],
         log_counter: int,
-    ):
-        """
-        Puts a log for the check. This method should only be called once per monitor check.
-        """
-        if self._put_log:
-            raise Exception('Log already put! Do not call this method more than once in one run.')
+    ) -> tuple[type[Table], UptimeLogModel]:
+        """The log for the check, and the table it goes in under the current log layout."""
         uptime_log = UptimeLogModel(
             monitor_id=self.monitor.id,
             timestamp=self.now,
             status=state,
             resp_code=status_code,
             latency_secs=latency,
+            queue_secs=self.queue_secs,
             error_message=error_messages if error_messages else None,
         )
-        if log_counter >= UptimeLogTable.retention_limit:
-            # The "-1" is to make room for the log we're about to put.
+        if log_layout() == 'ring':
+            # Overwrites the oldest log once the ring is full, so there's nothing to prune.
+            slot = UptimeLogRingTable.slot(log_counter)
+            return UptimeLogRingTable, UptimeLogSlotModel(**dict(uptime_log), slot=slot)
+        return UptimeLogTable, uptime_log
+
+    def prune_logs(self, log_counter: int):
+        """Make room for one more log once the table layout's retention limit is reached."""
+        if log_layout() != 'ring' and log_counter >= UptimeLogTable.retention_limit:
+            # The "-1" is to make room for the log we're putting.
             UptimeLogTable.prune(
                 self.monitor.id, log_counter - (UptimeLogTable.retention_limit - 1)
             )
-        UptimeLogTable.put(uptime_log)
+
+    def put_log(
+        self,
+        state: MonitorState,
+        status_code: int,
+        latency: float,
+        error_messages: list[str],
+        log_counter: int,
+    ):
+        """
+        Puts a log for the check. This method should only be called once per monitor check.
+        """
+        if self._put_log:
+            raise Exception('Log already put! Do not call this method more than once in one run.')
+        table, uptime_log = self.new_log(state, status_code, latency, error_messages, log_counter)
+        self.prune_logs(log_counter)
+        table.put(uptime_log)
         self._put_log = True
 
+    def commit(
+        self,
+        updates: dict,
+        status_code: int,
+        latency: float,
+        error_messages: list[str],
+    ) -> bool:
+        """
+        update_monitor() and put_log() in one TransactWriteItems call: one round trip instead of
+        two, and the log is only written if the update is. Pruning (table layout only) still
+        takes its own calls, after the commit.
+
+        Returns True if committed, False if the update's condition failed (a race).
+        """
+        if self._updated_monitor or self._put_log:
+            raise Exception(
+                'Check already saved! Do not call this method more than once in one run.'
+            )
+        updates = {**updates, 'next_due_at': self.new_next_due_at}
+        log_counter = self.monitor.log_counter
+        table, uptime_log = self.new_log(
+            updates['state'], status_code, latency, error_messages, log_counter
+        )
+        committed = transact_write(
+            [
+                {
+                    'Update': UptimeMonitorTable.update_request(
+                        self.project_id,
+                        self.monitor_slug,
+                        updates=updates,
+                        condition={'next_due_at': self.claimed_due_at or self.monitor.next_due_at},
+                    )
+                },
+                {'Put': table.put_request(uptime_log)},
+            ]
+        )
+        self._updated_monitor = self._put_log = True
+        if committed:
+            self.saved_updates = updates
+            self.prune_logs(log_counter)
+        return committed
+
     def run(self):
         """
-        1. Make the request
+        1. Claim the monitor (with CRITIC_CLAIM_CHECKS=1) and make the request
         2. Check the response
         3. Update the monitor
         4. Save a log
@@ -166,26 +504,40 @@ class UptimeCheck:
             self.update_monitor()
             return
 
-        # Capture previous values for alert logic
-        prev_state = self.monitor.state
-        prev_consecutive_fails = self.monitor.consecutive_fails
+        if claims_enabled() and not self.claim():
+            return
 
         # Make the request
         resp, latency = self.make_req()
 
+        self.record(resp, latency)
+
+    def record(self, resp: httpx.Response | None, latency: float):
+        """
+        Everything after the request: check the response, update the monitor, alert and save a
+        log.
+        """
+        # Capture previous values for alert logic
+        prev_state = self.monitor.state
+        prev_consecutive_fails = self.monitor.consecutive_fails
+
         # Check the response (also kicks off alerts if needed)
         state, consecutive_fails, error_messages = self.check_resp(resp)
 
-        # Update the monitor
-        updated = self.update_monitor(
-            {
-                'state': state,
-                'consecutive_fails': consecutive_fails,
-                'log_counter': min(self.monitor.log_counter + 1, UptimeLogTable.retention_limit),
-            }
-        )
+        updates = {
+            'state': state,
+            'consecutive_fails': consecutive_fails,
+            'log_counter': self.next_log_counter(),
+            **self.body_cache_updates(resp, self.results),
+        }
+        status_code = resp.status_code if resp else 0
+
+        if transact_commit_enabled():
+            # Update the monitor and save a log together
+            updated = self.commit(updates, status_code, latency, error_messages)
+        else:
+            updated = self.update_monitor(updates)
 
-        # Save a log
         if updated:
             # Keep the in-memory monitor consistent for alert formatting/logic
             self.monitor.state = state
@@ -194,10 +546,126 @@ class UptimeCheck:
             # Alerts (only if update succeeded to prevent duplicates on race conditions)
             self.alert(prev_state, prev_consecutive_fails)
 
-            self.put_log(
-                state,
-                resp.status_code if resp else 0,
-                latency,
-                error_messages,
-                self.monitor.log_counter,
+            # Save a log
+            if not self._put_log:
+                self.put_log(state, status_code, latency, error_messages, self.monitor.log_counter)
+
+
+def check_concurrency() -> int:
+    return int(os.environ.get('CRITIC_CHECK_CONCURRENCY', DEFAULT_CHECK_CONCURRENCY))
+
+
+def project_concurrency() -> int:
+    return int(os.environ.get('CRITIC_PROJECT_CONCURRENCY', DEFAULT_PROJECT_CONCURRENCY))
+
+
+def project_caps(project_ids: Iterable[str]) -> dict[str, int]:
+    """
+    How many of each project's checks may have a request in flight at once (0 for no cap): the
+    project's check_concurrency, or CRITIC_PROJECT_CONCURRENCY.
+    """
+    project_ids = set(project_ids)
+    projects = ProjectTable.by_id(project_ids)
+    default = project_concurrency()
+    return {
+        pid: (projects[pid].check_concurrency if pid in projects else None) or default
+        for pid in project_ids
+    }
+
+
+async def run_checks_async(
+    checks: list[UptimeCheck], concurrency: int, caps: dict[str, int] | None = None
+):
+    """
+    Run the checks concurrently: requests share one async client (at most `concurrency` in flight,
+    within each project's cap, see project_caps(), and within each host's limits, see host_limits)
+    and each check's DynamoDB writes and alerts run on a thread pool as soon as its response is
+    in.
+    A failing check is logged and doesn't affect the rest of the batch.
+
+    Checks that would send the same request (see UptimeCheck.request_key()) share one. Each still
+    evaluates its own assertions against the response and gets its own update and log.
+
+    With CRITIC_CLAIM_CHECKS=1, every check is claimed up front and the ones claimed elsewhere are
+    dropped before any request goes out.
+    """
+    loop = asyncio.get_running_loop()
+    limit = asyncio.Semaphore(concurrency)
+    per_host = host_limits.AsyncHostLimits()
+    if caps is None:
+        caps = project_caps(str(check.monitor.project_id) for check in checks)
+    per_project = {pid: asyncio.Semaphore(cap) for pid, cap in caps.items() if cap}
+    # The writes are blocking boto3/httpx calls, so they get threads of their own.
+    recorder = get_executor('record', max_workers=32)
+
+    async def record(check: UptimeCheck, *args):
+        try:
+            await loop.run_in_executor(recorder, check.record, *args)
+        except Exception:
+            log.exception(f'Check failed for monitor: {check.monitor.id}')
+
+    async def run_group(group: list[UptimeCheck], client: httpx.AsyncClient):
+        for check in group:
+            log.info(f'Starting check for monitor: {check.monitor.id}')
+        leader = group[0]
+        if len(group) > 1 and leader.body_watch is not None:
+            # Read the shared body until every check's body assertions are decided
+            leader.body_watch = BodyWatch.for_assertions(
+                [a for check in group for a in check.monitor.assertions]
             )
+        queued_at = time.perf_counter()
+        try:
+            # Project and host slots first, so checks waiting on them don't tie up the batch's
+            # slots. The host's spacing is reserved once the request can go out.
+            host = leader.monitor.url.host
+            project = per_project.get(str(leader.monitor.project_id)) or nullcontext()
+            async with project, per_host.slot(host), limit:
+                await per_host.wait_turn(host)
+                queue_secs = time.perf_counter() - queued_at
+                resp, latency = await leader.make_req_async(client)
+        except Exception:
+            for check in group:
+                log.exception(f'Check failed for monitor: {check.monitor.id}')
+            return
+        for check in group:
+            check.queue_secs = queue_secs
+        await asyncio.gather(*(record(check, resp, latency) for check in group))
+
+    async def run_paused(check: UptimeCheck):
+        try:
+            log.info(f'Starting check for monitor: {check.monitor.id}')
+            await loop.run_in_executor(recorder, check.update_monitor)
+        except Exception:
+            log.exception(f'Check failed for monitor: {check.monitor.id}')
+
+    async def claim(check: UptimeCheck) -> bool:
+        try:
+            return await loop.run_in_executor(recorder, check.claim)
+        except Exception:
+            log.exception(f'Check failed for monitor: {check.monitor.id}')
+            return False
+
+    paused = [check for check in checks if check.monitor.state == MonitorState.paused]
+    active = [check for check in checks if check.monitor.state != MonitorState.paused]
+    if claims_enabled():
+        # All claims go out at once, before any request
+        claimed = await asyncio.gather(*(claim(check) for check in active))
+        active = [check for check, won in zip(active, claimed, strict=True) if won]
+    groups: dict[tuple, list[UptimeCheck]] = {}
+    for i, check in enumerate(active):
+        key = check.request_key()
+        groups.setdefault(('solo', i) if key is None else key, []).append(check)
+    if len(groups) < len(active):
+        log.info(f'{len(active)} checks share {len(groups)} requests')
+
+    async with http_pool.new_async_client(max_connections=concurrency) as client:
+        await asyncio.gather(
+            *(run_paused(check) for check in paused),
+            *(run_group(group, client) for group in groups.values()),
+        )
+
+
+def run_batch(monitors: Iterable[UptimeMonitorModel], concurrency: int | None = None):
+    """Run a check for each of the (already loaded) monitors in this process."""
+    checks = [UptimeCheck(str(m.project_id), m.slug, monitor=m) for m in monitors]
+    asyncio.run(run_checks_async(checks, concurrency or check_concurrency()))
@@ -4,10 +4,10 @@ from datetime import UTC, datetime
 from enum import Enum
 from uuid import UUID
 
-from pydantic import AwareDatetime, BaseModel, Field, HttpUrl, field_validator
+from pydantic import AwareDatetime, BaseModel, Field, HttpUrl, field_validator, model_validator
 
 from critic.libs.assertions import Assertion
-from critic.libs.ddb import CONSTANT_GSI_PK
+from critic.libs.ddb import gsi_shard_key
 from critic.libs.dt import to_utc
 
 
@@ -21,6 +21,26 @@ class MonitorState(str, Enum):
 class ProjectModel(BaseModel):
     id: UUID
     name: str
+    # Weight of the project's checks when dispatch interleaves projects (see dispatch.fair_order())
+    check_share: int = Field(ge=1, default=1)
+    # Most of the project's checks a batch runs at once. None falls back to
+    # CRITIC_PROJECT_CONCURRENCY.
+    check_concurrency: int | None = Field(ge=1, default=None)
+
+
+class BodyCacheModel(BaseModel):
+    """
+    Validators (ETag/Last-Modified) of the last full response a monitor's content assertions were
+    evaluated against, and their results, so a check can send a conditional GET and reuse them if
+    the server says the content hasn't changed.
+    """
+
+    etag: str | None = None
+    last_modified: str | None = None
+    # Status of the full response, which a 304 stands in for
+    status_code: int
+    # Error message (or None if it passed) by assertion string
+    results: dict[str, str | None]
 
 
 class UptimeMonitorModel(BaseModel):
@@ -36,12 +56,16 @@ class UptimeMonitorModel(BaseModel):
         default_factory=lambda: datetime.now(UTC).replace(second=0, microsecond=0)
     )
     timeout_secs: float = Field(ge=0, default=5)
+    # Open a new connection for every check so latency includes connection setup
+    cold_connection: bool = False
     assertions: list[Assertion] = Field(default_factory=list)
+    body_cache: BodyCacheModel | None = None
     failures_before_alerting: int = Field(ge=1, default=1)
     alert_slack_channels: list[str] = Field(default_factory=list)
     alert_emails: list[str] = Field(default_factory=list)
     realert_interval_mins: int = Field(ge=15, default=60)
-    GSI_PK: str = Field(default=CONSTANT_GSI_PK)
+    # NextDueIndex partition key, see gsi_shard_key(). Derived from the id when not given.
+    GSI_PK: str = ''
 
     @field_validator('next_due_at')
     @classmethod
@@ -51,6 +75,13 @@ class UptimeMonitorModel(BaseModel):
             raise ValueError('next_due_at must be no more precise than minutes')
         return to_utc(v)
 
+    @model_validator(mode='after')
+    def default_gsi_pk(self) -> UptimeMonitorModel:
+        # After validation, so an invalid project_id or slug only reports its own error
+        if not self.GSI_PK:
+            self.GSI_PK = gsi_shard_key(self.id)
+        return self
+
     @property
     def id(self) -> str:
         return UptimeLogModel.monitor_id_from_parts(self.project_id, self.slug)
@@ -66,6 +97,8 @@ class UptimeLogModel(BaseModel):
     status: MonitorState
     resp_code: int | None = None
     latency_secs: float | None = None
+    # Time the check waited to send its request, e.g. for a busy host (not part of the latency)
+    queue_secs: float | None = None
     error_message: list[str] | None = None
 
     @staticmethod
@@ -73,5 +106,45 @@ class UptimeLogModel(BaseModel):
         return f'{project_id}/{slug}'
 
 
+class UptimeLogSlotModel(UptimeLogModel):
+    # Position in the monitor's ring of logs (see UptimeLogRingTable)
+    slot: int = Field(ge=0)
+
+
 class ProjectMonitorsModel(BaseModel):
     uptime: list[UptimeMonitorModel] = Field(default_factory=list)
+
+
+class AlertChannel(str, Enum):
+    slack = 'slack'
+    email = 'email'
+
+
+class AlertModel(BaseModel):
+    """An alert to one destination, waiting in the outbox (see AlertOutboxTable) to be sent."""
+
+    # Monitor, the due time that was checked, kind of alert and destination. Checks racing over
+    # the same due time make the same id, so an alert is only queued once.
+    id: str
+    channel: AlertChannel
+    destination: str
+    # `down` or `recovery`
+    kind: str | None = None
+    subject: str
+    text: str
+    created_at: AwareDatetime
+    # Deliveries that failed so far
+    attempts: int = Field(ge=0, default=0)
+    # A sender holds the alert until then
+    lease_until: AwareDatetime | None = None
+    delivered_at: AwareDatetime | None = None
+    # The destination (see pending_key()) until the alert is delivered or given up on, then
+    # removed. PendingIndex is keyed on it (and created_at), so only alerts still to be sent are in
+    # that index, spread over a partition per destination.
+    pending: str | None = None
+    # Epoch seconds when DynamoDB's TTL removes the alert
+    expires_at: int
+
+    @staticmethod
+    def pending_key(channel: AlertChannel, destination: str) -> str:
+        return f'{channel.value}/{destination}'
@@ -1,15 +1,34 @@
+from collections.abc import Iterable
 from datetime import datetime
+from itertools import batched
+import os
+from typing import ClassVar
+from uuid import UUID
+
+from botocore.exceptions import ClientError
 
 from critic.libs.ddb import (
-    CONSTANT_GSI_PK,
     CascadeRelationship,
+    MergedQueryIterator,
+    QueryIterator,
     Table,
     deserialize,
     get_client,
+    get_executor,
+    gsi_shard_key,
+    gsi_shard_keys,
     serialize,
+    transact_write,
 )
 
-from .models import ProjectModel, UptimeLogModel, UptimeMonitorModel
+from .models import (
+    AlertChannel,
+    AlertModel,
+    ProjectModel,
+    UptimeLogModel,
+    UptimeLogSlotModel,
+    UptimeMonitorModel,
+)
 
 
 class ProjectTable(Table):
@@ -23,42 +42,96 @@ class ProjectTable(Table):
             CascadeRelationship(
                 UptimeMonitorTable,
                 lambda pk, _sk: pk,
-                lambda m: (m.project_id, m.slug),
             )
         ]
 
+    @classmethod
+    def by_id(cls, project_ids: Iterable[UUID | str]) -> dict[str, ProjectModel]:
+        """The projects that exist among the given ids, keyed by the id as a string."""
+        keys = {(str(project_id), None) for project_id in project_ids}
+        return {str(project.id): project for project in cls.batch_get(keys)}
+
 
 class UptimeMonitorTable(Table):
     base_name = 'UptimeMonitor'
     model = UptimeMonitorModel
     partition_key = 'project_id'
     sort_key = 'slug'
+    indexes: ClassVar[dict[str, tuple[str, str | None]]] = {
+        'NextDueIndex': ('GSI_PK', 'next_due_at')
+    }
 
     @classmethod
     def cascade_relationships(cls) -> list[CascadeRelationship]:
+        # Logs written before switching to the ring layout stay in UptimeLog, so it's always
+        # cleaned up. UptimeLogRing may not exist where the ring layout isn't in use.
+        log_tables = [UptimeLogTable]
+        if log_layout() == 'ring':
+            log_tables.append(UptimeLogRingTable)
         return [
             CascadeRelationship(
-                UptimeLogTable,
+                table,
                 # TODO: have a universal function for this
                 lambda pk, sk: UptimeLogModel.monitor_id_from_parts(pk, sk),
-                lambda log: (log.monitor_id, log.timestamp),
             )
+            for table in log_tables
         ]
 
     @classmethod
-    def get_due_since(cls, timestamp: datetime) -> list[UptimeMonitorModel]:
-        response = get_client().query(
-            TableName=cls.name(),
-            IndexName='NextDueIndex',
-            KeyConditionExpression='GSI_PK = :pk AND next_due_at <= :timestamp',
-            ExpressionAttributeValues=serialize(
-                {
-                    ':pk': CONSTANT_GSI_PK,
-                    ':timestamp': timestamp,
-                }
-            ),
-        )
-        return [cls.model(**deserialize(item)) for item in response['Items']]
+    def get_due_since(
+        cls,
+        timestamp: datetime,
+        cursor: dict[str, dict | None] | None = None,
+        page_size: int | None = None,
+    ) -> MergedQueryIterator:
+        """
+        Lazily yield every monitor due at or before the given timestamp, most overdue first. Each
+        NextDueIndex shard is queried in parallel. Pass the cursor of a previous iterator to resume
+        where it left off.
+        """
+        shard_cursors = cursor if cursor is not None else dict.fromkeys(gsi_shard_keys())
+        iterators = {}
+        for shard, shard_cursor in shard_cursors.items():
+            request = {
+                'TableName': cls.name(),
+                'IndexName': 'NextDueIndex',
+                'KeyConditionExpression': 'GSI_PK = :pk AND next_due_at <= :timestamp',
+                'ExpressionAttributeValues': serialize(
+                    {
+                        ':pk': shard,
+                        ':timestamp': timestamp,
+                    }
+                ),
+            }
+            iterators[shard] = QueryIterator(cls, request, cursor=shard_cursor, page_size=page_size)
+        return MergedQueryIterator(iterators, sort_key=lambda m: m.next_due_at)
+
+    @classmethod
+    def reshard(cls) -> int:
+        """
+        Move every monitor whose GSI_PK doesn't match its shard under the current shard count.
+        Only needed after lowering CRITIC_GSI_SHARDS (or to spread out monitors written before
+        sharding). Returns the number of monitors moved.
+        """
+        executor = get_executor('batch')
+        futures = []
+        scan = cls.scan_iter(ProjectionExpression='project_id, slug, GSI_PK')
+        for page in scan.pages():
+            for item in map(deserialize, page):
+                monitor_id = UptimeLogModel.monitor_id_from_parts(item['project_id'], item['slug'])
+                shard = gsi_shard_key(monitor_id)
+                if item['GSI_PK'] != shard:
+                    # The condition keeps us from recreating monitors deleted since the scan.
+                    futures.append(
+                        executor.submit(
+                            cls.update,
+                            item['project_id'],
+                            item['slug'],
+                            updates={'GSI_PK': shard},
+                            condition={'GSI_PK': item['GSI_PK']},
+                        )
+                    )
+        return sum(f.result() for f in futures)
 
 
 class UptimeLogTable(Table):
@@ -71,5 +144,220 @@ class UptimeLogTable(Table):
     @classmethod
     def prune(cls, monitor_id: str, n: int):
         """Prune the n oldest logs"""
-        for log in cls.query(monitor_id, ScanIndexForward=True, Limit=n):
-            cls.delete(monitor_id, getattr(log, cls.sort_key))
+        cls.batch_delete(
+            (monitor_id, getattr(log, cls.sort_key))
+            for log in cls.query_iter(monitor_id, ScanIndexForward=True, Limit=n)
+        )
+
+
+class UptimeLogRingTable(Table):
+    """
+    Alternative log layout (CRITIC_LOG_LAYOUT=ring): each monitor has `retention_limit` slots and
+    each check overwrites the oldest one in place, so keeping logs to the limit costs nothing and
+    a check writes exactly one item. The slot comes from the monitor's log_counter, which keeps
+    counting past the limit in this layout.
+
+    Slots aren't in time order once the ring wraps, so read logs through `logs()`, which queries
+    TimestampIndex (a local secondary index on monitor_id and timestamp).
+    """
+
+    base_name = 'UptimeLogRing'
+    model = UptimeLogSlotModel
+    partition_key = 'monitor_id'
+    sort_key = 'slot'
+    retention_limit = UptimeLogTable.retention_limit
+    indexes: ClassVar[dict[str, tuple[str, str | None]]] = {
+        'TimestampIndex': ('monitor_id', 'timestamp')
+    }
+
+    @classmethod
+    def slot(cls, log_counter: int) -> int:
+        return log_counter % cls.retention_limit
+
+    @classmethod
+    def logs(
+        cls,
+        monitor_id: str,
+        newest_first: bool = False,
+        cursor: dict | None = None,
+        page_size: int | None = None,
+        **kwargs,
+    ) -> QueryIterator:
+        """Lazily yield the monitor's logs in timestamp order."""
+        return cls.query_iter(
+            monitor_id,
+            cursor=cursor,
+            page_size=page_size,
+            IndexName='TimestampIndex',
+            ScanIndexForward=not newest_first,
+            **kwargs,
+        )
+
+
+class AlertOutboxTable(Table):
+    """
+    Alerts waiting to be sent (see critic.alerts), so checks only write here and never wait on
+    Slack or Mailgun. Sent alerts stay until DynamoDB's TTL removes them (`expires_at`), so the same
+    alert can't be queued again.
+
+    With digests, the table also holds a lock item per destination (see lock_digest()). It has no
+    `pending`, so it's never in PendingIndex.
+    """
+
+    base_name = 'AlertOutbox'
+    model = AlertModel
+    partition_key = 'id'
+    indexes: ClassVar[dict[str, tuple[str, str | None]]] = {
+        'PendingIndex': ('pending', 'created_at'),
+    }
+    # Most items in one TransactWriteItems call
+    transact_limit = 100
+
+    @classmethod
+    def enqueue(cls, alerts: list[AlertModel]) -> bool:
+        """Queue the alerts. Returns False if they were already queued."""
+        queued = True
+        for chunk in batched(alerts, cls.transact_limit, strict=False):
+            queued &= transact_write(
+                [
+                    {
+                        'Put': {
+                            **cls.put_request(a),
+                            'ConditionExpression': 'attribute_not_exists(id)',
+                        }
+                    }
+                    for a in chunk
+                ]
+            )
+        return queued
+
+    @classmethod
+    def _conditional_update(cls, alert_id: str, **kwargs) -> bool:
+        try:
+            get_client().update_item(TableName=cls.name(), Key=cls.key(alert_id), **kwargs)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    @classmethod
+    def claim(cls, alert_id: str, now: datetime, lease_until: datetime) -> bool:
+        """
+        Take the alert to send it. Fails if it's been sent, or another sender holds it and their
+        lease hasn't run out.
+        """
+        return cls._conditional_update(
+            alert_id,
+            UpdateExpression='SET lease_until = :lease_until',
+            ConditionExpression=(
+                'attribute_exists(id) AND attribute_not_exists(delivered_at)'
+                ' AND (attribute_not_exists(lease_until) OR lease_until < :now)'
+            ),
+            ExpressionAttributeValues=serialize({':lease_until': lease_until, ':now': now}),
+        )
+
+    @staticmethod
+    def digest_lock_id(channel: AlertChannel, destination: str) -> str:
+        # Alert ids start with a project id, so they can't clash
+        return f'digest/{AlertModel.pending_key(channel, destination)}'
+
+    @classmethod
+    def lock_digest(
+        cls, channel: AlertChannel, destination: str, now: datetime, lease_until: datetime
+    ) -> bool:
+        """
+        Become the only sender of the destination's digests. Fails if another sender holds the
+        lock and their lease hasn't run out. DynamoDB's TTL removes the lock once the lease is up.
+        """
+        return cls._conditional_update(
+            cls.digest_lock_id(channel, destination),
+            UpdateExpression='SET lease_until = :lease_until, expires_at = :expires_at',
+            ConditionExpression='attribute_not_exists(lease_until) OR lease_until < :now',
+            ExpressionAttributeValues=serialize(
+                {
+                    ':lease_until': lease_until,
+                    ':expires_at': int(lease_until.timestamp()),
+                    ':now': now,
+                }
+            ),
+        )
+
+    @classmethod
+    def unlock_digest(cls, channel: AlertChannel, destination: str):
+        get_client().update_item(
+            TableName=cls.name(),
+            Key=cls.key(cls.digest_lock_id(channel, destination)),
+            UpdateExpression='REMOVE lease_until',
+        )
+
+    @classmethod
+    def finish(cls, alert_id: str, now: datetime, delivered: bool, max_attempts: int) -> bool:
+        """
+        Release a claimed alert, either sent or with one more failed attempt. An alert that fails
+        its last attempt is taken out of PendingIndex like a sent one, so it isn't tried again.
+        Returns True if it was given up on.
+        """
+        if delivered:
+            get_client().update_item(
+                TableName=cls.name(),
+                Key=cls.key(alert_id),
+                UpdateExpression='SET delivered_at = :now REMOVE lease_until, pending',
+                ExpressionAttributeValues=serialize({':now': now}),
+            )
+            return False
+        # Counted in the table, since the sender's copy of the alert may be stale
+        if cls._conditional_update(
+            alert_id,
+            UpdateExpression='SET attempts = attempts + :one REMOVE lease_until, pending',
+            ConditionExpression='attempts >= :last',
+            ExpressionAttributeValues=serialize({':one': 1, ':last': max_attempts - 1}),
+        ):
+            return True
+        get_client().update_item(
+            TableName=cls.name(),
+            Key=cls.key(alert_id),
+            UpdateExpression='SET attempts = attempts + :one REMOVE lease_until',
+            ExpressionAttributeValues=serialize({':one': 1}),
+        )
+        return False
+
+    @classmethod
+    def pending(cls) -> QueryIterator:
+        """
+        Lazily yield the alerts not sent or given up on yet, in no particular order. They're scanned
+        from PendingIndex, which only holds those, so this doesn't read the rest kept until their
+        TTL.
+        """
+        return cls.scan_iter(IndexName='PendingIndex')
+
+    @classmethod
+    def pending_for(cls, channel: AlertChannel, destination: str) -> QueryIterator:
+        """Like pending(), for one destination's alerts, oldest first."""
+        request = {
+            'TableName': cls.name(),
+            'IndexName': 'PendingIndex',
+            'KeyConditionExpression': 'pending = :pending',
+            'ExpressionAttributeValues': serialize(
+                {':pending': AlertModel.pending_key(channel, destination)}
+            ),
+        }
+        return QueryIterator(cls, request)
+
+
+def log_layout() -> str:
+    """`table` (the default) keeps logs in UptimeLogTable, `ring` in UptimeLogRingTable."""
+    return os.environ.get('CRITIC_LOG_LAYOUT', 'table')
+
+
+# Lookup for tasks that are passed a table by name
+TABLES: dict[str, type[Table]] = {
+    t.base_name: t
+    for t in (
+        ProjectTable,
+        UptimeMonitorTable,
+        UptimeLogTable,
+        UptimeLogRingTable,
+        AlertOutboxTable,
+    )
+}
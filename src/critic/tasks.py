@@ -1,15 +1,23 @@
 from datetime import UTC, datetime
 import logging
+import time
 
 import mu
 
+from critic import alerts
+from critic.libs import dispatch, host_limits
+from critic.libs.ddb import CascadeDelete
 from critic.libs.dt import round_minute
-from critic.libs.uptime import MonitorNotFoundError, UptimeCheck
-from critic.tables import UptimeMonitorTable
+from critic.libs.uptime import MonitorNotFoundError, UptimeCheck, claims_enabled, run_batch
+from critic.tables import TABLES, UptimeMonitorTable
 
 
 log = logging.getLogger(__name__)
 
+# How long one cascade_delete invocation works before handing off to the next. Lambda's timeout
+# (mu defaults to 900s) must leave room for the step that's running when this runs out.
+CASCADE_DELETE_BUDGET_SECS = 600
+
 
 @mu.task
 def run_checks(monitor_id: str, monitor_slug: str):
@@ -19,19 +27,97 @@ def run_checks(monitor_id: str, monitor_slug: str):
         log.info(f'Monitor {monitor_id}/{monitor_slug} not found, skipping')
 
 
+@mu.task
+def run_checks_batch(monitors: list[dict]):
+    """
+    Runs the checks for a batch of monitors concurrently in this invocation. The monitors are the
+    DynamoDB items the dispatcher got from the NextDueIndex, so they aren't loaded again.
+    """
+    run_batch([UptimeMonitorTable.ddb_to_model(item) for item in monitors])
+
+
 @mu.task
 def run_due_checks():
     """
     This task is invoked by an EventBridge rule once a minute. It queries for all monitors that are
-    due and invokes `run_checks` for each one.
+    due and invokes `run_checks` for each one, or `run_checks_batch` for each chunk of them in
+    batch mode (CRITIC_DISPATCH_MODE=batch). Invokes go out concurrently.
+
+    When it falls behind or more checks are due than CRITIC_DISPATCH_CAPACITY, the checks that
+    matter most for alerting go first and the rest are deferred (see dispatch.prioritize()). With
+    a spread, down and failing monitors then go in the first slice.
+
+    With CRITIC_FAIR_DISPATCH=1, the capacity is shared between projects by their check shares,
+    so one big project can't take all of it.
+
+    With CRITIC_DISPATCH_SPREAD_SECS set, the checks are released on their monitors' offsets
+    through the minute rather than all at once, so this runs for up to that long. Set
+    CRITIC_CLAIM_CHECKS=1 with it: a check released late in the minute whose request times out
+    can still be running when the next run finds its monitor due, and only the claim stops that
+    run from dispatching it again.
     """
     now = datetime.now(UTC)
     log.info(f'Triggering due checks at {now.isoformat()}')
 
-    # Trigger `run_checks` for each due monitor.
     rounded_now = round_minute(now)
-    due_monitors = UptimeMonitorTable.get_due_since(rounded_now)
-    for monitor in due_monitors:
-        run_checks.invoke(str(monitor.project_id), monitor.slug)
+    if dispatch.dispatch_mode() != 'batch' and host_limits.configured():
+        log.warning('Host limits are set but only apply with CRITIC_DISPATCH_MODE=batch')
+    if dispatch.spread_secs() > 0 and not claims_enabled():
+        log.warning('Checks are spread without CRITIC_CLAIM_CHECKS=1, late ones may run twice')
+    due_monitors, by_priority = dispatch.prioritize(
+        UptimeMonitorTable.get_due_since(rounded_now), rounded_now
+    )
+    slices = dispatch.release_slices(due_monitors, rounded_now, urgent_first=by_priority)
+    count = calls_made = 0
+    if dispatch.dispatch_mode() == 'batch':
+
+        def batch_calls():
+            nonlocal count, calls_made
+            for monitors in slices:
+                for chunk in dispatch.chunk_monitors(monitors):
+                    count += len(chunk)
+                    calls_made += 1
+                    yield (chunk,)
 
-    log.info(f'Due checks triggered for {len(due_monitors)} monitors in {datetime.now(UTC) - now}')
+        invoked = dispatch.invoke_all(run_checks_batch.invoke, batch_calls())
+        log.info(f'Invoked {invoked} batches')
+    else:
+
+        def single_calls():
+            nonlocal count, calls_made
+            for monitors in slices:
+                for m in monitors:
+                    count += 1
+                    calls_made += 1
+                    yield (str(m.project_id), m.slug)
+
+        invoked = dispatch.invoke_all(run_checks.invoke, single_calls())
+
+    log.info(f'Due checks triggered for {count} monitors in {datetime.now(UTC) - now}')
+    if invoked < calls_made:
+        # Their monitors are still due, so the next run picks them up
+        log.error(f'{calls_made - invoked} of {calls_made} invokes failed')
+
+    if alerts.outbox_enabled():
+        # Retry alerts that failed to send, or whose delivery never started
+        alerts.deliver_alerts.invoke()
+
+
+@mu.task
+def cascade_delete(
+    table_name: str,
+    partition_value: str,
+    sort_value: str | None = None,
+    checkpoint: dict | None = None,
+):
+    """
+    Deletes an item and all its descendants in the background. If that takes longer than one
+    invocation's budget, it re-invokes itself with a checkpoint to carry on where it stopped.
+    """
+    job = CascadeDelete(TABLES[table_name], partition_value, sort_value, checkpoint=checkpoint)
+    checkpoint = job.run(deadline=time.monotonic() + CASCADE_DELETE_BUDGET_SECS)
+    if checkpoint:
+        log.info(f'Cascade delete of {table_name} {partition_value}/{sort_value} continuing')
+        cascade_delete.invoke(table_name, partition_value, sort_value, checkpoint)
+    else:
+        log.info(f'Cascade delete of {table_name} {partition_value}/{sort_value} finished')
@@ -0,0 +1,197 @@
+"""
+Long-running worker: runs due checks from an in-memory schedule instead of the once-a-minute
+run_due_checks Lambda. Run it with `python -m critic.worker` (see the `worker` compose service).
+Only one of the two should be scheduling checks for a namespace; disable the EventBridge rule
+where the worker runs.
+"""
+
+import asyncio
+from datetime import UTC, datetime
+import heapq
+import logging
+import math
+import os
+import signal
+import threading
+
+from botocore.exceptions import ClientError
+
+from critic import alerts
+from critic.libs.ddb import StreamNotEnabledError, StreamReader, deserialize, get_executor
+from critic.libs.dt import round_minute
+from critic.libs.uptime import UptimeCheck, check_concurrency, run_checks_async
+from critic.models import UptimeLogModel, UptimeMonitorModel
+from critic.tables import UptimeMonitorTable
+
+
+log = logging.getLogger(__name__)
+
+# How long it takes the worker's rolling scan to re-read every monitor. Changes come from the
+# table's stream; the scan only reconciles the schedule with the table in case any were missed.
+DEFAULT_WORKER_RECONCILE_SECS = 3600
+# Fewest monitors the rolling scan reads on a tick
+MIN_REFRESH_ITEMS = 100
+
+
+def reconcile_secs() -> int:
+    return int(os.environ.get('CRITIC_WORKER_RECONCILE_SECS', DEFAULT_WORKER_RECONCILE_SECS))
+
+
+class Worker:
+    """
+    Keeps every monitor in memory with a heap of their next due times. Each minute it pops the due
+    monitors and runs them as a batch (see run_checks_async), so there's no NextDueIndex query and
+    no invocation per minute.
+
+    The schedule is kept current without re-reading it all each minute:
+
+    - A check that saved its update is rescheduled from what it wrote.
+    - A check that didn't (it lost a race, e.g. to an edit, or failed) re-reads its monitor.
+    - Monitors added, edited or deleted elsewhere are read from the table's stream each tick
+      (see StreamReader), which only costs a GetRecords call per stream shard. If the stream can't
+      be read, e.g. the worker fell behind its retention, everything is loaded again.
+    - A rolling scan reads a slice of the table each tick, so every monitor is re-read once per
+      CRITIC_WORKER_RECONCILE_SECS, in case a change was missed. Monitors missing from a complete
+      pass were deleted. The scan is eventually consistent (half the cost of a consistent one): a
+      stale read is put right by the stream, or by the check's conditional update failing.
+
+    Without a stream on the table, changes are only picked up by the rolling scan.
+    """
+
+    def __init__(self, concurrency: int | None = None, reconcile_every: int | None = None):
+        self.concurrency = concurrency or check_concurrency()
+        self.reconcile_secs = reconcile_every or reconcile_secs()
+        self.stream: StreamReader | None = None
+        self.monitors: dict[str, UptimeMonitorModel] = {}
+        # (next_due_at, monitor id). Entries go stale when a monitor is rescheduled or dropped and
+        # are skipped when popped.
+        self.heap: list[tuple[datetime, str]] = []
+        self.scan_cursor: dict | None = None
+        self.scan_seen: set[str] = set()
+
+    def schedule(self, monitor: UptimeMonitorModel):
+        current = self.monitors.get(monitor.id)
+        self.monitors[monitor.id] = monitor
+        if current is None or current.next_due_at != monitor.next_due_at:
+            heapq.heappush(self.heap, (monitor.next_due_at, monitor.id))
+
+    def drop(self, monitor_id: str):
+        self.monitors.pop(monitor_id, None)
+
+    def load(self):
+        """Read every monitor, replacing the schedule."""
+        # Follow the stream from before the scan, so no change made during it is missed
+        try:
+            self.stream = StreamReader(UptimeMonitorTable)
+        except StreamNotEnabledError:
+            log.warning('UptimeMonitor has no stream, changes are only picked up by the scan')
+            self.stream = None
+        self.monitors = {m.id: m for m in UptimeMonitorTable.scan_iter(ConsistentRead=True)}
+        self.heap = [(m.next_due_at, monitor_id) for monitor_id, m in self.monitors.items()]
+        heapq.heapify(self.heap)
+        self.scan_cursor = None
+        self.scan_seen = set()
+        log.info(f'Worker loaded {len(self.monitors)} monitors')
+
+    def apply_changes(self):
+        """Apply the changes to monitors in the table's stream since the last call."""
+        if self.stream is None:
+            return
+        try:
+            for record in self.stream.read():
+                if record['eventName'] == 'REMOVE':
+                    keys = deserialize(record['Keys'])
+                    self.drop(
+                        UptimeLogModel.monitor_id_from_parts(keys['project_id'], keys['slug'])
+                    )
+                    continue
+                monitor = UptimeMonitorTable.ddb_to_model(record['NewImage'])
+                # It exists, whether or not this pass of the scan gets to it
+                self.scan_seen.add(monitor.id)
+                self.schedule(monitor)
+        except ClientError:
+            log.exception('Reading the UptimeMonitor stream failed, loading every monitor again')
+            self.load()
+
+    def refresh_step(self, ticks_per_pass: int):
+        """Re-read the next slice of the table, so a full pass takes `ticks_per_pass` ticks."""
+        limit = max(MIN_REFRESH_ITEMS, math.ceil(len(self.monitors) / max(ticks_per_pass, 1)))
+        scan = UptimeMonitorTable.scan_iter(cursor=self.scan_cursor, Limit=limit)
+        for monitor in scan:
+            self.scan_seen.add(monitor.id)
+            self.schedule(monitor)
+        self.scan_cursor = scan.cursor
+        if scan.cursor is None:
+            deleted = self.monitors.keys() - self.scan_seen
+            for monitor_id in deleted:
+                self.drop(monitor_id)
+            if deleted:
+                log.info(f'Worker dropped {len(deleted)} deleted monitors')
+            self.scan_seen = set()
+
+    def pop_due(self, now: datetime) -> list[UptimeMonitorModel]:
+        """Take the monitors due as of `now` (rounded like run_due_checks) off the schedule."""
+        rounded_now = round_minute(now)
+        due = []
+        while self.heap and self.heap[0][0] <= rounded_now:
+            next_due_at, monitor_id = heapq.heappop(self.heap)
+            monitor = self.monitors.get(monitor_id)
+            if monitor is not None and monitor.next_due_at == next_due_at:
+                due.append(monitor)
+        return due
+
+    def reschedule(self, check: UptimeCheck):
+        """Put a check's monitor back on the schedule for its next due time."""
+        if check.saved_updates is not None:
+            self.schedule(
+                UptimeMonitorModel.model_validate(check.monitor.model_dump() | check.saved_updates)
+            )
+            return
+        monitor = UptimeMonitorTable.get(check.project_id, check.monitor_slug)
+        if monitor is None:
+            self.drop(check.monitor.id)
+            return
+        self.scan_seen.add(monitor.id)
+        # A failed check's monitor is still due and runs again on the next tick, like it would
+        # with run_due_checks.
+        self.monitors.pop(monitor.id, None)
+        self.schedule(monitor)
+
+    def run_due(self, now: datetime | None = None) -> int:
+        """Run the checks due as of `now`. Returns how many ran."""
+        now = now or datetime.now(UTC)
+        due = self.pop_due(now)
+        if not due:
+            return 0
+        checks = [UptimeCheck(str(m.project_id), m.slug, monitor=m) for m in due]
+        asyncio.run(run_checks_async(checks, self.concurrency))
+        for check in checks:
+            self.reschedule(check)
+        log.info(f'Worker ran {len(checks)} checks in {datetime.now(UTC) - now}')
+        return len(checks)
+
+    def run(self, stop: threading.Event):
+        """Run due checks at the top of every minute until `stop` is set."""
+        self.load()
+        ticks_per_pass = max(self.reconcile_secs // 60, 1)
+        while not stop.is_set():
+            self.run_due()
+            self.apply_changes()
+            self.refresh_step(ticks_per_pass)
+            if alerts.outbox_enabled():
+                # Alerts that failed to send are retried in the background
+                get_executor('alerts').submit(alerts.deliver_pending)
+            now = datetime.now(UTC)
+            stop.wait(60 - now.second - now.microsecond / 1e6)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_args: stop.set())
+    Worker().run(stop)
+
+
+if __name__ == '__main__':
+    main()
@@ -67,6 +67,10 @@ resource "aws_dynamodb_table" "uptime_monitor_prod" {
   hash_key     = "project_id"
   range_key    = "slug"
 
+  # The worker follows changes to monitors from the stream
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
   attribute {
     name = "project_id"
     type = "S"
@@ -104,6 +108,10 @@ resource "aws_dynamodb_table" "uptime_monitor_qa" {
   hash_key     = "project_id"
   range_key    = "slug"
 
+  # The worker follows changes to monitors from the stream
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
   attribute {
     name = "project_id"
     type = "S"
@@ -143,6 +151,10 @@ resource "aws_dynamodb_table" "uptime_monitor_dev" {
   hash_key     = "project_id"
   range_key    = "slug"
 
+  # The worker follows changes to monitors from the stream
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
   attribute {
     name = "project_id"
     type = "S"
@@ -182,6 +194,10 @@ resource "aws_dynamodb_table" "uptime_monitor_test" {
   hash_key     = "project_id"
   range_key    = "slug"
 
+  # The worker follows changes to monitors from the stream
+  stream_enabled   = true
+  stream_view_type = "NEW_IMAGE"
+
   attribute {
     name = "project_id"
     type = "S"
@@ -292,3 +308,287 @@ resource "aws_dynamodb_table" "uptime_log_test" {
     type = "S"
   }
 }
+
+# UptimeLogRing table - prod
+resource "aws_dynamodb_table" "uptime_log_ring_prod" {
+  provider = aws.prod
+  name     = "UptimeLogRing"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "monitor_id"
+  range_key    = "slot"
+
+  attribute {
+    name = "monitor_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "slot"
+    type = "N"
+  }
+
+  attribute {
+    name = "timestamp"
+    type = "S"
+  }
+
+  local_secondary_index {
+    name            = "TimestampIndex"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+}
+
+# UptimeLogRing table - qa
+resource "aws_dynamodb_table" "uptime_log_ring_qa" {
+  provider = aws.qa
+  name     = "UptimeLogRing"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "monitor_id"
+  range_key    = "slot"
+
+  attribute {
+    name = "monitor_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "slot"
+    type = "N"
+  }
+
+  attribute {
+    name = "timestamp"
+    type = "S"
+  }
+
+  local_secondary_index {
+    name            = "TimestampIndex"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+}
+
+# UptimeLogRing table - dev (per developer)
+resource "aws_dynamodb_table" "uptime_log_ring_dev" {
+  for_each = local.developers
+
+  provider = aws.dev
+  name     = "UptimeLogRing-${each.key}"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "monitor_id"
+  range_key    = "slot"
+
+  attribute {
+    name = "monitor_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "slot"
+    type = "N"
+  }
+
+  attribute {
+    name = "timestamp"
+    type = "S"
+  }
+
+  local_secondary_index {
+    name            = "TimestampIndex"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+}
+
+# UptimeLogRing table - test (per developer + ci)
+resource "aws_dynamodb_table" "uptime_log_ring_test" {
+  for_each = local.test_namespaces
+
+  provider = aws.test
+  name     = "UptimeLogRing-${each.key}"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "monitor_id"
+  range_key    = "slot"
+
+  attribute {
+    name = "monitor_id"
+    type = "S"
+  }
+
+  attribute {
+    name = "slot"
+    type = "N"
+  }
+
+  attribute {
+    name = "timestamp"
+    type = "S"
+  }
+
+  local_secondary_index {
+    name            = "TimestampIndex"
+    range_key       = "timestamp"
+    projection_type = "ALL"
+  }
+}
+
+# AlertOutbox table - prod
+resource "aws_dynamodb_table" "alert_outbox_prod" {
+  provider = aws.prod
+  name     = "AlertOutbox"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  attribute {
+    name = "pending"
+    type = "S"
+  }
+
+  attribute {
+    name = "created_at"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  # Sparse: only alerts still to be sent have `pending`, so senders and the sweep read just those.
+  # `pending` is the alert's destination, so writes spread over a partition per destination.
+  global_secondary_index {
+    name            = "PendingIndex"
+    hash_key        = "pending"
+    range_key       = "created_at"
+    projection_type = "ALL"
+  }
+}
+
+# AlertOutbox table - qa
+resource "aws_dynamodb_table" "alert_outbox_qa" {
+  provider = aws.qa
+  name     = "AlertOutbox"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  attribute {
+    name = "pending"
+    type = "S"
+  }
+
+  attribute {
+    name = "created_at"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  # Sparse: only alerts still to be sent have `pending`, so senders and the sweep read just those.
+  # `pending` is the alert's destination, so writes spread over a partition per destination.
+  global_secondary_index {
+    name            = "PendingIndex"
+    hash_key        = "pending"
+    range_key       = "created_at"
+    projection_type = "ALL"
+  }
+}
+
+# AlertOutbox table - dev (per developer)
+resource "aws_dynamodb_table" "alert_outbox_dev" {
+  for_each = local.developers
+
+  provider = aws.dev
+  name     = "AlertOutbox-${each.key}"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  attribute {
+    name = "pending"
+    type = "S"
+  }
+
+  attribute {
+    name = "created_at"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  # Sparse: only alerts still to be sent have `pending`, so senders and the sweep read just those.
+  # `pending` is the alert's destination, so writes spread over a partition per destination.
+  global_secondary_index {
+    name            = "PendingIndex"
+    hash_key        = "pending"
+    range_key       = "created_at"
+    projection_type = "ALL"
+  }
+}
+
+# AlertOutbox table - test (per developer + ci)
+resource "aws_dynamodb_table" "alert_outbox_test" {
+  for_each = local.test_namespaces
+
+  provider = aws.test
+  name     = "AlertOutbox-${each.key}"
+
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "id"
+
+  attribute {
+    name = "id"
+    type = "S"
+  }
+
+  attribute {
+    name = "pending"
+    type = "S"
+  }
+
+  attribute {
+    name = "created_at"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+
+  # Sparse: only alerts still to be sent have `pending`, so senders and the sweep read just those.
+  # `pending` is the alert's destination, so writes spread over a partition per destination.
+  global_secondary_index {
+    name            = "PendingIndex"
+    hash_key        = "pending"
+    range_key       = "created_at"
+    projection_type = "ALL"
+  }
+}
@@ -15,7 +15,12 @@ resource "aws_iam_policy" "lambda_dynamodb_prod" {
           aws_dynamodb_table.project_prod.arn,
           aws_dynamodb_table.uptime_monitor_prod.arn,
           aws_dynamodb_table.uptime_log_prod.arn,
-          "${aws_dynamodb_table.uptime_monitor_prod.arn}/index/*"
+          aws_dynamodb_table.uptime_log_ring_prod.arn,
+          aws_dynamodb_table.alert_outbox_prod.arn,
+          "${aws_dynamodb_table.uptime_monitor_prod.arn}/index/*",
+          "${aws_dynamodb_table.uptime_monitor_prod.arn}/stream/*",
+          "${aws_dynamodb_table.uptime_log_ring_prod.arn}/index/*",
+          "${aws_dynamodb_table.alert_outbox_prod.arn}/index/*"
         ]
       }
     ]
@@ -39,7 +44,12 @@ resource "aws_iam_policy" "lambda_dynamodb_qa" {
           aws_dynamodb_table.project_qa.arn,
           aws_dynamodb_table.uptime_monitor_qa.arn,
           aws_dynamodb_table.uptime_log_qa.arn,
-          "${aws_dynamodb_table.uptime_monitor_qa.arn}/index/*"
+          aws_dynamodb_table.uptime_log_ring_qa.arn,
+          aws_dynamodb_table.alert_outbox_qa.arn,
+          "${aws_dynamodb_table.uptime_monitor_qa.arn}/index/*",
+          "${aws_dynamodb_table.uptime_monitor_qa.arn}/stream/*",
+          "${aws_dynamodb_table.uptime_log_ring_qa.arn}/index/*",
+          "${aws_dynamodb_table.alert_outbox_qa.arn}/index/*"
         ]
       }
     ]
@@ -65,7 +75,12 @@ resource "aws_iam_policy" "lambda_dynamodb_dev" {
           aws_dynamodb_table.project_dev[each.key].arn,
           aws_dynamodb_table.uptime_monitor_dev[each.key].arn,
           aws_dynamodb_table.uptime_log_dev[each.key].arn,
-          "${aws_dynamodb_table.uptime_monitor_dev[each.key].arn}/index/*"
+          aws_dynamodb_table.uptime_log_ring_dev[each.key].arn,
+          aws_dynamodb_table.alert_outbox_dev[each.key].arn,
+          "${aws_dynamodb_table.uptime_monitor_dev[each.key].arn}/index/*",
+          "${aws_dynamodb_table.uptime_monitor_dev[each.key].arn}/stream/*",
+          "${aws_dynamodb_table.uptime_log_ring_dev[each.key].arn}/index/*",
+          "${aws_dynamodb_table.alert_outbox_dev[each.key].arn}/index/*"
         ]
       }
     ]
@@ -91,7 +106,12 @@ resource "aws_iam_policy" "lambda_dynamodb_test" {
           aws_dynamodb_table.project_test[each.key].arn,
           aws_dynamodb_table.uptime_monitor_test[each.key].arn,
           aws_dynamodb_table.uptime_log_test[each.key].arn,
-          "${aws_dynamodb_table.uptime_monitor_test[each.key].arn}/index/*"
+          aws_dynamodb_table.uptime_log_ring_test[each.key].arn,
+          aws_dynamodb_table.alert_outbox_test[each.key].arn,
+          "${aws_dynamodb_table.uptime_monitor_test[each.key].arn}/index/*",
+          "${aws_dynamodb_table.uptime_monitor_test[each.key].arn}/stream/*",
+          "${aws_dynamodb_table.uptime_log_ring_test[each.key].arn}/index/*",
+          "${aws_dynamodb_table.alert_outbox_test[each.key].arn}/index/*"
         ]
       }
     ]
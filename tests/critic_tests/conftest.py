@@ -5,6 +5,8 @@ from moto import mock_aws
 import pytest
 
 import critic.libs.ddb as ddb_module
+import critic.libs.host_limits as host_limits_module
+from critic.libs.http_pool import pool as http_pool
 from critic.libs.testing import clear_tables, create_tables
 
 
@@ -47,6 +49,12 @@ def moto_for_unit_tests(request):
     # integration tests, this cache needs to be reset so the integration test doesn't get
     # the mocked client and vice versa.
     ddb_module._ddb_client = None
+    ddb_module._streams_client = None
+    # Don't let connections (or mocked transports) leak between tests.
+    http_pool.close()
+    # Nor hosts' request schedules. One kept on a frozen clock (freeze_time fakes time.monotonic)
+    # would hold up a later request to the same host until that far in the future.
+    host_limits_module.limits = host_limits_module.HostLimits()
 
 
 def pytest_configure(config):
@@ -1,9 +1,17 @@
+from datetime import UTC, datetime, timedelta
+import json
 from unittest import mock
 
+from freezegun import freeze_time
+import httpx
+import pytest
+
+from critic import alerts
 from critic.alerts import maybe_send_alerts
 from critic.libs.testing import UptimeMonitorFactory
 from critic.libs.uptime import UptimeCheck
-from critic.models import MonitorState
+from critic.models import AlertChannel, MonitorState
+from critic.tables import AlertOutboxTable
 
 
 class TestAlerts:
@@ -159,3 +167,371 @@ class TestUptimeAlertHook:
 
         m_alert.assert_called_once()
         m_put_log.assert_called_once()
+
+
+class TestAlertOutbox:
+    @pytest.fixture(autouse=True)
+    def env(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_ALERT_OUTBOX', '1')
+        monkeypatch.setenv('MAILGUN_API_KEY', 'key')
+        monkeypatch.setenv('MAILGUN_DOMAIN', 'mg.example.com')
+        monkeypatch.setenv('MAILGUN_FROM', 'critic@example.com')
+        monkeypatch.setattr('critic.alerts.time.sleep', lambda _secs: None)
+
+    def down_monitor(self):
+        return UptimeMonitorFactory.put(
+            state=MonitorState.down,
+            consecutive_fails=2,
+            failures_before_alerting=2,
+            alert_slack_channels=['https://hooks.slack.com/services/T1'],
+            alert_emails=['a@example.com'],
+        )
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_queue_once(self, m_start):
+        monitor = self.down_monitor()
+
+        for _ in range(2):
+            maybe_send_alerts(monitor=monitor, prev_state=MonitorState.up, prev_consecutive_fails=1)
+
+        m_start.assert_called_once()
+        queued = m_start.call_args.args[0]
+        assert [(a.channel, a.destination) for a in queued] == [
+            ('slack', 'https://hooks.slack.com/services/T1'),
+            ('email', 'a@example.com'),
+        ]
+        assert sorted(a.id for a in AlertOutboxTable.pending()) == sorted(a.id for a in queued)
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_pending_for(self, m_start):
+        first, second = (self.down_monitor() for _ in range(2))
+        with freeze_time('2026-01-01 12:00:00.5', tz_offset=0):
+            maybe_send_alerts(monitor=second, prev_state=MonitorState.up, prev_consecutive_fails=1)
+        with freeze_time('2026-01-01 12:00:00.2', tz_offset=0):
+            maybe_send_alerts(monitor=first, prev_state=MonitorState.up, prev_consecutive_fails=1)
+
+        pending = list(AlertOutboxTable.pending_for(AlertChannel.email, 'a@example.com'))
+        # Oldest first, and only the destination's
+        assert [(a.channel, a.id.split('/')[1]) for a in pending] == [
+            ('email', first.slug),
+            ('email', second.slug),
+        ]
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_deliver(self, m_start, httpx_mock):
+        httpx_mock.add_response(url='https://hooks.slack.com/services/T1')
+        httpx_mock.add_response(url='https://api.mailgun.net/v3/mg.example.com/messages')
+        monitor = self.down_monitor()
+        maybe_send_alerts(monitor=monitor, prev_state=MonitorState.up, prev_consecutive_fails=1)
+        queued = m_start.call_args.args[0]
+
+        assert alerts.deliver_all(queued) == 2
+        # Already sent
+        assert alerts.deliver_all(queued) == 0
+        assert list(AlertOutboxTable.pending()) == []
+        assert all(AlertOutboxTable.get(a.id).delivered_at for a in queued)
+        # Out of PendingIndex
+        assert all(AlertOutboxTable.get(a.id).pending is None for a in queued)
+        assert len(httpx_mock.get_requests()) == 2
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_failed_delivery_retried(self, m_start, httpx_mock):
+        monitor = UptimeMonitorFactory.put(
+            state=MonitorState.up,
+            alert_emails=['a@example.com'],
+        )
+        maybe_send_alerts(monitor=monitor, prev_state=MonitorState.down, prev_consecutive_fails=3)
+        (alert,) = m_start.call_args.args[0]
+        url = 'https://api.mailgun.net/v3/mg.example.com/messages'
+        for _ in range(alerts.ALERT_SEND_ATTEMPTS):
+            httpx_mock.add_response(url=url, status_code=503)
+
+        assert not alerts.deliver(alert)
+        saved = AlertOutboxTable.get(alert.id)
+        assert saved.attempts == 1
+        assert saved.lease_until is None
+
+        # The sweep sends it
+        httpx_mock.add_response(url=url)
+        assert alerts.deliver_pending() == 1
+        assert AlertOutboxTable.get(alert.id).delivered_at is not None
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_gives_up(self, m_start, httpx_mock, caplog):
+        monitor = UptimeMonitorFactory.put(state=MonitorState.up, alert_emails=['a@example.com'])
+        maybe_send_alerts(monitor=monitor, prev_state=MonitorState.down, prev_consecutive_fails=3)
+        (alert,) = m_start.call_args.args[0]
+        httpx_mock.add_response(status_code=503, is_reusable=True)
+        # Copies read before earlier attempts
+        for _ in range(alerts.MAX_ALERT_DELIVERIES - 1):
+            assert not alerts.deliver(alert)
+        assert AlertOutboxTable.get(alert.id).pending == 'email/a@example.com'
+        assert 'Giving up' not in caplog.text
+
+        assert not alerts.deliver(alert)
+        saved = AlertOutboxTable.get(alert.id)
+        assert saved.attempts == alerts.MAX_ALERT_DELIVERIES
+        # Out of PendingIndex
+        assert saved.pending is None
+        assert 'Giving up' in caplog.text
+        assert list(AlertOutboxTable.pending()) == []
+
+    @mock.patch('critic.alerts._send')
+    @mock.patch('critic.alerts.start_delivery')
+    def test_claimed_alert_skipped(self, m_start, m_send):
+        monitor = self.down_monitor()
+        maybe_send_alerts(monitor=monitor, prev_state=MonitorState.up, prev_consecutive_fails=1)
+        alert = m_start.call_args.args[0][0]
+        now = datetime.now(UTC)
+        # Held by another sender
+        assert AlertOutboxTable.claim(alert.id, now, now + timedelta(minutes=2))
+
+        assert not alerts.deliver(alert)
+        m_send.assert_not_called()
+
+        # Until its lease runs out
+        with mock.patch('critic.alerts.datetime') as m_datetime:
+            m_datetime.now.return_value = now + timedelta(minutes=3)
+            assert alerts.deliver(alert)
+        m_send.assert_called_once()
+
+
+class TestAlertDigest:
+    webhook = 'https://hooks.slack.com/services/T1'
+
+    @pytest.fixture(autouse=True)
+    def env(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_ALERT_OUTBOX', '1')
+        monkeypatch.setenv('CRITIC_ALERT_DIGEST_SECS', '10')
+        monkeypatch.setenv('CRITIC_ALERT_DIGEST_MAX_DELAY_SECS', '30')
+
+    def go_down(self):
+        monitor = UptimeMonitorFactory.put(
+            state=MonitorState.down,
+            consecutive_fails=1,
+            failures_before_alerting=1,
+            alert_slack_channels=[self.webhook],
+        )
+        maybe_send_alerts(monitor=monitor, prev_state=MonitorState.up, prev_consecutive_fails=0)
+        return monitor
+
+    def sent_texts(self, httpx_mock):
+        return [json.loads(r.content)['text'] for r in httpx_mock.get_requests()]
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_coalesces(self, m_start, httpx_mock):
+        httpx_mock.add_response(url=self.webhook)
+
+        with (
+            freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen,
+            mock.patch('critic.alerts._pending_for', wraps=alerts._pending_for) as m_pending,
+        ):
+            monitors = [self.go_down()]
+            frozen.tick(5)
+            monitors += [self.go_down(), self.go_down()]
+            # Each alert starts its sender, without reading the outbox on the check's path
+            assert m_start.call_count == 3
+            m_pending.assert_not_called()
+
+            frozen.tick(9)
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook) == 0
+            frozen.tick(1)
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook) == 3
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook) == 0
+
+        (text,) = self.sent_texts(httpx_mock)
+        assert text.splitlines()[0] == '3 down'
+        assert all(f'CRITIC DOWN: {m.project_id}/{m.slug}' in text for m in monitors)
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_max_delay(self, m_start, httpx_mock):
+        httpx_mock.add_response(url=self.webhook)
+
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen:
+            # Alerts keep coming, so the window never closes
+            for _ in range(4):
+                self.go_down()
+                frozen.tick(8)
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook) == 4
+
+        assert self.sent_texts(httpx_mock)[0].splitlines()[0] == '4 down'
+
+    def test_sender_waits(self, httpx_mock):
+        httpx_mock.add_response(url=self.webhook, is_reusable=True)
+
+        with (
+            freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen,
+            mock.patch('critic.alerts.time.sleep', side_effect=frozen.tick) as m_sleep,
+            mock.patch('critic.alerts.start_delivery') as m_start,
+        ):
+            monitor = self.go_down()
+            m_start.assert_called_once()
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook, locked=True) == 1
+
+        m_sleep.assert_called_once_with(10)
+        # A single alert is sent as it is
+        assert self.sent_texts(httpx_mock)[0].startswith(f'Down: {monitor.project_id}/')
+
+    @mock.patch('critic.alerts.get_executor')
+    def test_one_sender_per_destination(self, m_executor, httpx_mock):
+        other = 'https://hooks.slack.com/services/T2'
+        httpx_mock.add_response(url=self.webhook)
+        httpx_mock.add_response(url=other)
+        # More alerts than the pool has threads
+        count = alerts.ALERT_SEND_CONCURRENCY * 2
+
+        with (
+            freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen,
+            mock.patch('critic.alerts.time.sleep', side_effect=frozen.tick),
+        ):
+            for _ in range(count):
+                monitor = UptimeMonitorFactory.put(
+                    state=MonitorState.down,
+                    consecutive_fails=1,
+                    failures_before_alerting=1,
+                    alert_slack_channels=[self.webhook, other],
+                )
+                maybe_send_alerts(
+                    monitor=monitor, prev_state=MonitorState.up, prev_consecutive_fails=0
+                )
+                frozen.tick(1)
+
+            submit = m_executor.return_value.submit
+            assert [call.args[1:] for call in submit.call_args_list] == [
+                (AlertChannel.slack, self.webhook, True),
+                (AlertChannel.slack, other, True),
+            ]
+            # The sweep leaves them to their senders
+            assert alerts.deliver_pending() == 0
+            assert [alerts.deliver_digest(*call.args[1:]) for call in submit.call_args_list] == [
+                count,
+                count,
+            ]
+
+        assert [t.splitlines()[0] for t in self.sent_texts(httpx_mock)] == [f'{count} down'] * 2
+        assert list(AlertOutboxTable.pending()) == []
+        # Nothing was left for another sender
+        assert submit.call_count == 2
+
+    @mock.patch('critic.alerts.deliver_alerts.invoke')
+    def test_one_invocation_per_destination(self, m_invoke, httpx_mock, monkeypatch):
+        monkeypatch.setenv('AWS_LAMBDA_FUNCTION_NAME', 'critic')
+        httpx_mock.add_response(url=self.webhook)
+
+        with (
+            freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen,
+            mock.patch('critic.alerts.time.sleep', side_effect=frozen.tick),
+        ):
+            for _ in range(3):
+                self.go_down()
+            m_invoke.assert_called_once_with(None, ['slack', self.webhook])
+
+            alerts.deliver_alerts(*m_invoke.call_args.args)
+
+        assert self.sent_texts(httpx_mock)[0].splitlines()[0] == '3 down'
+
+    @mock.patch('critic.alerts.get_executor')
+    def test_next_sender_started(self, m_executor, httpx_mock):
+        with (
+            freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen,
+            mock.patch('critic.alerts.time.sleep', side_effect=frozen.tick),
+        ):
+            self.go_down()
+
+            def queue_another(_request):
+                # Queued while the sender holds the lock, so it doesn't start its own
+                self.go_down()
+                return httpx.Response(200)
+
+            httpx_mock.add_callback(queue_another, url=self.webhook)
+            submit = m_executor.return_value.submit
+            assert alerts.deliver_digest(*submit.call_args.args[1:]) == 1
+
+        # It's started when the sender is done
+        assert submit.call_count == 2
+        assert len(list(AlertOutboxTable.pending())) == 1
+
+    def test_sender_stops_after_one_digest(self, httpx_mock):
+        httpx_mock.add_response(url=self.webhook, is_reusable=True)
+
+        with (
+            freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen,
+            mock.patch('critic.alerts.start_delivery'),
+        ):
+            self.go_down()
+            waited = []
+
+            def sleep(secs):
+                # Alerts keep coming while the sender waits
+                waited.append(secs)
+                frozen.tick(secs)
+                self.go_down()
+
+            with mock.patch('critic.alerts.time.sleep', side_effect=sleep):
+                sent = alerts.deliver_digest(AlertChannel.slack, self.webhook, locked=True)
+
+        # Sent once the oldest alert had waited the max delay, and then done
+        assert sum(waited) == 30
+        assert sent == len(waited) + 1
+        assert len(httpx_mock.get_requests()) == 1
+
+    @mock.patch('critic.alerts._send')
+    @mock.patch('critic.alerts.get_executor')
+    def test_sweep_leaves_waiting_sender(self, m_executor, m_send):
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen:
+            self.go_down()
+            m_executor.return_value.submit.assert_called_once()
+            frozen.tick(30)
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook) == 0
+            m_send.assert_not_called()
+
+            # Until the sender's lock runs out (the window, max delay and a lease), e.g. it died
+            frozen.tick(10 + alerts.ALERT_LEASE_SECS + 1)
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook) == 1
+        m_send.assert_called_once()
+
+    @mock.patch('critic.alerts._send')
+    @mock.patch('critic.alerts.start_delivery')
+    def test_lost_race_backs_off(self, m_start, m_send):
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen:
+            self.go_down()
+            frozen.tick(10)
+            (alert,) = alerts._pending_for(AlertChannel.slack, self.webhook)
+            # Another sender got there first
+            assert alerts._claim(alert)
+
+            assert alerts.deliver_digest(AlertChannel.slack, self.webhook) == 0
+        m_send.assert_not_called()
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_old_alerts_sent(self, m_start, httpx_mock):
+        httpx_mock.add_response(url=self.webhook)
+
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen:
+            self.go_down()
+            # Its sender never ran and the sweeps were down for a while
+            frozen.tick(3 * 3600)
+            assert alerts.deliver_pending() == 1
+
+    @mock.patch('critic.alerts.start_delivery')
+    def test_sweep(self, m_start, httpx_mock):
+        httpx_mock.add_response(url=self.webhook)
+        httpx_mock.add_response(url='https://hooks.slack.com/services/T2')
+
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0) as frozen:
+            self.go_down()
+            self.go_down()
+            other = UptimeMonitorFactory.put(
+                state=MonitorState.down,
+                consecutive_fails=1,
+                failures_before_alerting=1,
+                alert_slack_channels=['https://hooks.slack.com/services/T2'],
+            )
+            maybe_send_alerts(monitor=other, prev_state=MonitorState.up, prev_consecutive_fails=0)
+            assert alerts.deliver_pending() == 0
+            frozen.tick(10)
+            assert alerts.deliver_pending() == 3
+
+        digest, single = sorted(self.sent_texts(httpx_mock))
+        assert digest.startswith('2 down\n')
+        assert single.startswith(f'Down: {other.project_id}/{other.slug}\n')
@@ -1,9 +1,17 @@
 from datetime import timedelta
+import re
+from unittest import mock
 
 import httpx
 import pytest
 
-from critic.libs.assertions import Assertion
+from critic.libs.assertions import (
+    Assertion,
+    BodyWatch,
+    compile_assertion,
+    compile_json_path,
+    evaluate_all,
+)
 
 
 RESPONSE_TIME_ASSERTION = {'assertion_string': 'response_time < 20.2'}
@@ -79,3 +87,181 @@ class TestAssertions:
         assertion_body: tuple[bool, str] = assertion_body.evaluate(response=resp)
         assert resp_time_eval[0]
         assert resp_time_eval[1] is None
+
+    def test_assertion_evaluates_regex(self):
+        resp = httpx.Response(status_code=200, text='build 1234 ok')
+        assert Assertion(assertion_string='body matches "build [0-9]+"').evaluate(resp) == (
+            True,
+            None,
+        )
+        passed, error = Assertion(assertion_string='body matches "^ok"').evaluate(resp)
+        assert not passed
+        assert 'but got build 1234 ok' in error
+
+    def test_invalid_regex_fails_on_evaluate(self):
+        assertion = Assertion(assertion_string='body matches "(unclosed"')
+        passed, error = assertion.evaluate(httpx.Response(status_code=200, text='foo'))
+        assert not passed
+        assert error.startswith('Error evaluating assertion: missing )')
+
+
+class TestCompileAssertion:
+    def test_compiles_once(self):
+        compile_assertion.cache_clear()
+        with mock.patch('critic.libs.assertions.re.compile', wraps=re.compile) as m:
+            assertions = [Assertion(assertion_string='body matches "fo+"') for _ in range(3)]
+            resp = httpx.Response(status_code=200, text='foo')
+            assert all(a.evaluate(resp)[0] for a in assertions)
+        m.assert_called_once_with('fo+')
+        info = compile_assertion.cache_info()
+        assert (info.misses, info.hits) == (1, 5)
+
+    def test_invalid_not_cached(self):
+        compile_assertion.cache_clear()
+        for _ in range(2):
+            with pytest.raises(ValueError, match='is not a valid operator'):
+                compile_assertion('status_code foo 200')
+        assert compile_assertion.cache_info().currsize == 0
+
+
+def body_assertions(*strings: str) -> list[Assertion]:
+    return [Assertion(assertion_string=s) for s in strings]
+
+
+class TestEvaluateAll:
+    def test_matches_one_at_a_time(self):
+        assertions = body_assertions(
+            'status_code == 200',
+            'body contains "foo"',
+            'body contains "foobar"',
+            'body contains "oba"',
+            'body not_contains "foo"',
+            'body not_contains "missing"',
+            'body matches "f.+r"',
+            'body matches "(b|z)ar$"',
+            'body matches "^bar"',
+            'body matches "(?i)FOO"',
+            'body matches "(o)\\1"',
+            'body contains "missing"',
+        )
+        resp = httpx.Response(status_code=200, text='a foobar')
+        results = evaluate_all(assertions, resp)
+        assert results == [a.evaluate(resp) for a in assertions]
+        assert [passed for passed, _ in results] == [
+            True,
+            True,
+            True,
+            True,
+            False,
+            True,
+            True,
+            True,
+            False,
+            True,
+            True,
+            False,
+        ]
+        assert results[4][1] == 'Expected AssertionSubject.BODY not_contains foo, but got a foobar'
+
+    def test_invalid_pattern_reported(self):
+        assertions = body_assertions('body contains "foo"', 'body matches "(unclosed"')
+        results = evaluate_all(assertions, httpx.Response(status_code=200, text='foo'))
+        assert results[0] == (True, None)
+        assert results[1][1].startswith('Error evaluating assertion: missing )')
+
+
+class TestBodyWatch:
+    def watch(self, *strings: str) -> BodyWatch:
+        return BodyWatch.for_assertions(body_assertions(*strings))
+
+    def test_no_body_assertions(self):
+        assert BodyWatch.for_assertions(body_assertions('status_code == 200')) is None
+
+    def test_literals(self):
+        watch = self.watch('body contains "Welcome"', 'body not_contains "Error"')
+        assert not watch.decided('<h1>Wel')
+        assert not watch.decided('<h1>Welcome</h1>')
+        assert watch.decided('<h1>Welcome</h1><p>Error</p>')
+
+    def test_patterns(self):
+        watch = self.watch('body matches "[0-9]+ users"')
+        assert not watch.decided('42 use')
+        # Not until there's text after the match (and then only once the text has doubled)
+        assert not watch.decided('42 users')
+        assert watch.decided('42 users online now')
+
+    @pytest.mark.parametrize(
+        'assertion', ['body == "ok"', 'body matches "ok$"', 'body matches "ok(?!ay)"']
+    )
+    def test_needs_whole_body(self, assertion):
+        assert not self.watch(assertion).decided('ok then ok')
+
+
+class TestHeaderAndJsonSubjects:
+    def test_parse(self):
+        assertion = Assertion(assertion_string='header Content-Type contains json')
+        assert assertion.assertion_target == 'Content-Type'
+        assert assertion.assertion_operator == 'contains'
+        assert assertion.assertion_expected_value == 'json'
+
+        assertion = Assertion(assertion_string='json data.ok == true')
+        assert assertion.assertion_target == 'data.ok'
+        assert assertion.assertion_expected_value is True
+        assert Assertion(assertion_string='json code == \'"200"\'').assertion_expected_value == (
+            '200'
+        )
+
+    def test_needs_target(self):
+        with pytest.raises(ValueError, match='has more or less than 4 parts'):
+            Assertion(assertion_string='header == json')
+        with pytest.raises(ValueError, match='Invalid JSON path'):
+            Assertion(assertion_string='json a..b == 1')
+
+    def test_json_path(self):
+        assert compile_json_path('$.data.items[0].id') == ('data', 'items', 0, 'id')
+        assert compile_json_path('[-1]') == (-1,)
+
+    @pytest.mark.parametrize(
+        ('assertion_string', 'passed'),
+        [
+            ('header content-type contains json', True),
+            ('header X-Missing == x', False),
+            ('json status == ok', True),
+            ('json checks.db.latency_ms < 50', True),
+            ('json checks.db.latency_ms > 50', False),
+            ('json regions[1] == eu', True),
+            ('json regions contains us', True),
+            ('json regions[5] == eu', False),
+            ('json status.nested == ok', False),
+        ],
+    )
+    def test_evaluate(self, assertion_string, passed):
+        resp = httpx.Response(
+            status_code=200,
+            json={'status': 'ok', 'checks': {'db': {'latency_ms': 12}}, 'regions': ['us', 'eu']},
+        )
+        result = Assertion(assertion_string=assertion_string).evaluate(resp)
+        assert result[0] is passed
+
+    def test_failure_message(self):
+        resp = httpx.Response(status_code=200, json={'status': 'degraded'})
+        passed, error = Assertion(assertion_string='json status == ok').evaluate(resp)
+        assert not passed
+        assert error == 'Expected AssertionSubject.JSON status == ok, but got degraded'
+
+    def test_invalid_json(self):
+        resp = httpx.Response(status_code=200, text='<html>')
+        passed, error = Assertion(assertion_string='json status == ok').evaluate(resp)
+        assert not passed
+        assert error.startswith('Error evaluating assertion: Response body is not valid JSON')
+
+    def test_json_parsed_once(self):
+        assertions = body_assertions('json a == 1', 'json b == 2', 'status_code == 200')
+        resp = httpx.Response(status_code=200, json={'a': 1, 'b': 2})
+        with mock.patch.object(httpx.Response, 'json', wraps=resp.json) as m_json:
+            assert evaluate_all(assertions, resp) == [(True, None)] * 3
+        m_json.assert_called_once()
+
+    def test_json_needs_whole_body(self):
+        watch = BodyWatch.for_assertions(body_assertions('json status == ok'))
+        assert not watch.decided('{"status": "ok"}')
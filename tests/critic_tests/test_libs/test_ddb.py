@@ -1,10 +1,20 @@
-from datetime import datetime
+from datetime import UTC, datetime, timedelta
+from itertools import islice
 from unittest import mock
 
 from botocore.exceptions import ClientError
 import pytest
 
 from critic.libs.assertions import Assertion
+from critic.libs.ddb import (
+    CONSTANT_GSI_PK,
+    CascadeDelete,
+    UnprocessedItemsError,
+    gsi_shard_keys,
+    model_codec,
+    serialize,
+    transact_write,
+)
 from critic.libs.testing import ProjectFactory, UptimeLogFactory, UptimeMonitorFactory
 from critic.models import ProjectModel, UptimeLogModel, UptimeMonitorModel
 from critic.tables import ProjectTable, UptimeLogTable, UptimeMonitorTable
@@ -82,6 +92,90 @@ class TestTable:
         assert len(out_data) == 1
         assert str(out_data[0].url) == 'https://example.com/health'
 
+    def test_query_follows_pages(self):
+        monitor = UptimeMonitorFactory.build()
+        start = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+        for minute in range(5):
+            UptimeLogFactory.put(monitor_id=monitor.id, timestamp=start + timedelta(minutes=minute))
+
+        logs = list(UptimeLogTable.query_iter(monitor.id, page_size=2))
+        assert [log.timestamp for log in logs] == [
+            start + timedelta(minutes=minute) for minute in range(5)
+        ]
+
+    def test_query_limit_caps_total(self):
+        monitor = UptimeMonitorFactory.build()
+        for _ in range(5):
+            UptimeLogFactory.put(monitor_id=monitor.id)
+
+        assert len(UptimeLogTable.query(monitor.id, Limit=3, page_size=2)) == 3
+
+    def test_query_resume_from_cursor(self):
+        monitor = UptimeMonitorFactory.build()
+        start = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+        for minute in range(5):
+            UptimeLogFactory.put(monitor_id=monitor.id, timestamp=start + timedelta(minutes=minute))
+
+        first = UptimeLogTable.query_iter(monitor.id, page_size=2)
+        consumed = list(islice(first, 3))
+        assert first.cursor is not None
+
+        rest = UptimeLogTable.query_iter(monitor.id, cursor=first.cursor, page_size=2)
+        timestamps = [log.timestamp for log in consumed + list(rest)]
+        assert timestamps == [start + timedelta(minutes=minute) for minute in range(5)]
+        assert rest.cursor is None
+
+    def test_get_due_since_follows_pages(self):
+        due = {UptimeMonitorFactory.put(next_due_at='2026-01-01 12:00:00Z').slug for _ in range(5)}
+        UptimeMonitorFactory.put(next_due_at='2026-01-01 12:01:00Z')
+
+        monitors = UptimeMonitorTable.get_due_since(
+            datetime(2026, 1, 1, 12, 0, tzinfo=UTC), page_size=2
+        )
+        assert {m.slug for m in monitors} == due
+
+    def test_get_due_since_merges_shards(self):
+        # Including a monitor written before sharding
+        legacy = UptimeMonitorFactory.put(
+            next_due_at='2026-01-01 11:58:00Z', GSI_PK=CONSTANT_GSI_PK
+        )
+        monitors = [
+            UptimeMonitorFactory.put(next_due_at=f'2026-01-01 11:{minute}:00Z')
+            for minute in (50, 59, 55, 57, 51)
+        ]
+        assert len({m.GSI_PK for m in monitors}) > 1
+
+        due = UptimeMonitorTable.get_due_since(datetime(2026, 1, 1, 12, 0, tzinfo=UTC))
+        assert [m.slug for m in due] == [
+            m.slug for m in sorted([*monitors, legacy], key=lambda m: m.next_due_at)
+        ]
+
+    def test_get_due_since_resume_from_cursor(self):
+        for minute in range(10):
+            UptimeMonitorFactory.put(next_due_at=f'2026-01-01 11:{minute:02}:00Z')
+        timestamp = datetime(2026, 1, 1, 12, 0, tzinfo=UTC)
+
+        first = UptimeMonitorTable.get_due_since(timestamp, page_size=1)
+        consumed = list(islice(first, 4))
+        rest = UptimeMonitorTable.get_due_since(timestamp, cursor=first.cursor, page_size=1)
+        minutes = [m.next_due_at.minute for m in consumed + list(rest)]
+        assert minutes == list(range(10))
+        assert rest.cursor == {}
+
+    def test_reshard(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_GSI_SHARDS', '4')
+        monitors = UptimeMonitorFactory.batch(20)
+        UptimeMonitorTable.batch_put(monitors)
+
+        monkeypatch.setenv('CRITIC_GSI_SHARDS', '2')
+        expected_moves = sum(m.GSI_PK not in gsi_shard_keys() for m in monitors)
+        assert expected_moves
+        assert UptimeMonitorTable.reshard() == expected_moves
+        assert UptimeMonitorTable.reshard() == 0
+
+        for m in monitors:
+            assert UptimeMonitorTable.get(m.project_id, m.slug).GSI_PK in gsi_shard_keys()
+
     def test_serialize_unaware_dt(self):
         with pytest.raises(ValueError, match='must be timezone aware'):
             UptimeMonitorTable.get_due_since(datetime.now())
@@ -102,6 +196,32 @@ class TestTable:
             )
         assert excinfo.value == error
 
+    def test_transact_write(self):
+        monitor = UptimeMonitorFactory.put()
+        uptime_log = UptimeLogFactory.build(monitor_id=monitor.id)
+
+        def items(expected_fails):
+            return [
+                {
+                    'Update': UptimeMonitorTable.update_request(
+                        monitor.project_id,
+                        monitor.slug,
+                        updates={'consecutive_fails': 3},
+                        condition={'consecutive_fails': expected_fails},
+                    )
+                },
+                {'Put': UptimeLogTable.put_request(uptime_log)},
+            ]
+
+        # A failed condition cancels the whole transaction
+        assert transact_write(items(5)) is False
+        assert UptimeLogTable.query(monitor.id) == []
+        assert UptimeMonitorTable.get(monitor.project_id, monitor.slug).consecutive_fails == 0
+
+        assert transact_write(items(0)) is True
+        assert UptimeLogTable.query(monitor.id) == [uptime_log]
+        assert UptimeMonitorTable.get(monitor.project_id, monitor.slug).consecutive_fails == 3
+
     def test_cascade_delete(self):
         # Happy path: deleting a project should delete all its monitors and logs
         del_proj: ProjectModel = ProjectFactory.put()
@@ -129,3 +249,132 @@ class TestTable:
         assert ProjectTable.get(keep_proj.id) == keep_proj
         assert UptimeMonitorTable.get(keep_mon.project_id, keep_mon.slug) == keep_mon
         assert UptimeLogTable.get(keep_log.monitor_id, keep_log.timestamp) == keep_log
+
+
+class TestBatch:
+    def test_put_get_delete(self):
+        project = ProjectFactory.build()
+        monitors = UptimeMonitorFactory.batch(30, project_id=project.id)
+        keys = [(m.project_id, m.slug) for m in monitors]
+
+        UptimeMonitorTable.batch_put(monitors)
+        assert len(UptimeMonitorTable.query(project.id)) == 30
+
+        fetched = UptimeMonitorTable.batch_get([*keys, (project.id, 'missing')])
+        assert sorted(fetched, key=lambda m: m.slug) == sorted(monitors, key=lambda m: m.slug)
+
+        UptimeMonitorTable.batch_delete(keys)
+        assert UptimeMonitorTable.query(project.id) == []
+
+    def test_delete_cascades(self):
+        monitor = UptimeMonitorFactory.put()
+        UptimeLogFactory.put(monitor_id=monitor.id)
+
+        UptimeMonitorTable.batch_delete([(monitor.project_id, monitor.slug)])
+        assert UptimeLogTable.query(monitor.id) == []
+
+    @mock.patch('critic.libs.ddb.time.sleep')
+    @mock.patch('critic.libs.ddb.get_client')
+    def test_retries_unprocessed(self, m_get_client, m_sleep):
+        project = ProjectFactory.build()
+        unprocessed = {
+            ProjectTable.name(): [{'PutRequest': {'Item': ProjectTable.model_to_ddb(project)}}]
+        }
+        m_batch_write = m_get_client.return_value.batch_write_item
+        m_batch_write.side_effect = [{'UnprocessedItems': unprocessed}, {'UnprocessedItems': {}}]
+
+        ProjectTable.batch_put([project])
+
+        assert m_batch_write.call_count == 2
+        assert m_batch_write.call_args.kwargs == {'RequestItems': unprocessed}
+        m_sleep.assert_called_once()
+
+    @mock.patch('critic.libs.ddb.time.sleep')
+    @mock.patch('critic.libs.ddb.get_client')
+    def test_gives_up_on_unprocessed(self, m_get_client, m_sleep):
+        project = ProjectFactory.build()
+        unprocessed = {
+            ProjectTable.name(): [{'PutRequest': {'Item': ProjectTable.model_to_ddb(project)}}]
+        }
+        m_get_client.return_value.batch_write_item.return_value = {'UnprocessedItems': unprocessed}
+
+        with pytest.raises(UnprocessedItemsError, match='1 items were still unprocessed'):
+            ProjectTable.batch_put([project])
+
+
+class TestModelCodec:
+    @staticmethod
+    def slow_path(inst) -> dict:
+        return serialize(inst.model_dump(mode='json', exclude_none=True))
+
+    @pytest.mark.parametrize('factory', [ProjectFactory, UptimeMonitorFactory, UptimeLogFactory])
+    def test_matches_serializer(self, factory):
+        for inst in factory.batch(50):
+            assert model_codec(type(inst)).encode(inst) == self.slow_path(inst)
+
+    def test_edge_values(self):
+        monitor = UptimeMonitorFactory.build(
+            assertions=['status_code == 200', "body contains 'OK'"],
+            # Int default for a float field, and a float that str() renders in exponent form
+            timeout_secs=5,
+        )
+        log = UptimeLogFactory.build(
+            timestamp='2026-01-01 12:00:00.5+04:00',
+            latency_secs=1e-7,
+            resp_code=None,
+        )
+        for inst in (monitor, log):
+            assert model_codec(type(inst)).encode(inst) == self.slow_path(inst)
+
+    @pytest.mark.parametrize('factory', [ProjectFactory, UptimeMonitorFactory, UptimeLogFactory])
+    def test_trusted_decode_matches_validation(self, factory):
+        codec = model_codec(factory.__model__)
+        for inst in factory.batch(50):
+            item = codec.encode(inst)
+            decoded = codec.decode(item)
+            assert decoded == inst
+            assert decoded == codec.decode(item, validate=True)
+
+    def test_decode_falls_back_to_validation(self):
+        monitor = UptimeMonitorFactory.build()
+        item = model_codec(UptimeMonitorModel).encode(monitor)
+        # Pretend an older version of Critic stored this attribute as a string
+        item['frequency_mins'] = {'S': str(monitor.frequency_mins)}
+        assert model_codec(UptimeMonitorModel).decode(item) == monitor
+
+    @pytest.mark.parametrize('validate_reads', [True, False])
+    def test_table_validate_reads(self, monkeypatch, validate_reads):
+        monkeypatch.setattr(UptimeMonitorTable, 'validate_reads', validate_reads)
+        monitor = UptimeMonitorFactory.put()
+        codec = model_codec(UptimeMonitorModel)
+        with mock.patch.object(codec, 'construct', wraps=codec.construct) as m_construct:
+            assert UptimeMonitorTable.get(monitor.project_id, monitor.slug) == monitor
+        assert m_construct.called is not validate_reads
+
+
+class TestCascadeDelete:
+    def test_resume_from_checkpoint(self):
+        project = ProjectFactory.put()
+        monitors = UptimeMonitorFactory.batch(5, project_id=project.id)
+        UptimeMonitorTable.batch_put(monitors)
+        UptimeLogTable.batch_put(
+            log for m in monitors for log in UptimeLogFactory.batch(3, monitor_id=m.id)
+        )
+        keep = UptimeMonitorFactory.put()
+
+        # A deadline in the past stops the job after every page.
+        checkpoints = []
+        checkpoint = None
+        while True:
+            job = CascadeDelete(ProjectTable, project.id, checkpoint=checkpoint, page_size=2)
+            checkpoint = job.run(deadline=0)
+            if checkpoint is None:
+                break
+            checkpoints.append(checkpoint)
+
+        assert len(checkpoints) == 2
+        assert ProjectTable.get(project.id) is None
+        assert UptimeMonitorTable.query(project.id) == []
+        for m in monitors:
+            assert UptimeLogTable.query(m.id) == []
+        assert UptimeMonitorTable.get(keep.project_id, keep.slug) == keep
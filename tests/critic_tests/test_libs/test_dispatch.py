@@ -0,0 +1,338 @@
+from datetime import UTC, datetime
+import logging
+import time
+
+from freezegun import freeze_time
+import httpx
+
+from critic.libs import dispatch
+from critic.libs.testing import ProjectFactory, UptimeMonitorFactory
+from critic.models import MonitorState
+from critic.tables import UptimeMonitorTable
+
+
+class TestChunkMonitors:
+    def test_chunk_size(self):
+        monitors = UptimeMonitorFactory.batch(5)
+        chunks = list(dispatch.chunk_monitors(monitors, max_size=2))
+        assert [len(chunk) for chunk in chunks] == [2, 2, 1]
+        assert [UptimeMonitorTable.ddb_to_model(item) for c in chunks for item in c] == monitors
+
+    def test_chunk_bytes(self):
+        monitors = UptimeMonitorFactory.batch(4, assertions=['status_code == 200'] * 50)
+        one_item = len(dispatch.json.dumps(UptimeMonitorTable.model_to_ddb(monitors[0])))
+        chunks = list(dispatch.chunk_monitors(monitors, max_size=100, max_bytes=one_item * 2.5))
+        assert [len(chunk) for chunk in chunks] == [2, 2]
+
+    def test_same_host_together(self):
+        monitors = UptimeMonitorFactory.batch(5)
+        same_host = [
+            UptimeMonitorFactory.build(url=f'https://example.com/{path}')
+            for path in ('a', 'b', 'a')
+        ]
+        # Apart in the due order, and the first chunk has room for only two more
+        monitors = [*monitors[:2], same_host[0], *monitors[2:], same_host[1], same_host[2]]
+
+        chunks = list(dispatch.chunk_monitors(monitors, max_size=4))
+
+        hosts = [[httpx.URL(item['url']['S']).host for item in chunk] for chunk in chunks]
+        assert [len(c) for c in hosts] == [2, 4, 2]
+        assert hosts[1].count('example.com') == 3
+        # Same URL next to each other
+        urls = [item['url']['S'] for item in chunks[1] if 'example.com' in item['url']['S']]
+        assert urls == sorted(urls)
+
+    def test_oversized_monitor_gets_own_chunk(self):
+        monitors = UptimeMonitorFactory.batch(2)
+        chunks = list(dispatch.chunk_monitors(monitors, max_size=100, max_bytes=1))
+        assert [len(chunk) for chunk in chunks] == [1, 1]
+
+
+class TestInvokeAll:
+    def test_invokes_each(self):
+        calls = []
+        succeeded = dispatch.invoke_all(
+            lambda *args: calls.append(args), [(i, 'a') for i in range(50)]
+        )
+        assert succeeded == 50
+        assert sorted(calls) == [(i, 'a') for i in range(50)]
+
+    def test_failures_logged(self, caplog):
+        caplog.set_level(logging.ERROR)
+
+        def invoke(i):
+            if i % 2:
+                raise RuntimeError('throttled')
+
+        assert dispatch.invoke_all(invoke, [(i,) for i in range(10)], concurrency=3) == 5
+        assert caplog.text.count('Task invoke failed') == 5
+
+
+class TestReleaseSlices:
+    start = datetime(2026, 1, 1, 12, tzinfo=UTC)
+
+    def test_offsets_stable_and_in_range(self):
+        monitors = UptimeMonitorFactory.batch(50)
+        offsets = [dispatch.monitor_offset_secs(m, 30) for m in monitors]
+        assert offsets == [dispatch.monitor_offset_secs(m, 30) for m in monitors]
+        assert all(0 <= offset < 30 for offset in offsets)
+        # Spread out, not bunched up
+        assert len({int(offset // 5) for offset in offsets}) == 6
+        # Monitors of the same host go out together
+        same_host = [
+            UptimeMonitorFactory.build(url=f'https://example.com/{path}') for path in ('a', 'b')
+        ]
+        assert len({dispatch.monitor_offset_secs(m, 30) for m in same_host}) == 1
+
+    def test_slices_released_on_offsets(self):
+        monitors = UptimeMonitorFactory.batch(100)
+        sleeps = []
+
+        with freeze_time(self.start, tick=False) as frozen:
+
+            def sleep(secs):
+                sleeps.append(secs)
+                frozen.tick(secs)
+
+            slices = list(
+                dispatch.release_slices(monitors, self.start, spread=20, slice_len=2, sleep=sleep)
+            )
+
+        assert sorted(m.slug for s in slices for m in s) == sorted(m.slug for m in monitors)
+        for monitors_slice in slices:
+            slice_nums = {dispatch.monitor_offset_secs(m, 20) // 2 for m in monitors_slice}
+            assert len(slice_nums) == 1
+        # Each slice waits for its own start
+        assert sum(sleeps) == 2 * (len(slices) - 1)
+        assert all(secs % 2 == 0 for secs in sleeps)
+
+    def test_slices_go_out_while_reading(self):
+        monitors = UptimeMonitorFactory.batch(40)
+        sleeps = []
+
+        with freeze_time(self.start, tick=False) as frozen:
+
+            def slow_read():
+                # Reading takes as long as the spread
+                for monitor in monitors:
+                    yield monitor
+                    frozen.tick(0.5)
+
+            released = [
+                (time.time() - self.start.timestamp(), monitors_slice)
+                for monitors_slice in dispatch.release_slices(
+                    slow_read(), self.start, spread=20, sleep=sleeps.append
+                )
+            ]
+
+        assert sorted(m.slug for _, s in released for m in s) == sorted(m.slug for m in monitors)
+        # The first slices went out before reading finished
+        assert released[0][0] < 19.5
+        for released_at, monitors_slice in released:
+            for monitor in monitors_slice:
+                slice_start = dispatch.monitor_offset_secs(monitor, 20) // 1
+                read_at = monitors.index(monitor) * 0.5
+                # Never early, and at most a slice late (plus the gap between reads)
+                assert slice_start <= released_at <= max(slice_start, read_at) + 1.5
+
+    def test_urgent_first(self):
+        healthy = UptimeMonitorFactory.batch(10, state=MonitorState.up)
+        down = UptimeMonitorFactory.build(state=MonitorState.down)
+        failing = UptimeMonitorFactory.build(state=MonitorState.up, consecutive_fails=1)
+        monitors = [down, failing, *healthy]
+
+        with freeze_time(self.start, tick=False) as frozen:
+            slices = list(
+                dispatch.release_slices(
+                    monitors, self.start, spread=20, sleep=frozen.tick, urgent_first=True
+                )
+            )
+
+        assert slices[0][:2] == [down, failing]
+        # The healthy ones keep their offsets
+        for monitors_slice in slices:
+            healthy_slices = {
+                dispatch.monitor_offset_secs(m, 20) // 1 for m in monitors_slice if m in healthy
+            }
+            assert len(healthy_slices) <= 1
+
+    def test_late_start_doesnt_wait(self):
+        monitors = UptimeMonitorFactory.batch(20)
+        sleeps = []
+        with freeze_time('2026-01-01 12:00:30', tz_offset=0):
+            slices = list(
+                dispatch.release_slices(monitors, self.start, spread=20, sleep=sleeps.append)
+            )
+        assert sum(len(s) for s in slices) == 20
+        assert sleeps == []
+
+    def test_no_spread(self, monkeypatch):
+        monkeypatch.delenv('CRITIC_DISPATCH_SPREAD_SECS', raising=False)
+        monitors = iter(UptimeMonitorFactory.batch(3))
+        sleeps = []
+        assert list(dispatch.release_slices(monitors, self.start, sleep=sleeps.append)) == [
+            monitors
+        ]
+        assert sleeps == []
+
+    def test_spread_capped(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_DISPATCH_SPREAD_SECS', '90')
+        assert dispatch.spread_secs() == dispatch.MAX_SPREAD_SECS
+
+
+class TestPrioritize:
+    now = datetime(2026, 1, 1, 12, tzinfo=UTC)
+
+    def monitors(self):
+        return {
+            'up-overdue': UptimeMonitorFactory.build(
+                state=MonitorState.up, next_due_at='2026-01-01 11:50:00Z'
+            ),
+            'up': UptimeMonitorFactory.build(
+                state=MonitorState.up, next_due_at='2026-01-01 11:59:00Z'
+            ),
+            'paused': UptimeMonitorFactory.build(
+                state=MonitorState.paused, next_due_at='2026-01-01 11:50:00Z'
+            ),
+            'failing-far': UptimeMonitorFactory.build(
+                state=MonitorState.up,
+                consecutive_fails=1,
+                failures_before_alerting=5,
+                next_due_at='2026-01-01 11:59:00Z',
+            ),
+            'failing-near': UptimeMonitorFactory.build(
+                state=MonitorState.up,
+                consecutive_fails=2,
+                failures_before_alerting=3,
+                next_due_at='2026-01-01 11:59:00Z',
+            ),
+            'down': UptimeMonitorFactory.build(
+                state=MonitorState.down, next_due_at='2026-01-01 12:00:00Z'
+            ),
+        }
+
+    def names(self, monitors, result):
+        by_id = {m.id: name for name, m in monitors.items()}
+        return [by_id[m.id] for m in result]
+
+    def due(self, monitors):
+        return sorted(monitors.values(), key=lambda m: m.next_due_at)
+
+    def test_keeping_up(self):
+        monitors = self.monitors()
+        due = iter(self.due(monitors))
+        result, by_priority = dispatch.prioritize(due, self.now, capacity=0, lag_secs=3600)
+        # Lazy and in the order given
+        assert not by_priority
+        assert not isinstance(result, list)
+        assert list(result) == self.due(monitors)
+
+    def test_behind_orders_by_priority(self, caplog):
+        monitors = self.monitors()
+        result, by_priority = dispatch.prioritize(
+            self.due(monitors), self.now, capacity=0, lag_secs=300
+        )
+        assert by_priority
+        assert self.names(monitors, result) == [
+            'down',
+            'failing-near',
+            'failing-far',
+            'up-overdue',
+            'up',
+            'paused',
+        ]
+        assert 'Behind schedule by 600s' in caplog.text
+
+    def test_over_capacity_defers(self, caplog):
+        caplog.set_level(logging.INFO)
+        monitors = self.monitors()
+        result, by_priority = dispatch.prioritize(
+            self.due(monitors), self.now, capacity=3, lag_secs=3600
+        )
+        assert by_priority
+        assert self.names(monitors, result) == ['down', 'failing-near', 'failing-far']
+        # One line for all of them
+        (record,) = [r for r in caplog.records if 'Deferr' in r.message]
+        project_ids = {str(monitors[name].project_id) for name in ('up-overdue', 'up', 'paused')}
+        assert record.message.startswith(
+            'Deferring 3 checks (overloaded: 6 checks due, capacity 3, lag 600s), '
+            'by state: up 2, paused 1; by project: '
+        )
+        assert all(f'{pid} 1' in record.message for pid in project_ids)
+
+    def test_fair_shares_capacity(self):
+        big = ProjectFactory.put(check_share=2)
+        small = ProjectFactory.put()
+        big_monitors = UptimeMonitorFactory.batch(
+            6, project_id=big.id, next_due_at='2026-01-01 11:50:00Z'
+        )
+        small_monitors = UptimeMonitorFactory.batch(
+            3, project_id=small.id, next_due_at='2026-01-01 11:59:00Z'
+        )
+        down = UptimeMonitorFactory.build(
+            project_id=big.id, state=MonitorState.down, next_due_at='2026-01-01 11:59:00Z'
+        )
+
+        result, _ = dispatch.prioritize(
+            [*big_monitors, *small_monitors, down], self.now, capacity=4, lag_secs=3600, fair=True
+        )
+
+        # Priority tiers still come first, then the rest of the capacity goes by share
+        assert result[0] == down
+        assert [m.project_id for m in result[1:]].count(big.id) == 2
+        assert [m.project_id for m in result[1:]].count(small.id) == 1
+
+    def test_unfair_capacity(self):
+        big, small = ProjectFactory.batch(2)
+        big_monitors = UptimeMonitorFactory.batch(
+            4, project_id=big.id, next_due_at='2026-01-01 11:50:00Z'
+        )
+        small_monitor = UptimeMonitorFactory.build(
+            project_id=small.id, next_due_at='2026-01-01 11:59:00Z'
+        )
+
+        result, _ = dispatch.prioritize(
+            [*big_monitors, small_monitor], self.now, capacity=3, lag_secs=3600, fair=False
+        )
+
+        # The most overdue win, whichever project they're from
+        assert result == big_monitors[:3]
+
+    def test_under_capacity(self):
+        monitors = self.monitors()
+        result, by_priority = dispatch.prioritize(
+            self.due(monitors), self.now, capacity=10, lag_secs=3600
+        )
+        assert not by_priority
+        assert result == self.due(monitors)
+
+    def test_nothing_due(self):
+        assert dispatch.prioritize(iter([]), self.now, capacity=1) == ([], False)
+
+
+class TestFairOrder:
+    def test_interleaves_projects(self):
+        big, small = ProjectFactory.batch(2)
+        big_monitors = UptimeMonitorFactory.batch(6, project_id=big.id)
+        small_monitors = UptimeMonitorFactory.batch(2, project_id=small.id)
+
+        ordered = list(dispatch.fair_order([*big_monitors, *small_monitors], shares={}))
+
+        assert [m.project_id for m in ordered[:4]] == [big.id, small.id, big.id, small.id]
+        # Each project's monitors keep their order
+        assert [m for m in ordered if m.project_id == big.id] == big_monitors
+
+    def test_shares(self):
+        heavy = ProjectFactory.put(check_share=3)
+        light = ProjectFactory.put()
+        monitors = [
+            *UptimeMonitorFactory.batch(6, project_id=heavy.id),
+            *UptimeMonitorFactory.batch(6, project_id=light.id),
+        ]
+
+        ordered = list(dispatch.fair_order(monitors))
+
+        first = [m.project_id for m in ordered[:8]]
+        assert first.count(heavy.id) == 6
+        assert first.count(light.id) == 2
+        assert len(ordered) == 12
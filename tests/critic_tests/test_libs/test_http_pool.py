@@ -0,0 +1,86 @@
+import asyncio
+from unittest import mock
+
+from critic.libs.http_pool import ClientPool, http2_enabled, new_async_client
+
+
+class TestClientPool:
+    def test_reuses_client_per_origin(self):
+        pool = ClientPool()
+        with pool.hold('https://example.com/health') as client:
+            pass
+        with pool.hold('https://example.com/other') as other:
+            assert other is client
+        with pool.hold('https://example.com:8443/health') as other:
+            assert other is not client
+        with pool.hold('http://example.com/health') as other:
+            assert other is not client
+        pool.close()
+
+    def test_evicts_least_recently_used(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_HTTP_MAX_HOSTS', '2')
+        pool = ClientPool()
+        with pool.hold('https://one.example.com') as first:
+            pass
+        with pool.hold('https://two.example.com') as second:
+            pass
+        # Using the first client makes the second the least recently used.
+        with pool.hold('https://one.example.com'), pool.hold('https://three.example.com'):
+            pass
+
+        assert second.is_closed
+        assert not first.is_closed
+        with pool.hold('https://one.example.com') as client:
+            assert client is first
+        pool.close()
+        assert first.is_closed
+
+    def test_evicted_client_closed_after_use(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_HTTP_MAX_HOSTS', '1')
+        pool = ClientPool()
+        with pool.hold('https://one.example.com') as first:
+            with (
+                pool.hold('https://one.example.com'),
+                pool.hold('https://two.example.com') as second,
+            ):
+                # Evicted, but still in use
+                assert not first.is_closed
+            assert not first.is_closed
+        assert first.is_closed
+
+        with pool.hold('https://three.example.com'):
+            pass
+        assert second.is_closed
+        pool.close()
+
+    def test_keepalive_config(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_HTTP_KEEPALIVE_PER_HOST', '3')
+        monkeypatch.setenv('CRITIC_HTTP_KEEPALIVE_EXPIRY_SECS', '5')
+        pool = ClientPool()
+        with pool.hold('https://example.com') as client:
+            transport_pool = client._transport._pool
+        assert transport_pool._max_keepalive_connections == 3
+        assert transport_pool._keepalive_expiry == 5
+        pool.close()
+
+
+class TestNewAsyncClient:
+    def test_sized_for_concurrency(self):
+        client = new_async_client(max_connections=150)
+        transport_pool = client._transport._pool
+        assert transport_pool._max_connections == 150
+        assert transport_pool._max_keepalive_connections == 150
+        asyncio.run(client.aclose())
+
+
+class TestHttp2Enabled:
+    def test_off_by_default(self):
+        assert not http2_enabled()
+
+    @mock.patch('critic.libs.http_pool.importlib.util.find_spec')
+    def test_needs_h2(self, m_find_spec, monkeypatch):
+        monkeypatch.setenv('CRITIC_HTTP2', '1')
+        m_find_spec.return_value = None
+        assert not http2_enabled()
+        m_find_spec.return_value = object()
+        assert http2_enabled()
@@ -1,15 +1,20 @@
-from datetime import UTC, datetime
+import asyncio
+from datetime import UTC, datetime, timedelta
+import gzip
 import logging
+from unittest import mock
 
 from freezegun import freeze_time
 import httpx
 import pytest
+from pytest_httpx import IteratorStream
 
-from critic.libs.assertions import Assertion
-from critic.libs.testing import UptimeMonitorFactory
-from critic.libs.uptime import MonitorNotFoundError, UptimeCheck
+from critic.libs import http_pool
+from critic.libs.assertions import Assertion, evaluate_all
+from critic.libs.testing import ProjectFactory, UptimeMonitorFactory
+from critic.libs.uptime import MonitorNotFoundError, UptimeCheck, run_batch
 from critic.models import MonitorState, UptimeLogModel, UptimeMonitorModel
-from critic.tables import UptimeLogTable, UptimeMonitorTable
+from critic.tables import UptimeLogRingTable, UptimeLogTable, UptimeMonitorTable
 
 
 class TestUptimeCheck:
@@ -54,6 +59,65 @@ class TestUptimeCheck:
         logs = UptimeLogTable.query(monitor.id)
         assert len(logs) == 0
 
+    def test_claim_lost_skips_request(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_CLAIM_CHECKS', '1')
+        monitor = UptimeMonitorFactory.put(next_due_at='2026-02-10 11:50:00Z')
+        check = UptimeCheck(str(monitor.project_id), monitor.slug)
+        # Claimed by a check that started after this one loaded the monitor
+        UptimeMonitorTable.update(
+            monitor.project_id, monitor.slug, updates={'next_due_at': '2026-02-10 11:52:00Z'}
+        )
+
+        # No response is mocked, so a request would fail the test
+        check.run()
+
+        monitor = UptimeMonitorTable.get(monitor.project_id, monitor.slug)
+        assert monitor.next_due_at == datetime(2026, 2, 10, 11, 52, tzinfo=UTC)
+        assert UptimeLogTable.query(monitor.id) == []
+
+    def test_claim_then_update(self, httpx_mock, monkeypatch):
+        monkeypatch.setenv('CRITIC_CLAIM_CHECKS', '1')
+        httpx_mock.add_response()
+        monitor = UptimeMonitorFactory.put(next_due_at='2026-02-10 11:50:00Z', frequency_mins=5)
+        updates = []
+        update = UptimeMonitorTable.update
+
+        def spy(*args, **kwargs):
+            updates.append(kwargs['updates']['next_due_at'])
+            return update(*args, **kwargs)
+
+        with (
+            freeze_time('2026-02-10 11:50:05', tz_offset=0),
+            mock.patch.object(UptimeMonitorTable, 'update', spy),
+        ):
+            UptimeCheck(str(monitor.project_id), monitor.slug).run()
+
+        # Leased until 11:52, then moved on by the frequency from when it was due
+        assert updates == [
+            datetime(2026, 2, 10, 11, 52, tzinfo=UTC),
+            datetime(2026, 2, 10, 11, 55, tzinfo=UTC),
+        ]
+        saved = UptimeMonitorTable.get(monitor.project_id, monitor.slug)
+        assert saved.next_due_at == datetime(2026, 2, 10, 11, 55, tzinfo=UTC)
+        assert saved.state == MonitorState.up
+        assert len(UptimeLogTable.query(monitor.id)) == 1
+
+    def test_crashed_claim_recovered(self, httpx_mock):
+        monitor = UptimeMonitorFactory.put(next_due_at='2026-02-10 11:50:00Z')
+        with freeze_time('2026-02-10 11:50:05', tz_offset=0):
+            assert UptimeCheck(str(monitor.project_id), monitor.slug).claim()
+            # The claim holder dies without checking. Nothing else can claim it meanwhile.
+            assert not UptimeCheck(str(monitor.project_id), monitor.slug, monitor=monitor).claim()
+
+        # Due again once the lease is up
+        with freeze_time('2026-02-10 11:52:01', tz_offset=0):
+            due = list(UptimeMonitorTable.get_due_since(datetime(2026, 2, 10, 11, 52, tzinfo=UTC)))
+            assert [m.slug for m in due] == [monitor.slug]
+            httpx_mock.add_response()
+            UptimeCheck(str(monitor.project_id), monitor.slug).run()
+
+        assert len(UptimeLogTable.query(monitor.id)) == 1
+
     def test_run_up(self, caplog, httpx_mock):
         monitor: UptimeMonitorModel = UptimeMonitorFactory.put(
             consecutive_fails=1, failures_before_alerting=2, state=MonitorState.up
@@ -219,3 +283,399 @@ class TestUptimeCheck:
             datetime(2026, 2, 1, 12, 2, 0, tzinfo=UTC),
             datetime(2026, 2, 1, 12, 3, 0, tzinfo=UTC),
         ]
+
+    @pytest.mark.parametrize('layout', ['table', 'ring'])
+    def test_transact_commit(self, monkeypatch, httpx_mock, layout):
+        monkeypatch.setenv('CRITIC_TRANSACT_COMMIT', '1')
+        monkeypatch.setenv('CRITIC_LOG_LAYOUT', layout)
+        monkeypatch.setattr(UptimeLogTable, 'retention_limit', 3)
+        monkeypatch.setattr(UptimeLogRingTable, 'retention_limit', 3)
+        monitor: UptimeMonitorModel = UptimeMonitorFactory.put(
+            next_due_at='2026-02-01 12:00:00Z',
+            frequency_mins=1,
+        )
+
+        # The update and log only go out together
+        with (
+            mock.patch.object(UptimeMonitorTable, 'update', side_effect=AssertionError),
+            mock.patch.object(UptimeLogTable, 'put', side_effect=AssertionError),
+            mock.patch.object(UptimeLogRingTable, 'put', side_effect=AssertionError),
+        ):
+            for minute in range(4):
+                current = datetime(2026, 2, 1, 12, minute, 0, tzinfo=UTC)
+                httpx_mock.add_response()
+                with freeze_time(current):
+                    UptimeCheck(str(monitor.project_id), monitor.slug).run()
+
+        monitor = UptimeMonitorTable.get(monitor.project_id, monitor.slug)
+        assert monitor.next_due_at == datetime(2026, 2, 1, 12, 4, tzinfo=UTC)
+        assert monitor.state == MonitorState.up
+        if layout == 'ring':
+            logs = list(UptimeLogRingTable.logs(monitor.id))
+        else:
+            logs = UptimeLogTable.query(monitor.id)
+        assert [log.timestamp.minute for log in logs] == [1, 2, 3]
+
+    def test_transact_commit_race(self, monkeypatch, httpx_mock):
+        monkeypatch.setenv('CRITIC_TRANSACT_COMMIT', '1')
+        monitor = UptimeMonitorFactory.put(next_due_at='2026-02-10 11:50:00Z')
+        check = UptimeCheck(str(monitor.project_id), monitor.slug)
+        UptimeMonitorTable.update(
+            monitor.project_id, monitor.slug, updates={'next_due_at': '2026-02-10 12:00:00Z'}
+        )
+
+        httpx_mock.add_response(status_code=500)
+        with mock.patch('critic.libs.uptime.maybe_send_alerts') as m_alerts:
+            check.run()
+
+        m_alerts.assert_not_called()
+        assert check.saved_updates is None
+        saved = UptimeMonitorTable.get(monitor.project_id, monitor.slug)
+        assert saved.next_due_at == datetime(2026, 2, 10, 12, tzinfo=UTC)
+        assert saved.state == monitor.state
+        assert UptimeLogTable.query(monitor.id) == []
+
+    def test_log_ring_layout(self, monkeypatch, httpx_mock):
+        monkeypatch.setenv('CRITIC_LOG_LAYOUT', 'ring')
+        monkeypatch.setattr(UptimeLogRingTable, 'retention_limit', 3)
+        monitor: UptimeMonitorModel = UptimeMonitorFactory.put(
+            next_due_at='2026-02-01 12:00:00Z',
+            frequency_mins=1,
+        )
+
+        with mock.patch.object(UptimeLogTable, 'prune') as m_prune:
+            for minute in range(5):
+                current = datetime(2026, 2, 1, 12, minute, 0, tzinfo=UTC)
+                httpx_mock.add_response()
+                with freeze_time(current):
+                    UptimeCheck(str(monitor.project_id), monitor.slug).run()
+        m_prune.assert_not_called()
+
+        monitor = UptimeMonitorTable.get(monitor.project_id, monitor.slug)
+        assert monitor.log_counter == 5
+        assert UptimeLogTable.query(monitor.id) == []
+        # Minutes 3 and 4 overwrote slots 0 and 1
+        logs = list(UptimeLogRingTable.logs(monitor.id))
+        assert [(log.slot, log.timestamp.minute) for log in logs] == [(2, 2), (0, 3), (1, 4)]
+        newest = list(UptimeLogRingTable.logs(monitor.id, newest_first=True, Limit=1))
+        assert [log.timestamp.minute for log in newest] == [4]
+
+        UptimeMonitorTable.delete(monitor.project_id, monitor.slug)
+        assert UptimeLogRingTable.query(monitor.id) == []
+
+    @pytest.mark.parametrize('cold_connection', [True, False])
+    def test_connection_reuse(self, httpx_mock, cold_connection):
+        monitor = UptimeMonitorFactory.put(cold_connection=cold_connection)
+        httpx_mock.add_response()
+        httpx_mock.add_response()
+
+        clients = []
+        new_client = http_pool.pool.new_client
+
+        def track_new_client():
+            clients.append(new_client())
+            return clients[-1]
+
+        with mock.patch.object(http_pool.pool, 'new_client', side_effect=track_new_client):
+            UptimeCheck(str(monitor.project_id), monitor.slug).make_req()
+            UptimeCheck(str(monitor.project_id), monitor.slug).make_req()
+
+        assert len(clients) == (2 if cold_connection else 1)
+        assert clients[0].is_closed is cold_connection
+
+
+class TestBodyReads:
+    def test_head_without_body_assertions(self, httpx_mock):
+        httpx_mock.add_response(method='HEAD')
+        monitor = UptimeMonitorFactory.put(assertions=['status_code == 200'])
+
+        resp, _latency = UptimeCheck(str(monitor.project_id), monitor.slug).make_req()
+        assert resp.status_code == 200
+
+    def test_get_with_body_assertions(self, httpx_mock):
+        httpx_mock.add_response(method='GET', text='<h1>Welcome</h1>')
+        monitor = UptimeMonitorFactory.put(
+            state=MonitorState.down, assertions=['body contains "Welcome"']
+        )
+
+        UptimeCheck(str(monitor.project_id), monitor.slug).run()
+        assert UptimeMonitorTable.get(monitor.project_id, monitor.slug).state == MonitorState.up
+
+    @pytest.mark.parametrize(
+        ('assertions', 'chunks_read'),
+        [
+            # Decided once "Welcome" is in, even though it spans two chunks
+            (['body contains "Welcome"', 'body matches "W[a-z]+"'], 2),
+            # not_contains passes only once the whole body has been read
+            (['body contains "Welcome"', 'body not_contains "Error"'], 10),
+        ],
+    )
+    def test_stops_reading_when_decided(self, httpx_mock, assertions, chunks_read):
+        read = []
+
+        def body():
+            for i in range(10):
+                read.append(i)
+                yield [b'<h1>Wel', b'come</h1>', b' <p>'][i] if i < 3 else b'...'
+
+        httpx_mock.add_response(method='GET', stream=IteratorStream(body()))
+        monitor = UptimeMonitorFactory.put(assertions=assertions)
+
+        resp, _latency = UptimeCheck(str(monitor.project_id), monitor.slug).make_req()
+        assert len(read) == chunks_read
+        assert resp.text.startswith('<h1>Welcome</h1>')
+
+    def test_json_assertions(self, httpx_mock):
+        httpx_mock.add_response(method='GET', json={'status': 'ok'})
+        monitor = UptimeMonitorFactory.put(
+            assertions=['json status == ok', 'header content-type == application/json']
+        )
+
+        UptimeCheck(str(monitor.project_id), monitor.slug).run()
+        assert UptimeMonitorTable.get(monitor.project_id, monitor.slug).state == MonitorState.up
+
+    def test_conditional_get(self, httpx_mock):
+        monitor = UptimeMonitorFactory.put(
+            next_due_at='2026-02-01 12:00:00Z',
+            assertions=['status_code == 200', 'body contains "Welcome"', 'body contains "Error"'],
+        )
+        headers = {'ETag': '"v1"', 'Last-Modified': 'Sun, 01 Feb 2026 11:00:00 GMT'}
+        httpx_mock.add_response(method='GET', text='Welcome', headers=headers)
+        httpx_mock.add_response(
+            method='GET',
+            status_code=304,
+            match_headers={
+                'If-None-Match': '"v1"',
+                'If-Modified-Since': 'Sun, 01 Feb 2026 11:00:00 GMT',
+            },
+        )
+
+        logs = []
+        for minute in range(2):
+            with freeze_time(datetime(2026, 2, 1, 12, minute, 0, tzinfo=UTC)):
+                UptimeCheck(str(monitor.project_id), monitor.slug).run()
+            logs.append(UptimeLogTable.query(monitor.id)[-1])
+            monitor = UptimeMonitorTable.get(monitor.project_id, monitor.slug)
+            assert monitor.body_cache.etag == '"v1"'
+            assert monitor.body_cache.results['body contains "Welcome"'] is None
+
+        # The 304 reused the body results (including the failure) and the status it stands in for
+        assert [log.resp_code for log in logs] == [200, 304]
+        assert logs[0].error_message == logs[1].error_message
+        assert len(logs[1].error_message) == 1
+
+    def test_conditional_get_needs_cached_results(self, httpx_mock):
+        monitor = UptimeMonitorFactory.put(assertions=['body contains "Welcome"'])
+        httpx_mock.add_response(method='GET', text='Welcome', headers={'ETag': '"v1"'})
+        UptimeCheck(str(monitor.project_id), monitor.slug).run()
+        monitor = UptimeMonitorTable.get(monitor.project_id, monitor.slug)
+        assert UptimeCheck(str(monitor.project_id), monitor.slug).conditional_headers() == {
+            'If-None-Match': '"v1"'
+        }
+
+        # A new assertion has no cached result, so the content has to be fetched again
+        monitor.assertions.append(Assertion(assertion_string='json ok == true'))
+        check = UptimeCheck(str(monitor.project_id), monitor.slug, monitor=monitor)
+        assert check.conditional_headers() == {}
+
+    def test_max_body_bytes(self, httpx_mock, monkeypatch):
+        monkeypatch.setenv('CRITIC_MAX_BODY_BYTES', '100')
+        httpx_mock.add_response(method='GET', text='x' * 200 + 'Welcome')
+        monitor = UptimeMonitorFactory.put(assertions=['body contains "Welcome"'])
+
+        resp, _latency = UptimeCheck(str(monitor.project_id), monitor.slug).make_req()
+        assert resp.text == 'x' * 100
+
+    def test_decodes_charset(self, httpx_mock):
+        httpx_mock.add_response(
+            method='GET',
+            content='Prüfung bestanden'.encode('latin-1'),
+            headers={'Content-Type': 'text/html; charset=latin-1'},
+        )
+        monitor = UptimeMonitorFactory.put(assertions=['body contains "Prüfung"'])
+
+        resp, _latency = UptimeCheck(str(monitor.project_id), monitor.slug).make_req()
+        assert evaluate_all(monitor.assertions, resp) == [(True, None)]
+
+    def test_keeps_content_encoding(self, httpx_mock):
+        httpx_mock.add_response(
+            method='GET',
+            stream=IteratorStream([gzip.compress(b'Welcome')]),
+            headers={'Content-Encoding': 'gzip', 'Content-Type': 'text/html'},
+        )
+        monitor = UptimeMonitorFactory.put(
+            assertions=['body contains "Welcome"', 'header content-encoding == gzip']
+        )
+
+        resp, _latency = UptimeCheck(str(monitor.project_id), monitor.slug).make_req()
+        assert resp.text == 'Welcome'
+        assert evaluate_all(monitor.assertions, resp) == [(True, None), (True, None)]
+
+    def test_async_get(self, httpx_mock):
+        httpx_mock.add_response(method='GET', text='all systems go')
+        httpx_mock.add_response(method='HEAD')
+        with_body = UptimeMonitorFactory.build(assertions=['body contains "go"'])
+        without_body = UptimeMonitorFactory.build()
+        UptimeMonitorTable.batch_put([with_body, without_body])
+
+        run_batch([with_body, without_body])
+        for m in (with_body, without_body):
+            assert UptimeMonitorTable.get(m.project_id, m.slug).state == MonitorState.up
+
+
+class TestRunBatch:
+    def test_runs_checks(self, httpx_mock):
+        httpx_mock.add_response(is_reusable=True)
+        monitors = UptimeMonitorFactory.batch(5, state=MonitorState.new)
+        monitors.append(UptimeMonitorFactory.build(state=MonitorState.paused))
+        UptimeMonitorTable.batch_put(monitors)
+
+        with mock.patch.object(UptimeMonitorTable, 'get') as m_get:
+            run_batch(monitors)
+        # The monitors were passed in, so they aren't loaded again.
+        m_get.assert_not_called()
+
+        for m in monitors:
+            updated = UptimeMonitorTable.get(m.project_id, m.slug)
+            assert updated.next_due_at > m.next_due_at
+            logs = UptimeLogTable.query(m.id)
+            if m.state == MonitorState.paused:
+                assert updated.state == MonitorState.paused
+                assert logs == []
+            else:
+                assert updated.state == MonitorState.up
+                assert len(logs) == 1
+        assert len(httpx_mock.get_requests()) == 5
+
+    def test_coalesces_requests(self, httpx_mock):
+        url = 'https://example.com/health'
+        httpx_mock.add_response(method='GET', url=url, text='Welcome home')
+        httpx_mock.add_response(method='HEAD', url=url)
+        same_url = [
+            UptimeMonitorFactory.build(url=url, assertions=['body contains "Welcome"']),
+            UptimeMonitorFactory.build(url=url, assertions=['body contains "home"']),
+            UptimeMonitorFactory.build(url=url, assertions=['body contains "Missing"']),
+            # Needs no body, so HEAD instead
+            UptimeMonitorFactory.build(url=url),
+        ]
+        UptimeMonitorTable.batch_put(same_url)
+
+        run_batch(same_url)
+
+        assert [r.method for r in httpx_mock.get_requests()] == ['GET', 'HEAD']
+        states = [UptimeMonitorTable.get(m.project_id, m.slug).state for m in same_url]
+        assert states == [MonitorState.up, MonitorState.up, MonitorState.down, MonitorState.up]
+        for m in same_url:
+            assert len(UptimeLogTable.query(m.id)) == 1
+
+    def test_host_limits(self, httpx_mock, monkeypatch):
+        monkeypatch.setenv('CRITIC_HOST_CONCURRENCY', '1')
+        monkeypatch.setenv('CRITIC_HOST_SPACING_MS', '50')
+        httpx_mock.add_response(is_reusable=True)
+        monitors = [
+            UptimeMonitorFactory.build(url=f'https://example.com/{i}', state=MonitorState.up)
+            for i in range(3)
+        ]
+        UptimeMonitorTable.batch_put(monitors)
+
+        run_batch(monitors)
+
+        # The requests went one at a time, 50ms apart, and the wait isn't counted as latency
+        logs = sorted(UptimeLogTable.query(m.id)[0].queue_secs for m in monitors)
+        assert logs[0] < 0.05
+        assert logs[1] >= 0.045
+        assert logs[2] >= 0.095
+
+    def test_coalesced_failure(self, httpx_mock, caplog):
+        httpx_mock.add_exception(httpx.ConnectError('refused'))
+        monitors = UptimeMonitorFactory.batch(2, url='https://example.com/')
+        UptimeMonitorTable.batch_put(monitors)
+
+        run_batch(monitors)
+        for m in monitors:
+            assert f'Check failed for monitor: {m.id}' in caplog.text
+
+    def test_concurrency_cap(self):
+        in_flight = 0
+        max_in_flight = 0
+
+        async def make_req_async(self, client):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.01)
+            in_flight -= 1
+            return None, 0.01
+
+        monitors = UptimeMonitorFactory.batch(10, state=MonitorState.up)
+        UptimeMonitorTable.batch_put(monitors)
+        with mock.patch.object(UptimeCheck, 'make_req_async', make_req_async):
+            run_batch(monitors, concurrency=3)
+
+        assert max_in_flight == 3
+        for m in monitors:
+            assert UptimeMonitorTable.get(m.project_id, m.slug).state == MonitorState.down
+
+    def test_project_concurrency(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_PROJECT_CONCURRENCY', '4')
+        capped = ProjectFactory.put(check_concurrency=2)
+        uncapped = ProjectFactory.put()
+        in_flight = {str(capped.id): 0, str(uncapped.id): 0}
+        max_in_flight = dict(in_flight)
+
+        async def make_req_async(self, client):
+            pid = str(self.monitor.project_id)
+            in_flight[pid] += 1
+            max_in_flight[pid] = max(max_in_flight[pid], in_flight[pid])
+            await asyncio.sleep(0.01)
+            in_flight[pid] -= 1
+            return None, 0.01
+
+        monitors = [
+            *UptimeMonitorFactory.batch(6, project_id=capped.id, state=MonitorState.up),
+            *UptimeMonitorFactory.batch(6, project_id=uncapped.id, state=MonitorState.up),
+        ]
+        UptimeMonitorTable.batch_put(monitors)
+        with mock.patch.object(UptimeCheck, 'make_req_async', make_req_async):
+            run_batch(monitors, concurrency=10)
+
+        # The project's own cap, then CRITIC_PROJECT_CONCURRENCY
+        assert max_in_flight == {str(capped.id): 2, str(uncapped.id): 4}
+
+    def test_batch_claims(self, httpx_mock, monkeypatch):
+        monkeypatch.setenv('CRITIC_CLAIM_CHECKS', '1')
+        httpx_mock.add_response(url='https://example.com/ours')
+        ours = UptimeMonitorFactory.build(url='https://example.com/ours')
+        taken = UptimeMonitorFactory.build(url='https://example.com/taken')
+        UptimeMonitorTable.batch_put([ours, taken])
+        UptimeMonitorTable.update(
+            taken.project_id,
+            taken.slug,
+            updates={'next_due_at': taken.next_due_at + timedelta(minutes=2)},
+        )
+
+        run_batch([ours, taken])
+
+        assert [str(r.url) for r in httpx_mock.get_requests()] == ['https://example.com/ours']
+        assert len(UptimeLogTable.query(ours.id)) == 1
+        assert UptimeLogTable.query(taken.id) == []
+
+    def test_failure_is_isolated(self, httpx_mock, caplog):
+        httpx_mock.add_response(is_reusable=True)
+        monitors = UptimeMonitorFactory.batch(2, state=MonitorState.new)
+        UptimeMonitorTable.batch_put(monitors)
+
+        record = UptimeCheck.record
+
+        def flaky_record(self, resp, latency):
+            if self.monitor.slug == monitors[0].slug:
+                raise RuntimeError('boom')
+            return record(self, resp, latency)
+
+        with mock.patch.object(UptimeCheck, 'record', flaky_record):
+            run_batch(monitors)
+
+        assert f'Check failed for monitor: {monitors[0].id}' in caplog.text
+        assert UptimeMonitorTable.get(monitors[1].project_id, monitors[1].slug).state == (
+            MonitorState.up
+        )
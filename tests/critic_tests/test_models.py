@@ -1,8 +1,12 @@
 from datetime import UTC, datetime
+from uuid import uuid4
 
+from pydantic import ValidationError
 import pytest
 
+from critic.libs.ddb import CONSTANT_GSI_PK
 from critic.libs.testing import UptimeMonitorFactory
+from critic.models import UptimeMonitorModel
 
 
 class TestUptimeMonitorModel:
@@ -21,3 +25,28 @@ class TestUptimeMonitorModel:
     def test_next_due_at_microsecond(self):
         with pytest.raises(ValueError, match='next_due_at must be no more precise than minutes'):
             UptimeMonitorFactory.build(next_due_at='2026-01-01 12:00:00.000001Z')
+
+    def test_gsi_pk_sharded(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_GSI_SHARDS', '8')
+        monitors = UptimeMonitorFactory.batch(50)
+        assert len({m.GSI_PK for m in monitors}) > 1
+        # Stable for the same monitor
+        for m in monitors:
+            assert (
+                UptimeMonitorFactory.build(project_id=m.project_id, slug=m.slug).GSI_PK == m.GSI_PK
+            )
+
+    def test_gsi_pk_single_shard(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_GSI_SHARDS', '1')
+        assert UptimeMonitorFactory.build().GSI_PK == CONSTANT_GSI_PK
+
+    def test_gsi_pk_invalid_slug(self):
+        with pytest.raises(ValidationError) as exc_info:
+            UptimeMonitorModel(project_id=uuid4(), slug='Not A Slug', url='https://example.com')
+        assert [e['loc'] for e in exc_info.value.errors()] == [('slug',)]
+
+    def test_gsi_pk_kept(self, monkeypatch):
+        monkeypatch.setenv('CRITIC_GSI_SHARDS', '8')
+        # Stored before sharding: stays on its key until reshard-monitors moves it
+        monitor = UptimeMonitorFactory.build(GSI_PK=CONSTANT_GSI_PK)
+        assert UptimeMonitorModel.model_validate(monitor.model_dump()).GSI_PK == CONSTANT_GSI_PK
@@ -4,9 +4,12 @@ from unittest import mock
 from freezegun import freeze_time
 import pytest
 
-from critic.libs.testing import UptimeMonitorFactory
+from critic.libs import dispatch
+from critic.libs.testing import ProjectFactory, UptimeMonitorFactory
 from critic.libs.uptime import MonitorNotFoundError
-from critic.tasks import run_checks, run_due_checks
+from critic.models import MonitorState
+from critic.tables import ProjectTable, UptimeMonitorTable
+from critic.tasks import cascade_delete, run_checks, run_checks_batch, run_due_checks
 
 
 class TestRunDueChecks:
@@ -22,6 +25,113 @@ class TestRunDueChecks:
 
         m_run_check.assert_called_once_with(str(due.project_id), due.slug)
 
+    @mock.patch('critic.tasks.run_checks_batch.invoke')
+    def test_batch_mode(self, m_invoke, monkeypatch):
+        monkeypatch.setenv('CRITIC_DISPATCH_MODE', 'batch')
+        monkeypatch.setenv('CRITIC_DISPATCH_CHUNK_SIZE', '2')
+        due = UptimeMonitorFactory.batch(5, next_due_at='2026-01-01 12:00:00Z')
+        UptimeMonitorTable.batch_put(due)
+        UptimeMonitorFactory.put(next_due_at='2026-01-01 12:01:00Z')
+
+        with freeze_time('2026-01-01 12:00:01', tz_offset=0):
+            run_due_checks()
+
+        chunks = [call.args[0] for call in m_invoke.call_args_list]
+        assert sorted(len(chunk) for chunk in chunks) == [1, 2, 2]
+        sent = [UptimeMonitorTable.ddb_to_model(item) for chunk in chunks for item in chunk]
+        assert sorted(m.slug for m in sent) == sorted(m.slug for m in due)
+
+    @mock.patch('critic.libs.dispatch.time.sleep')
+    @mock.patch('critic.tasks.run_checks.invoke')
+    def test_spread(self, m_invoke, m_sleep, monkeypatch):
+        monkeypatch.setenv('CRITIC_DISPATCH_SPREAD_SECS', '30')
+        due = UptimeMonitorFactory.batch(20, next_due_at='2026-01-01 12:00:00Z')
+        UptimeMonitorTable.batch_put(due)
+
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0):
+            run_due_checks()
+
+        assert m_invoke.call_count == 20
+        # Released a slice (CRITIC_DISPATCH_SLICE_SECS, default 1s) at a time on their offsets
+        slices = {int(dispatch.monitor_offset_secs(m, 30)) for m in due}
+        delays = [call.args[0] for call in m_sleep.call_args_list]
+        assert delays == sorted(slices - {0})
+
+    @pytest.mark.parametrize('claims', ['0', '1'])
+    @mock.patch('critic.libs.dispatch.time.sleep')
+    @mock.patch('critic.tasks.run_checks.invoke')
+    def test_spread_without_claims_warns(self, m_invoke, m_sleep, monkeypatch, caplog, claims):
+        monkeypatch.setenv('CRITIC_DISPATCH_SPREAD_SECS', '30')
+        monkeypatch.setenv('CRITIC_CLAIM_CHECKS', claims)
+
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0):
+            run_due_checks()
+
+        assert ('without CRITIC_CLAIM_CHECKS=1' in caplog.text) == (claims == '0')
+
+    @pytest.mark.parametrize('mode', ['single', 'batch'])
+    def test_host_limits_in_single_mode_warn(self, monkeypatch, caplog, mode):
+        monkeypatch.setenv('CRITIC_DISPATCH_MODE', mode)
+        monkeypatch.setenv('CRITIC_HOST_CONCURRENCY', '4')
+
+        with freeze_time('2026-01-01 12:00:00', tz_offset=0):
+            run_due_checks()
+
+        assert ('only apply with CRITIC_DISPATCH_MODE=batch' in caplog.text) == (mode == 'single')
+
+    @mock.patch('critic.tasks.run_checks.invoke')
+    def test_failed_invokes_logged(self, m_invoke, caplog):
+        caplog.set_level(logging.INFO)
+        UptimeMonitorTable.batch_put(
+            UptimeMonitorFactory.batch(3, next_due_at='2026-01-01 12:00:00Z')
+        )
+        m_invoke.side_effect = [None, RuntimeError('throttled'), None]
+
+        with freeze_time('2026-01-01 12:00:01', tz_offset=0):
+            run_due_checks()
+
+        assert 'Due checks triggered for 3 monitors' in caplog.text
+        assert '1 of 3 invokes failed' in caplog.text
+
+    @mock.patch('critic.tasks.run_checks.invoke')
+    def test_defers_over_capacity(self, m_invoke, monkeypatch):
+        monkeypatch.setenv('CRITIC_DISPATCH_CAPACITY', '1')
+        UptimeMonitorFactory.put(state=MonitorState.up, next_due_at='2026-01-01 11:58:00Z')
+        down = UptimeMonitorFactory.put(state=MonitorState.down, next_due_at='2026-01-01 12:00:00Z')
+
+        with freeze_time('2026-01-01 12:00:01', tz_offset=0):
+            run_due_checks()
+
+        m_invoke.assert_called_once_with(str(down.project_id), down.slug)
+
+    @mock.patch('critic.tasks.run_checks.invoke')
+    def test_fair_dispatch(self, m_invoke, monkeypatch):
+        monkeypatch.setenv('CRITIC_FAIR_DISPATCH', '1')
+        monkeypatch.setenv('CRITIC_DISPATCH_CAPACITY', '2')
+        big, small = ProjectFactory.batch(2)
+        UptimeMonitorTable.batch_put(
+            UptimeMonitorFactory.batch(5, project_id=big.id, next_due_at='2026-01-01 11:59:00Z')
+        )
+        UptimeMonitorFactory.put(project_id=small.id, next_due_at='2026-01-01 12:00:00Z')
+
+        with freeze_time('2026-01-01 12:00:01', tz_offset=0):
+            run_due_checks()
+
+        # Not crowded out by the big project's more overdue monitors
+        project_ids = sorted(call.args[0] for call in m_invoke.call_args_list)
+        assert project_ids == sorted([str(big.id), str(small.id)])
+
+    @mock.patch('critic.tasks.alerts.deliver_alerts.invoke')
+    @mock.patch('critic.tasks.run_checks.invoke')
+    def test_alert_sweep(self, m_invoke, m_deliver, monkeypatch):
+        with freeze_time('2026-01-01 12:00:01', tz_offset=0):
+            run_due_checks()
+            m_deliver.assert_not_called()
+
+            monkeypatch.setenv('CRITIC_ALERT_OUTBOX', '1')
+            run_due_checks()
+            m_deliver.assert_called_once_with()
+
 
 class TestRunChecks:
     @mock.patch('critic.tasks.UptimeCheck')
@@ -36,3 +146,35 @@ class TestRunChecks:
         m_uptime_check.side_effect = MonitorNotFoundError
         run_checks('6033aa47-a9f7-4d7f-b7ff-a11ba9b34474', 'my-monitor')
         assert 'not found, skipping' in caplog.text
+
+
+class TestRunChecksBatch:
+    @mock.patch('critic.tasks.run_batch')
+    def test_decodes_monitors(self, m_run_batch):
+        monitors = UptimeMonitorFactory.batch(3)
+
+        run_checks_batch([UptimeMonitorTable.model_to_ddb(m) for m in monitors])
+
+        (loaded,) = m_run_batch.call_args.args
+        assert loaded == monitors
+
+
+class TestCascadeDelete:
+    @mock.patch('critic.tasks.cascade_delete.invoke')
+    def test_reinvokes_with_checkpoint(self, m_invoke, monkeypatch):
+        monkeypatch.setattr('critic.tasks.CASCADE_DELETE_BUDGET_SECS', 0)
+        project = ProjectFactory.put()
+        UptimeMonitorTable.batch_put(UptimeMonitorFactory.batch(30, project_id=project.id))
+
+        cascade_delete('Project', str(project.id))
+        m_invoke.assert_called_once()
+        table_name, partition_value, sort_value, checkpoint = m_invoke.call_args.args
+        assert (table_name, partition_value, sort_value) == ('Project', str(project.id), None)
+        assert ProjectTable.get(project.id) is not None
+
+        # The next invocation finishes the job
+        m_invoke.reset_mock()
+        cascade_delete(table_name, partition_value, sort_value, checkpoint)
+        m_invoke.assert_not_called()
+        assert ProjectTable.get(project.id) is None
+        assert UptimeMonitorTable.query(project.id) == []
@@ -0,0 +1,132 @@
+from datetime import UTC, datetime
+from unittest import mock
+
+from botocore.exceptions import ClientError
+from freezegun import freeze_time
+
+from critic.libs.ddb import StreamNotEnabledError
+from critic.libs.testing import UptimeMonitorFactory
+from critic.models import MonitorState
+from critic.tables import UptimeMonitorTable
+from critic.worker import Worker
+
+
+def at(timestamp: str) -> datetime:
+    return datetime.fromisoformat(timestamp).replace(tzinfo=UTC)
+
+
+class TestWorker:
+    def test_runs_due_checks(self, httpx_mock):
+        httpx_mock.add_response(is_reusable=True)
+        due = UptimeMonitorFactory.batch(2, next_due_at='2026-01-01 12:00:00Z')
+        later = UptimeMonitorFactory.build(next_due_at='2026-01-01 12:05:00Z')
+        UptimeMonitorTable.batch_put([*due, later])
+
+        worker = Worker()
+        worker.load()
+        with mock.patch.object(UptimeMonitorTable, 'get_due_since') as m_due_since:
+            with freeze_time('2026-01-01 12:00:01', tz_offset=0):
+                assert worker.run_due(at('2026-01-01 12:00:01')) == 2
+                # Rescheduled from the update the checks saved
+                assert worker.run_due(at('2026-01-01 12:00:30')) == 0
+            with freeze_time('2026-01-01 12:01:01', tz_offset=0):
+                assert worker.run_due(at('2026-01-01 12:01:01')) == 2
+        m_due_since.assert_not_called()
+
+        for m in due:
+            saved = UptimeMonitorTable.get(m.project_id, m.slug)
+            assert saved.state == MonitorState.up
+            assert saved.next_due_at == at('2026-01-01 12:02:00')
+            assert worker.monitors[m.id] == saved
+        assert len(httpx_mock.get_requests()) == 4
+
+    def test_lost_race_rereads_monitor(self, httpx_mock):
+        httpx_mock.add_response()
+        monitor = UptimeMonitorFactory.put(next_due_at='2026-01-01 12:00:00Z')
+        worker = Worker()
+        worker.load()
+        # Rescheduled elsewhere after the worker loaded it
+        UptimeMonitorTable.update(
+            monitor.project_id, monitor.slug, updates={'next_due_at': at('2026-01-01 12:10:00')}
+        )
+
+        with freeze_time('2026-01-01 12:00:01', tz_offset=0):
+            assert worker.run_due(at('2026-01-01 12:00:01')) == 1
+
+        assert worker.monitors[monitor.id].next_due_at == at('2026-01-01 12:10:00')
+        assert worker.pop_due(at('2026-01-01 12:09:00')) == []
+        assert worker.pop_due(at('2026-01-01 12:10:00')) == [worker.monitors[monitor.id]]
+
+    def test_stream_picks_up_changes(self):
+        kept, deleted = UptimeMonitorFactory.batch(2, next_due_at='2026-01-01 12:00:00Z')
+        UptimeMonitorTable.batch_put([kept, deleted])
+        worker = Worker()
+        worker.load()
+
+        added = UptimeMonitorFactory.put(next_due_at='2026-01-01 12:03:00Z')
+        UptimeMonitorTable.delete(deleted.project_id, deleted.slug)
+        UptimeMonitorTable.update(
+            kept.project_id, kept.slug, updates={'next_due_at': at('2026-01-01 12:02:00')}
+        )
+        with mock.patch.object(UptimeMonitorTable, 'scan_iter') as m_scan:
+            worker.apply_changes()
+        m_scan.assert_not_called()
+
+        assert worker.monitors.keys() == {kept.id, added.id}
+        assert worker.pop_due(at('2026-01-01 12:01:00')) == []
+        assert [m.id for m in worker.pop_due(at('2026-01-01 12:03:00'))] == [kept.id, added.id]
+        # Already read
+        assert list(worker.stream.read()) == []
+
+    def test_stream_error_reloads(self):
+        monitor = UptimeMonitorFactory.put()
+        worker = Worker()
+        worker.load()
+        added = UptimeMonitorFactory.put()
+
+        error = ClientError({'Error': {'Code': 'ExpiredIteratorException'}}, 'GetRecords')
+        with mock.patch.object(worker.stream, 'read', side_effect=error):
+            worker.apply_changes()
+
+        assert worker.monitors.keys() == {monitor.id, added.id}
+
+    def test_without_stream(self, caplog):
+        monitor = UptimeMonitorFactory.put()
+        with mock.patch('critic.libs.ddb.StreamReader.__init__', side_effect=StreamNotEnabledError):
+            worker = Worker()
+            worker.load()
+
+        assert worker.stream is None
+        assert 'changes are only picked up by the scan' in caplog.text
+        worker.apply_changes()
+        assert worker.monitors.keys() == {monitor.id}
+
+    def test_refresh_picks_up_changes(self):
+        kept, deleted = UptimeMonitorFactory.batch(2, next_due_at='2026-01-01 12:00:00Z')
+        UptimeMonitorTable.batch_put([kept, deleted])
+        worker = Worker()
+        worker.load()
+
+        added = UptimeMonitorFactory.put(next_due_at='2026-01-01 12:03:00Z')
+        UptimeMonitorTable.delete(deleted.project_id, deleted.slug)
+        UptimeMonitorTable.update(
+            kept.project_id, kept.slug, updates={'next_due_at': at('2026-01-01 12:02:00')}
+        )
+        worker.refresh_step(ticks_per_pass=1)
+
+        assert worker.monitors.keys() == {kept.id, added.id}
+        assert worker.pop_due(at('2026-01-01 12:01:00')) == []
+        assert [m.id for m in worker.pop_due(at('2026-01-01 12:03:00'))] == [kept.id, added.id]
+
+    def test_refresh_rolls_over_ticks(self, monkeypatch):
+        monkeypatch.setattr('critic.worker.MIN_REFRESH_ITEMS', 1)
+        UptimeMonitorTable.batch_put(UptimeMonitorFactory.batch(4))
+        worker = Worker()
+        worker.load()
+
+        worker.refresh_step(ticks_per_pass=2)
+        assert worker.scan_cursor is not None
+        assert len(worker.scan_seen) == 2
+        worker.refresh_step(ticks_per_pass=2)
+        assert worker.scan_cursor is None
+        assert len(worker.monitors) == 4